@@ -0,0 +1,375 @@
+# benchmark.py
+# 服务器tick的基准测试
+#
+# 按场景(玩家数、分布方式、飞行中的子弹数、每tick的开火次数)构造一个GameRoom，用模拟时钟驱动
+# 房间自己的run_due_ticks()，因此每个tick执行的就是服务器中真实的_game_tick、快照发送和事件合并。
+# 客户端用进程内的回环连接(transport.py)代替：帧进入与真实连接相同的发送队列，每个tick结束后直接取出并解码，
+# 移动、开火和快照确认都作为命令放入房间的命令队列。快照在客户端的确认延迟之后才被确认，
+# 增量因此以客户端已确认的较旧版本为基准，与真实网络中存在未确认快照的情况相同。
+# 房间的各个步骤在计时包装下运行，结果以JSON输出，便于比较不同版本。
+# tick是run_due_ticks的总耗时；process_skill在apply_commands之内，broadcast是每次广播(编码并加入事件列表)的耗时，
+# 包含在调用它的步骤(process_skill、broadcast_moves等)之内；
+# client_decode是所有模拟客户端解码本tick收到的帧的总耗时，都不另外计入tick。
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import time
+from collections import deque
+
+from room import GameRoom
+from transport import LoopbackConnection
+from protocol import FRAME_HEADER_SIZE
+from codec import CODECS, decode_message
+from interest import DEFAULT_VIEW_RADIUS, SUGGESTED_VIEW_RADIUS
+from util import percentile
+
+# 默认每个场景执行的tick数
+DEFAULT_TICKS = 300
+
+# 默认的客户端确认延迟(秒)，即模拟的往返时间；每个客户端在此基础上有±50%的差异
+DEFAULT_ACK_DELAY = 0.1
+
+# 地图大小，与客户端一致
+MAP_WIDTH = 2000
+MAP_HEIGHT = 1500
+
+# 聚集分布时的聚集点数量和每个聚集点的半径(标准差)
+CLUSTER_COUNT = 4
+CLUSTER_SPREAD = 80
+
+# 每个tick移动的玩家比例和最大移动距离
+MOVE_FRACTION = 0.5
+MOVE_STEP = 15
+
+# 补充的子弹速度范围
+BULLET_SPEED = (150, 500)
+
+# 二进制模式下的技能及其在客户端技能列表中的位置
+BINARY_SKILLS = (("AND", 0), ("OR", 1), ("XOR", 3))
+
+# 预置场景，可以用--scenario选择
+SCENARIOS = {
+    "spread-100": {"players": 100, "layout": "spread", "bullets": 200, "volleys": 1, "skills": 2},
+    "clustered-100": {"players": 100, "layout": "clustered", "bullets": 200, "volleys": 1, "skills": 2},
+    "spread-400": {"players": 400, "layout": "spread", "bullets": 1000, "volleys": 2, "skills": 5},
+    "volley-storm": {"players": 100, "layout": "clustered", "bullets": 0, "volleys": 10, "skills": 10},
+}
+
+# 计时的房间步骤: (结果中的名称, 对象的属性路径, 方法名)
+TIMED_STEPS = (
+    ("timers", "timers", "advance"),
+    ("apply_commands", None, "_apply_commands"),
+    ("process_skill", None, "_process_skill"),
+    ("broadcast", None, "_broadcast_message"),
+    ("apply_moves", None, "_apply_pending_moves"),
+    ("record_history", "position_history", "record"),
+    ("update_animations", None, "_update_animations"),
+    ("update_bullets", None, "_update_bullets"),
+    ("broadcast_moves", None, "_broadcast_moves"),
+    ("send_game_state_update", None, "_send_game_state_update"),
+    ("flush_events", None, "_flush_events"),
+)
+
+# 结果中各方法的顺序
+METHODS = tuple(name for name, _, _ in TIMED_STEPS) + ("tick", "client_decode")
+
+
+class BenchConnection(LoopbackConnection):
+    """代替真实客户端的回环连接，每个tick结束后取出发送的帧"""
+
+    def __init__(self):
+        super().__init__()
+        self.bytes_sent = 0
+        self.aborted = False
+
+    def pump(self):
+        """取出队列中的帧(不计入测量)"""
+        frames = self.queue.drain()
+        self.bytes_sent += sum(len(frame) for frame in frames)
+        return frames
+
+    def abort(self):
+        self.aborted = True
+        self.close()
+
+
+class BenchClient:
+    """模拟客户端：取出并解码收到的帧，在确认延迟之后确认收到的快照"""
+
+    def __init__(self, client_id, ack_delay_ticks):
+        self.client_id = client_id
+        self.connection = BenchConnection()
+        self.ack_delay_ticks = ack_delay_ticks
+        self.acks = deque()  # [(发送确认的tick, 确认消息)]
+        self.input_seq = 0
+
+    def receive(self, tick):
+        """解码本tick收到的帧，为其中的快照安排确认"""
+        for frame in self.connection.pump():
+            self._handle(decode_message(memoryview(frame)[FRAME_HEADER_SIZE:]), tick)
+
+    def _handle(self, message, tick):
+        message_type = message.get("type")
+        if message_type == "event_bundle":
+            for event in message["events"]:
+                self._handle(event, tick)
+        elif message_type in ("welcome", "game_update", "game_delta") and message.get("seq") is not None:
+            ack = {"type": "snapshot_ack", "seq": message["seq"]}
+            if message.get("timestamp") is not None:
+                ack["time"] = message["timestamp"]
+            self.acks.append((tick + self.ack_delay_ticks, ack))
+
+    def due_acks(self, tick):
+        """返回在tick之前应到达服务器的确认"""
+        acks = []
+        while self.acks and self.acks[0][0] <= tick:
+            acks.append(self.acks.popleft()[1])
+        return acks
+
+
+class Scenario:
+    """一个基准测试场景：构造房间、在每个tick中产生负载并记录各步骤的耗时"""
+
+    def __init__(self, name, players=100, layout="spread", bullets=0, volleys=0, skills=0,
+                 codec="binary", view_radius=DEFAULT_VIEW_RADIUS, tick_rate=30, send_rate=20,
+                 ack_delay=DEFAULT_ACK_DELAY, seed=1):
+        if layout not in ("spread", "clustered"):
+            raise ValueError(f"未知的分布方式: {layout}")
+        self.name = name
+        self.players = players
+        self.layout = layout
+        self.bullets = bullets        # 保持在飞行中的子弹数
+        self.volleys = volleys        # 每个tick开火的玩家数
+        self.skills = skills          # 每个tick使用AND/OR/XOR的玩家数
+        self.codec = codec
+        self.view_radius = view_radius
+        self.tick_rate = tick_rate
+        self.send_rate = send_rate
+        self.ack_delay = ack_delay
+        self.rng = random.Random(seed)
+        self.room = None
+        self.clients = {}
+        self.positions = {}  # {client_id: 客户端最近发送的位置}
+        self.timings = {method: [] for method in METHODS}
+        self.ticks = 0  # 已执行的tick数
+        self.sim_time = 0.0  # 房间和调度器使用的模拟时钟
+
+    def _random_position(self, centers):
+        if self.layout == "spread":
+            return [self.rng.uniform(0, MAP_WIDTH), self.rng.uniform(0, MAP_HEIGHT)]
+        center = self.rng.choice(centers)
+        return [min(max(self.rng.gauss(center[0], CLUSTER_SPREAD), 0), MAP_WIDTH),
+                min(max(self.rng.gauss(center[1], CLUSTER_SPREAD), 0), MAP_HEIGHT)]
+
+    def _instrument(self):
+        # 用计时包装替换房间实例上的方法，_game_tick等通过属性查找调用，测量的是真实的调用路径
+        room = self.room
+        for method, path, attribute in TIMED_STEPS:
+            owner = getattr(room, path) if path else room
+            setattr(owner, attribute, self._timed(method, getattr(owner, attribute)))
+
+    def _timed(self, method, function):
+        timings = self.timings[method]
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.append(time.perf_counter() - started)
+        return timed
+
+    def setup(self):
+        room = GameRoom(self.name, self.view_radius, self.tick_rate, self.send_rate, seed=self.rng.randrange(1 << 32))
+        # 房间时间和tick调度都使用模拟时钟，每个tick把时钟推进一个步长
+        room.clock = lambda: self.sim_time
+        room.scheduler.clock = lambda: self.sim_time
+        room.scheduler.start()
+        self.room = room
+        tick_interval = room.scheduler.tick_interval
+        centers = [[self.rng.uniform(200, MAP_WIDTH - 200), self.rng.uniform(200, MAP_HEIGHT - 200)]
+                   for _ in range(CLUSTER_COUNT)]
+        for client_id in range(self.players):
+            delay = self.ack_delay * self.rng.uniform(0.5, 1.5)
+            client = BenchClient(client_id, round(delay / tick_interval))
+            self.clients[client_id] = client
+            room.commands.append(("connect", client_id, (client.connection, ("bench", client_id),
+                                                         {"type": "connect", "username": f"Bench_{client_id}",
+                                                          "codecs": [self.codec]})))
+            self._send_move(client_id, self._random_position(centers))
+        # 连接、欢迎消息和初始位置不计入测量
+        self._run_tick()
+        for method in METHODS:
+            self.timings[method].clear()
+        self._spawn_bullets()
+        self._instrument()
+
+    def _send(self, client_id, message):
+        self.room.commands.append(("message", client_id, message))
+
+    def _send_move(self, client_id, position):
+        client = self.clients[client_id]
+        client.input_seq += 1
+        self.positions[client_id] = position
+        self._send(client_id, {"type": "move", "position": position, "seq": client.input_seq})
+
+    def _spawn_bullets(self):
+        # 直接补充子弹到目标数量，保持碰撞检测的负载稳定
+        bullets = self.room.game_state["bullets"]
+        players = self.room.game_state["players"]
+        owners = list(players)
+        while owners and len(bullets) < self.bullets:
+            owner = self.rng.choice(owners)
+            angle = self.rng.uniform(0, 2 * math.pi)
+            speed = self.rng.uniform(*BULLET_SPEED)
+            velocity = [speed * math.cos(angle), speed * math.sin(angle)]
+            bullets.spawn(self.room.bullet_id_counter, owner, players[owner]["position"], velocity,
+                          self.rng.randint(1, 10), self.room.tick, self.sim_time)
+            self.room.bullet_id_counter += 1
+
+    def _run_tick(self):
+        # 推进模拟时钟并执行房间到期的tick，时钟位于步长中间，调度器的浮点累积误差不会使tick提前或推迟
+        self.sim_time = (self.ticks + 0.5) * self.room.scheduler.tick_interval
+        started = time.perf_counter()
+        self.room.run_due_ticks()
+        elapsed = time.perf_counter() - started
+        self.ticks += 1
+        started = time.perf_counter()
+        for client in self.clients.values():
+            client.receive(self.ticks)
+        self.timings["client_decode"].append(time.perf_counter() - started)
+        return elapsed
+
+    def run_tick(self):
+        """模拟客户端发送本tick的输入，然后执行一个房间tick"""
+        rng = self.rng
+        client_ids = list(self.clients)
+        # 到期的快照确认
+        for client_id, client in self.clients.items():
+            for ack in client.due_acks(self.ticks):
+                self._send(client_id, ack)
+        # 部分玩家移动
+        for client_id in rng.sample(client_ids, int(len(client_ids) * MOVE_FRACTION)):
+            position = self.positions[client_id]
+            self._send_move(client_id, [min(max(position[0] + rng.uniform(-MOVE_STEP, MOVE_STEP), 0), MAP_WIDTH),
+                                        min(max(position[1] + rng.uniform(-MOVE_STEP, MOVE_STEP), 0), MAP_HEIGHT)])
+        for shooter in rng.sample(client_ids, min(self.volleys, len(client_ids))):
+            self._send(shooter, {"type": "action", "action": "decimal_skill", "skill_name": "开火", "skill_index": 1,
+                                 "memory_usage": 0})
+        for caster in rng.sample(client_ids, min(self.skills, len(client_ids))):
+            name, index = rng.choice(BINARY_SKILLS)
+            self._send(caster, {"type": "action", "action": "skill", "skill_name": name, "skill_index": index,
+                                "memory_usage": 0})
+        self._spawn_bullets()
+        self.timings["tick"].append(self._run_tick())
+
+    def close(self):
+        for client in self.clients.values():
+            client.connection.close()
+
+    def results(self, ticks):
+        """返回可序列化为JSON的结果，时间单位为微秒"""
+        methods = {}
+        for method in METHODS:
+            values = sorted(self.timings[method])
+            if not values:
+                continue
+            methods[method] = {
+                "calls": len(values),
+                "per_tick_us": sum(values) / ticks * 1e6,
+                "mean_us": sum(values) / len(values) * 1e6,
+                "p50_us": percentile(values, 50) * 1e6,
+                "p95_us": percentile(values, 95) * 1e6,
+                "p99_us": percentile(values, 99) * 1e6,
+                "max_us": values[-1] * 1e6
+            }
+        connections = [client.connection for client in self.clients.values()]
+        sent = sum(connection.bytes_sent for connection in connections)
+        return {
+            "name": self.name,
+            "players": self.players,
+            "layout": self.layout,
+            "bullets": self.bullets,
+            "volleys": self.volleys,
+            "skills": self.skills,
+            "codec": self.codec,
+            "view_radius": self.view_radius,
+            "ack_delay": self.ack_delay,
+            "ticks": ticks,
+            "live_bullets": len(self.room.game_state["bullets"]),
+            "bytes_per_client_per_tick": sent / max(1, self.players) / ticks,
+            "dropped_clients": sum(1 for connection in connections if connection.aborted),
+            "methods": methods
+        }
+
+
+def run_scenario(name, ticks=DEFAULT_TICKS, codec="binary", view_radius=DEFAULT_VIEW_RADIUS, seed=1,
+                 ack_delay=DEFAULT_ACK_DELAY, **options):
+    """运行一个场景，返回结果字典"""
+    scenario = Scenario(name, codec=codec, view_radius=view_radius, seed=seed, ack_delay=ack_delay, **options)
+    try:
+        scenario.setup()
+        for _ in range(ticks):
+            scenario.run_tick()
+        return scenario.results(ticks)
+    finally:
+        scenario.close()
+
+
+def run_benchmarks(names=None, ticks=DEFAULT_TICKS, codec="binary", view_radius=DEFAULT_VIEW_RADIUS, seed=1, quiet=True,
+                   ack_delay=DEFAULT_ACK_DELAY):
+    """运行选定的预置场景(默认全部)，返回结果字典"""
+    results = []
+    output = open(os.devnull, 'w') if quiet else None
+    try:
+        for name in names or list(SCENARIOS):
+            # 屏蔽房间中的日志输出，避免print的开销影响测量
+            with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+                results.append(run_scenario(name, ticks, codec, view_radius, seed, ack_delay, **SCENARIOS[name]))
+    finally:
+        if output:
+            output.close()
+    return {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenarios": results
+    }
+
+
+def save_report(report, path=None):
+    """把结果写入JSON文件，没有指定文件时输出到标准输出"""
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"基准测试结果已写入 {path}")
+    else:
+        print(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="服务器tick的基准测试")
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='要运行的场景，可以指定多次；默认运行全部场景')
+    parser.add_argument('--ticks', type=int, default=DEFAULT_TICKS, help='每个场景执行的tick数')
+    parser.add_argument('--codec', choices=list(CODECS), default='binary', help='模拟客户端使用的编码')
+    parser.add_argument('--view-radius', type=float, default=DEFAULT_VIEW_RADIUS,
+                        help=f'视野半径(建议{SUGGESTED_VIEW_RADIUS})，默认不限制')
+    parser.add_argument('--ack-delay', type=float, default=DEFAULT_ACK_DELAY,
+                        help='模拟客户端确认快照的平均延迟(秒)，0表示在下一个tick确认')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--output', help='结果JSON的输出文件，默认输出到标准输出')
+    args = parser.parse_args(argv)
+    report = run_benchmarks(args.scenario, args.ticks, args.codec, args.view_radius or None, args.seed,
+                            ack_delay=args.ack_delay)
+    save_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
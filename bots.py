@@ -0,0 +1,333 @@
+# bots.py
+# 无界面的机器人客户端和负载生成器
+#
+# 机器人复用GameClient的协议处理(握手、编码协商、快照和增量的应用与确认)，但不初始化pygame，
+# 发送的消息直接写入asyncio流。一个进程中用一个事件循环运行数百个机器人，每个机器人按脚本
+# 随机移动、切换进制，在十进制下开火、在二进制下使用AND/OR/XOR技能。
+# 结束时输出连接耗时、消息速率、收发字节数和快照延迟(服务器快照时间戳到收到快照的时间)的分位数，
+# 用来在没有真实玩家的情况下评估服务器的承载能力。
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import time
+
+from client import GameClient
+from protocol import FrameBuffer, FrameError, encode_frame
+from codec import CODECS, JSON_CODEC, decode_message
+from util import percentile
+
+# 机器人每次行动(移动一步并尝试使用技能)的平均间隔(秒)
+DEFAULT_ACTION_INTERVAL = 0.05
+
+# 每次行动切换进制的概率
+BASE_CHANGE_CHANCE = 0.02
+
+# 每次行动尝试使用技能的概率，技能仍受客户端冷却时间限制
+SKILL_CHANCE = 0.1
+
+# 每次行动的最大移动距离
+MOVE_STEP = 15
+
+# 等待welcome消息的最长时间(秒)
+CONNECT_TIMEOUT = 10.0
+
+# 二进制模式下机器人使用的技能
+BINARY_SKILLS = ("AND", "OR", "XOR")
+
+# 统计报告中的分位数
+PERCENTILES = (50, 95, 99)
+
+
+class LoadStats:
+    """所有机器人共享的统计数据，由同一个事件循环更新，不需要加锁"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.connect_times = []  # 从发起连接到收到welcome的秒数
+        self.failed = 0          # 连接失败或等待welcome超时的机器人数
+        self.disconnected = 0    # 运行过程中被服务器断开的机器人数
+        self.frames = 0          # 收到的帧数
+        self.messages = 0        # 收到的消息数(事件包中的事件分别计数)
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.snapshot_delays = []  # 快照时间戳到收到快照的秒数
+        self.message_types = {}
+
+    def record_message(self, message, received_at):
+        message_type = message.get('type')
+        if message_type == 'event_bundle':
+            for event in message.get('events', []):
+                self.record_message(event, received_at)
+            return
+        self.messages += 1
+        self.message_types[message_type] = self.message_types.get(message_type, 0) + 1
+        if message_type in ('game_update', 'game_delta') and message.get('timestamp') is not None:
+            self.snapshot_delays.append(received_at - message['timestamp'])
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def summary(self):
+        """返回统计报告的文本行"""
+        elapsed = max((self.finished or time.monotonic()) - self.started, 1e-9)
+        lines = [
+            f"机器人: {len(self.connect_times)}个已连接, {self.failed}个连接失败, {self.disconnected}个被断开",
+            f"连接耗时(毫秒): {self._format_percentiles(self.connect_times, 1000)}",
+            f"接收: {self.frames / elapsed:.0f}帧/秒, {self.messages / elapsed:.0f}条消息/秒, "
+            f"{self.bytes_received / elapsed / 1024:.1f}KB/秒 (共{self.bytes_received / 1024:.0f}KB)",
+            f"发送: {self.bytes_sent / elapsed / 1024:.1f}KB/秒 (共{self.bytes_sent / 1024:.0f}KB)",
+            f"快照延迟(毫秒): {self._format_percentiles(self.snapshot_delays, 1000)} "
+            f"(共{len(self.snapshot_delays)}个快照)"
+        ]
+        if self.message_types:
+            counts = sorted(self.message_types.items(), key=lambda item: -item[1])
+            lines.append("消息类型: " + ", ".join(f"{name}={count}" for name, count in counts))
+        return lines
+
+    @staticmethod
+    def _format_percentiles(values, scale):
+        ordered = sorted(values)
+        if not ordered:
+            return "无数据"
+        parts = [f"p{p}={percentile(ordered, p) * scale:.1f}" for p in PERCENTILES]
+        parts.append(f"max={ordered[-1] * scale:.1f}")
+        return ", ".join(parts)
+
+
+class BotClient(GameClient):
+    """由asyncio驱动的无界面客户端，收到的消息交给GameClient的协议处理"""
+
+    def __init__(self, host, port, username, room=None, codecs=None, stats=None, rng=None,
+                 action_interval=DEFAULT_ACTION_INTERVAL):
+        super().__init__(host=host, port=port, username=username, room=room)
+        self.codecs = codecs or list(CODECS)  # 握手时声明支持的编码
+        self.stats = stats or LoadStats()
+        self.rng = rng or random.Random()
+        self.action_interval = action_interval
+        self.writer = None
+        self.receive_task = None
+        self.welcomed = asyncio.Event()
+        self.position = None  # 机器人自己的位置，收到welcome后从游戏状态中读取
+
+    async def connect_async(self):
+        """连接服务器并等待welcome，返回是否成功"""
+        started = time.monotonic()
+        try:
+            reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.stats.failed += 1
+            return False
+        self.running = True
+        self.codec = JSON_CODEC
+        connect_message = {
+            "type": "connect",
+            "username": self.username,
+            "codecs": self.codecs
+        }
+        if self.room is not None:
+            connect_message["room"] = self.room
+        self._send_message(connect_message)
+        self.receive_task = asyncio.ensure_future(self._receive_async(reader))
+        try:
+            await asyncio.wait_for(self.welcomed.wait(), CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.stats.failed += 1
+            self.disconnect()
+            return False
+        self.stats.connect_times.append(time.monotonic() - started)
+        player = self.game_state.get("players", {}).get(self.client_id, {}) if self.game_state else {}
+        self.position = list(player.get("position", [self.map_width / 2, self.map_height / 2]))
+        self.display_base = player.get("base", self.display_base)
+        return True
+
+    async def _receive_async(self, reader):
+        frames = FrameBuffer()
+        try:
+            while self.running:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                self.stats.bytes_received += len(data)
+                frames.feed(data)
+                received_at = time.time()
+                for payload in frames.frames():
+                    self.stats.frames += 1
+                    message = decode_message(payload)
+                    self.stats.record_message(message, received_at)
+                    try:
+                        self._process_server_message(message)
+                    except Exception as e:
+                        print(f"机器人 {self.username} 处理消息 {message.get('type')} 时出错: {e}")
+                # 机器人不绘制画面，丢弃消息处理中产生的特效
+                self.particles.clear()
+                self.animations.clear()
+        except (OSError, FrameError, ValueError) as e:
+            if self.running:
+                print(f"机器人 {self.username} 接收消息时出错: {e}")
+        if self.running:
+            self.stats.disconnected += 1
+            self.disconnect()
+
+    def _process_server_message(self, message):
+        super()._process_server_message(message)
+        if message.get('type') == 'welcome':
+            self.welcomed.set()
+
+    def _send_message(self, message):
+        if not self.running or self.writer is None or self.writer.is_closing():
+            return False
+        frame = encode_frame(self.codec.encode(message))
+        self.writer.write(frame)
+        self.stats.bytes_sent += len(frame)
+        return True
+
+    def disconnect(self):
+        self.running = False
+        self.connected = False
+        if self.writer is not None:
+            self.writer.close()
+
+    async def play(self, duration):
+        """按脚本行动duration秒，连接被断开时提前结束"""
+        loop = asyncio.get_running_loop()
+        end = loop.time() + duration
+        while self.running and loop.time() < end:
+            await asyncio.sleep(self.action_interval * self.rng.uniform(0.5, 1.5))
+            if not self.running:
+                break
+            self.step()
+            try:
+                # 发送缓冲区积压时等待，避免机器人比服务器接收得更快
+                await self.writer.drain()
+            except OSError:
+                break
+
+    def step(self):
+        """一次行动：随机移动一步，偶尔切换进制或使用当前进制下的技能"""
+        rng = self.rng
+        self.position[0] = min(max(self.position[0] + rng.uniform(-MOVE_STEP, MOVE_STEP), 0), self.map_width)
+        self.position[1] = min(max(self.position[1] + rng.uniform(-MOVE_STEP, MOVE_STEP), 0), self.map_height)
+        self.send_move([round(self.position[0], 2), round(self.position[1], 2)])
+
+        if rng.random() < BASE_CHANGE_CHANCE:
+            self.display_base = rng.choice([base for base in (2, 10, 16) if base != self.display_base])
+            self._send_base_change(self.display_base)
+
+        if rng.random() < SKILL_CHANCE:
+            if self.display_base == 10:
+                self._use_skill("decimal_skill", "开火", 1)
+            elif self.display_base == 2:
+                name = rng.choice(BINARY_SKILLS)
+                self._use_skill("skill", name, [skill["name"] for skill in self.skills].index(name))
+
+    def _use_skill(self, action, skill_name, skill_index):
+        # 只检查冷却时间，射程和目标由服务器判断
+        if time.time() - self.last_skill_use.get(skill_name, 0) < self.cooldowns.get(skill_name, 0):
+            return
+        self.send_action(action, skill_name=skill_name, skill_index=skill_index, memory_usage=self.memory_usage)
+        self._update_skill_use_time(skill_name)
+
+    # 机器人不绘制画面，不生成特效
+    def _add_conversion_particles(self, x, y, base):
+        pass
+
+    def _add_skill_particles(self, x, y):
+        pass
+
+    def _add_fire_text_effect(self, x, y):
+        pass
+
+    def _add_explosion_particles(self, x, y):
+        pass
+
+
+class LoadGenerator:
+    """在一个事件循环中运行多个机器人并汇总统计"""
+
+    def __init__(self, host='localhost', port=5555, bots=100, duration=30.0, ramp=5.0, room=None, rooms=1,
+                 codec=None, action_interval=DEFAULT_ACTION_INTERVAL, seed=None, quiet=True):
+        if bots <= 0 or rooms <= 0:
+            raise ValueError("机器人数和房间数必须大于0")
+        self.host = host
+        self.port = port
+        self.bots = bots
+        self.duration = duration
+        self.ramp = ramp  # 在多少秒内逐个启动全部机器人
+        self.room = room
+        self.rooms = rooms  # 大于1时机器人平均分布到多个房间
+        self.codecs = [codec] if codec else list(CODECS)
+        self.action_interval = action_interval
+        self.seed = seed
+        self.quiet = quiet  # 屏蔽客户端协议处理中的输出
+        self.stats = LoadStats()
+
+    def _room_name(self, index):
+        if self.rooms == 1:
+            return self.room
+        return f"{self.room or 'bots'}-{index % self.rooms}"
+
+    async def _run_bot(self, index):
+        await asyncio.sleep(self.ramp * index / self.bots)
+        seed = None if self.seed is None else self.seed + index
+        bot = BotClient(self.host, self.port, f"Bot_{index}", room=self._room_name(index), codecs=self.codecs,
+                        stats=self.stats, rng=random.Random(seed), action_interval=self.action_interval)
+        if await bot.connect_async():
+            try:
+                await bot.play(self.duration)
+            finally:
+                bot.disconnect()
+        if bot.receive_task is not None:
+            await asyncio.gather(bot.receive_task, return_exceptions=True)
+
+    async def run_async(self):
+        self.stats = LoadStats()
+        await asyncio.gather(*(self._run_bot(index) for index in range(self.bots)))
+        self.stats.finish()
+        return self.stats
+
+    def run(self):
+        """运行全部机器人直到结束，返回LoadStats"""
+        output = open(os.devnull, 'w') if self.quiet else None
+        try:
+            with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+                return asyncio.run(self.run_async())
+        finally:
+            if output:
+                output.close()
+
+
+def run_load(host='localhost', port=5555, bots=100, duration=30.0, ramp=5.0, room=None, rooms=1, codec=None,
+             action_interval=DEFAULT_ACTION_INTERVAL, seed=None, quiet=True):
+    """运行负载测试并输出统计报告，返回LoadStats"""
+    print(f"启动 {bots} 个机器人连接 {host}:{port}，运行 {duration:.0f} 秒")
+    generator = LoadGenerator(host, port, bots, duration, ramp, room, rooms, codec, action_interval, seed, quiet)
+    stats = generator.run()
+    for line in stats.summary():
+        print(line)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="无界面机器人负载生成器")
+    parser.add_argument('--host', default='localhost', help='服务器主机名')
+    parser.add_argument('--port', type=int, default=5555, help='服务器端口')
+    parser.add_argument('--bots', type=int, default=100, help='机器人数量')
+    parser.add_argument('--duration', type=float, default=30.0, help='每个机器人连接后运行的秒数')
+    parser.add_argument('--ramp', type=float, default=5.0, help='在多少秒内逐个启动全部机器人')
+    parser.add_argument('--room', help='机器人加入的房间名，默认进入服务器的默认房间')
+    parser.add_argument('--rooms', type=int, default=1, help='大于1时机器人平均分布到多个房间')
+    parser.add_argument('--codec', choices=list(CODECS), help='只声明支持该编码，默认与普通客户端相同')
+    parser.add_argument('--action-interval', type=float, default=DEFAULT_ACTION_INTERVAL,
+                        help='机器人每次行动的平均间隔(秒)')
+    parser.add_argument('--seed', type=int, help='随机种子，相同种子的机器人行为相同')
+    parser.add_argument('--verbose', action='store_true', help='显示客户端协议处理中的输出')
+    args = parser.parse_args()
+    try:
+        run_load(args.host, args.port, args.bots, args.duration, args.ramp, args.room, args.rooms, args.codec,
+                 args.action_interval, args.seed, not args.verbose)
+    except KeyboardInterrupt:
+        print("负载测试被用户中断")
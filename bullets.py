@@ -0,0 +1,194 @@
+# bullets.py
+# 服务器端基于NumPy的子弹存储
+#
+# 子弹按列存放在预分配的数组中(结构数组)，位置更新和与玩家的碰撞检测
+# 都是整列的向量运算，不再逐个处理子弹字典；寿命到期由服务器的时间轮触发。
+# 被移除的子弹槽位放入空闲列表，下一颗子弹直接复用，不需要移动其他子弹。
+
+import numpy as np
+
+# 初始容量，不够时按两倍扩容
+DEFAULT_CAPACITY = 256
+
+# 子弹存在的时间(秒)
+BULLET_LIFETIME = 5.0
+
+# 子弹与玩家的碰撞距离
+BULLET_HIT_RADIUS = 20
+
+# 子弹的显示属性，所有子弹相同
+BULLET_CHAR = "*"
+BULLET_COLOR = (212, 212, 212)
+
+
+class BulletStore:
+    """
+    子弹的列存储
+    每颗子弹占用一个槽位，包含ID、所有者、位置、速度、伤害、生成tick和生成时间；
+    alive为False的槽位在空闲列表中等待复用。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._count = 0
+        self._free = []  # 空闲槽位，后进先出
+        self._records = None  # records()的缓存，子弹变化后失效
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.owners = np.zeros(capacity, dtype=np.int64)
+        self.positions = np.zeros((capacity, 2), dtype=np.float64)
+        self.velocities = np.zeros((capacity, 2), dtype=np.float64)
+        self.damages = np.zeros(capacity, dtype=np.int64)
+        self.spawn_ticks = np.zeros(capacity, dtype=np.int64)
+        self.created_times = np.zeros(capacity, dtype=np.float64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def _grow(self):
+        # 容量翻倍，已有数据复制到新数组的前半部分
+        old_capacity = len(self.alive)
+        columns = (self.ids, self.owners, self.positions, self.velocities,
+                   self.damages, self.spawn_ticks, self.created_times, self.alive)
+        self._allocate(old_capacity * 2)
+        for new, old in zip((self.ids, self.owners, self.positions, self.velocities,
+                             self.damages, self.spawn_ticks, self.created_times, self.alive), columns):
+            new[:old_capacity] = old
+        self._free = list(range(old_capacity * 2 - 1, old_capacity - 1, -1))
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return len(self.alive)
+
+    def spawn(self, bullet_id, owner, position, velocity, damage, tick, created_time):
+        """加入一颗子弹，返回其槽位"""
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self.ids[slot] = bullet_id
+        self.owners[slot] = owner
+        self.positions[slot] = position[:2]
+        self.velocities[slot] = velocity[:2]
+        self.damages[slot] = damage
+        self.spawn_ticks[slot] = tick
+        self.created_times[slot] = created_time
+        self.alive[slot] = True
+        self._count += 1
+        self._records = None
+        return slot
+
+    def remove_slots(self, slots):
+        """移除指定槽位的子弹，槽位放回空闲列表"""
+        slots = [slot for slot in slots if self.alive[slot]]
+        if not slots:
+            return
+        self.alive[slots] = False
+        self._free.extend(slots)
+        self._count -= len(slots)
+        self._records = None
+
+    def integrate(self, delta_time):
+        """按速度推进所有子弹的位置"""
+        if self._count:
+            alive = self.alive
+            self.positions[alive] += self.velocities[alive] * delta_time
+            self._records = None
+
+    def expire_slots(self, slots, bullet_ids):
+        """移除到达寿命的子弹；槽位中的子弹已被移除或槽位已被新子弹复用时忽略，返回移除的数量"""
+        expired = [slot for slot, bullet_id in zip(slots, bullet_ids)
+                   if self.alive[slot] and self.ids[slot] == bullet_id]
+        self.remove_slots(expired)
+        return len(expired)
+
+    def live_spawns(self):
+        """返回存活子弹(按槽位顺序)的所有者和生成tick"""
+        alive = self.alive
+        return self.owners[alive], self.spawn_ticks[alive]
+
+    def collide(self, player_ids, player_positions, radius=BULLET_HIT_RADIUS, frames=None):
+        """
+        检测子弹与玩家的碰撞并移除击中的子弹
+        每颗子弹击中player_ids顺序中第一个在碰撞距离内的非所有者玩家，
+        返回[(子弹ID, 玩家ID, 伤害, [x, y])]，按子弹ID排序
+        player_positions也可以是多帧的玩家位置(帧数, 玩家数, 2)，此时frames给出每颗存活子弹(按槽位顺序)使用的帧
+        """
+        if not self._count or not player_ids:
+            return []
+        slots = np.flatnonzero(self.alive)
+        r2 = radius * radius
+        if frames is None:
+            targets = np.asarray(player_positions, dtype=np.float64).reshape(-1, 2)
+            # (子弹数, 玩家数)的平方距离矩阵
+            offsets = self.positions[slots, None, :] - targets[None, :, :]
+            in_range = (offsets * offsets).sum(axis=2) < r2
+        else:
+            # 按帧分组计算，同一帧的子弹共用该帧的玩家位置
+            in_range = np.empty((len(slots), len(player_ids)), dtype=bool)
+            for frame in range(len(player_positions)):
+                rows = np.flatnonzero(frames == frame)
+                if len(rows):
+                    offsets = self.positions[slots[rows], None, :] - player_positions[frame][None, :, :]
+                    in_range[rows] = (offsets * offsets).sum(axis=2) < r2
+        # 子弹不与自己的所有者碰撞
+        in_range &= self.owners[slots, None] != np.asarray(player_ids, dtype=np.int64)[None, :]
+
+        hit_rows = np.flatnonzero(in_range.any(axis=1))
+        if not len(hit_rows):
+            return []
+        hit_rows = hit_rows[np.argsort(self.ids[slots[hit_rows]], kind='stable')]
+        first_target = in_range[hit_rows].argmax(axis=1)
+
+        hit_slots = slots[hit_rows]
+        hits = list(zip(self.ids[hit_slots].tolist(),
+                        [player_ids[index] for index in first_target.tolist()],
+                        self.damages[hit_slots].tolist(),
+                        self.positions[hit_slots].tolist()))
+        self.remove_slots(hit_slots.tolist())
+        return hits
+
+    def state_bytes(self):
+        """按ID排序的存活子弹的ID、所有者、位置、速度和伤害的原始字节，用于计算状态哈希"""
+        slots = np.flatnonzero(self.alive)
+        slots = slots[np.argsort(self.ids[slots], kind='stable')]
+        return b''.join(column[slots].tobytes()
+                        for column in (self.ids, self.owners, self.positions, self.velocities, self.damages))
+
+    def records(self):
+        """返回所有子弹的字典列表(按ID排序)，用于快照和增量；结果在子弹变化前会被复用，调用者不能修改"""
+        if self._records is None:
+            slots = np.flatnonzero(self.alive)
+            slots = slots[np.argsort(self.ids[slots], kind='stable')]
+            self._records = [
+                {
+                    "id": bullet_id,
+                    "owner": owner,
+                    "position": position,
+                    "velocity": velocity,
+                    "damage": damage,
+                    "created_time": created_time,
+                    "char": BULLET_CHAR,
+                    "color": BULLET_COLOR
+                }
+                for bullet_id, owner, position, velocity, damage, created_time in zip(
+                    self.ids[slots].tolist(), self.owners[slots].tolist(),
+                    self.positions[slots].tolist(), self.velocities[slots].tolist(),
+                    self.damages[slots].tolist(), self.created_times[slots].tolist())
+            ]
+        return self._records
+
+    def record(self, slot):
+        """返回单颗子弹的字典"""
+        return {
+            "id": int(self.ids[slot]),
+            "owner": int(self.owners[slot]),
+            "position": self.positions[slot].tolist(),
+            "velocity": self.velocities[slot].tolist(),
+            "damage": int(self.damages[slot]),
+            "created_time": float(self.created_times[slot]),
+            "char": BULLET_CHAR,
+            "color": BULLET_COLOR
+        }
@@ -1,31 +1,67 @@
-import socket
 import threading
 import json
 import time
-import pygame
 import sys
 import math
 import random
+from collections import deque
+
+try:
+    import pygame
+except ImportError:
+    # 机器人客户端(bots.py)只复用协议处理，不需要pygame
+    pygame = None
 
 # 导入按键配置模块
 from keybindings import load_keybindings, get_key_name
+from protocol import FrameError, encode_frame
+from codec import CODECS, JSON_CODEC, get_codec, decode_message
+from spatial import SpatialGrid
+from datagram import DatagramChannel
+from transport import TcpTransport
 
 class GameClient:
-    def __init__(self, host='localhost', port=5555, username=None, screen_width=800, screen_height=600):
+    # 等待服务器确认的移动输入最多保留多少条(60帧/秒时约4秒)，超出时丢弃最旧的
+    PREDICTION_BUFFER_SIZE = 256
+
+    def __init__(self, host='localhost', port=5555, username=None, screen_width=800, screen_height=600, room=None,
+                 udp=True, transport=None):
         # 初始化游戏客户端
         self.host = host
         self.port = port
+        # 与服务器之间的传输(见transport.py)，默认为TCP；与服务器在同一进程中运行时可以使用回环传输
+        self.transport = transport or TcpTransport(host, port)
         self.username = username or f"Player_{int(time.time()) % 1000}"
-        self.client_socket = None
+        self.room = room  # 要加入的房间名，None表示服务器的默认房间；连接后为实际加入的房间
+        self.client_socket = None  # 传输打开的流
         self.client_id = None
         self.game_state = None
         self.running = False
         self.connected = False
         self.message_callback = None
         self.receive_thread = None
+        self.send_lock = threading.Lock()  # 主线程和接收线程都会发送消息
+        self.snapshot_seq = None  # 最近应用的快照版本
+        self.codec = JSON_CODEC  # 发送消息使用的编码，收到welcome后切换为协商的编码
+        # 握手时请求UDP通道，服务器提供时玩家位置和快照通过UDP接收，UDP不通时只使用TCP
+        self.udp = udp
+        self.datagram_channel = None
+        self.datagram_thread = None
+        # TCP和UDP两个接收线程处理消息时互斥
+        self.message_lock = threading.Lock()
+
+        # 客户端预测：自己的移动立即在本地生效，服务器在快照的玩家记录中回传已应用的最新输入序号(input_seq)，
+        # 收到快照时以服务器位置为准，再叠加尚未被确认的输入，高延迟下自己的角色也不会被拉回
+        self.input_seq = 0  # 最近发送的移动输入序号
+        self.pending_inputs = deque(maxlen=self.PREDICTION_BUFFER_SIZE)  # [(序号, dx, dy)]，尚未被服务器确认的输入
+        self.server_position = None  # 服务器快照中自己的位置
+        self.acked_input_seq = 0  # 服务器已应用的最新输入序号
+        self.prediction_lock = threading.Lock()  # 主线程发送输入，接收线程应用快照
         
         # 其他玩家位置插值系统
         self.player_positions = {}  # {player_id: {"current": [x, y], "target": [x, y], "last_update": timestamp}}
+        # 玩家位置的空间索引，用于目标查找和碰撞检测，每帧在主线程中与游戏状态同步
+        self.player_grid = SpatialGrid()
         
         # 角色字符串颜色
         self.prefix_color = (86, 156, 214)  # 前缀(0x, 0b)的颜色
@@ -165,15 +201,20 @@ class GameClient:
         # 连接到游戏服务器
         try:
             # 初始化网络连接
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((self.host, self.port))
+            self.client_socket = self.transport.open()
             self.running = True
+            self.codec = JSON_CODEC
 
             # 发送连接消息
             connect_message = {
                 "type": "connect",
-                "username": self.username
+                "username": self.username,
+                "codecs": list(CODECS)  # 支持的编码，按优先级排列
             }
+            if self.room is not None:
+                connect_message["room"] = self.room
+            if self.udp and self.transport.datagrams:
+                connect_message["udp"] = True
             self._send_message(connect_message)
 
             # 启动接收消息线程
@@ -197,6 +238,8 @@ class GameClient:
                 self.client_socket.close()
             except:
                 pass
+        if self.datagram_channel is not None:
+            self.datagram_channel.close()
         self.connected = False
         print("已断开与服务器的连接")
         pygame.quit()
@@ -212,6 +255,17 @@ class GameClient:
         return (abs(x1 - x2) < self.player_size and 
                 abs(y1 - y2) < self.player_size)
                 
+    def _sync_player_grid(self):
+        # 将空间索引与本地游戏状态同步，只有跨越网格单元的玩家才需要移动
+        players = self.game_state.get("players", {}) if self.game_state else {}
+        for player_id in self.player_grid:
+            if player_id not in players:
+                self.player_grid.remove(player_id)
+        for player_id, player_data in list(players.items()):
+            position = player_data.get("position")
+            if position:
+                self.player_grid.update(player_id, position[0], position[1])
+
     def _find_nearest_target_in_range(self, max_range):
         # 查找射程范围内最近的目标
         if not self.game_state or not self.client_id or self.client_id not in self.game_state.get("players", {}):
@@ -220,20 +274,9 @@ class GameClient:
         # 获取当前玩家位置
         player_pos = self.game_state["players"][self.client_id]["position"]
         
-        nearest_player = None
-        min_distance = float('inf')
-        
-        # 查找最近的玩家
-        for other_id, other_player in self.game_state["players"].items():
-            if other_id != self.client_id:
-                other_pos = other_player["position"]
-                # 计算距离
-                distance = math.sqrt(max(0, (player_pos[0] - other_pos[0]) ** 2 + (player_pos[1] - other_pos[1]) ** 2))
-                if distance <= max_range and distance < min_distance:
-                    min_distance = distance
-                    nearest_player = other_id
-        
-        return nearest_player
+        # 通过空间索引查找最近的玩家
+        nearest = self.player_grid.nearest(player_pos[0], player_pos[1], 1, max_range, exclude=self.client_id)
+        return nearest[0][1] if nearest else None
 
     def _draw_target_frame(self, target_id):
         # 绘制目标红框
@@ -447,6 +490,9 @@ class GameClient:
             
         try:
             while self.running:
+                # 同步玩家位置的空间索引
+                self._sync_player_grid()
+
                 # 处理事件
                 self._handle_events()
                 
@@ -595,9 +641,11 @@ class GameClient:
 
         # 检测与其他玩家的碰撞
         collision_detected = False
-        for other_id, other_player in self.game_state["players"].items():
-            if other_id != self.client_id:
-                other_pos = other_player["position"]
+        # 碰撞箱是正方形，只需检查外接圆半径内的玩家
+        collision_radius = self.player_size * math.sqrt(2)
+        for _, other_id in sorted(self.player_grid.query_radius(new_x, new_y, collision_radius, exclude=self.client_id)):
+            other_pos = self.player_grid.position(other_id)
+            if other_pos is not None:
                 # 检测是否会与其他玩家碰撞
                 if self._check_player_collision(new_x, new_y, other_pos[0], other_pos[1]):
                     collision_detected = True
@@ -626,12 +674,8 @@ class GameClient:
         if collision_detected:
             new_x = max(30, min(self.map_width - self.player_size - 30, new_x))
             new_y = max(30, min(self.map_height - self.player_size - 30, new_y))
-        # 只有位置确实改变时才发送更新
+        # 只有位置确实改变时才发送更新，本地状态由send_move立即更新
         if new_x != current_pos[0] or new_y != current_pos[1]:
-            # 更新本地状态
-            self.game_state["players"][self.client_id]["position"] = [new_x, new_y]
-
-            # 发送位置更新到服务器
             self.send_move([new_x, new_y])
     
     def _update_player_positions(self):
@@ -1630,13 +1674,49 @@ class GameClient:
         self.message_callback = callback
 
     def send_move(self, position):
-        # 发送移动消息
-        move_message = {
-            "type": "move",
-            "position": position
-        }
+        # 发送带输入序号的移动消息，并立即在本地应用(客户端预测)
+        with self.prediction_lock:
+            self.input_seq += 1
+            player_data = self._own_player()
+            if player_data is not None:
+                current_pos = player_data.get("position", position)
+                self.pending_inputs.append((self.input_seq, position[0] - current_pos[0], position[1] - current_pos[1]))
+                player_data["position"] = [position[0], position[1]]
+                self.player_grid.update(self.client_id, position[0], position[1])
+            move_message = {
+                "type": "move",
+                "position": position,
+                "seq": self.input_seq
+            }
         self._send_message(move_message)
 
+    def _own_player(self):
+        if self.game_state and self.client_id in self.game_state.get("players", {}):
+            return self.game_state["players"][self.client_id]
+        return None
+
+    def _record_server_position(self, fields):
+        # 记录快照中自己的玩家记录(完整记录或增量中变化的字段)里的服务器位置和已确认的输入序号
+        if "position" in fields:
+            self.server_position = list(fields["position"])
+        if "input_seq" in fields:
+            self.acked_input_seq = fields["input_seq"]
+
+    def _reconcile_prediction(self):
+        # 丢弃已被服务器应用的输入，在服务器位置上重新叠加其余输入，得到自己的预测位置
+        with self.prediction_lock:
+            player_data = self._own_player()
+            if player_data is None or self.server_position is None:
+                return
+            while self.pending_inputs and self.pending_inputs[0][0] <= self.acked_input_seq:
+                self.pending_inputs.popleft()
+            x, y = self.server_position
+            for _, dx, dy in self.pending_inputs:
+                x += dx
+                y += dy
+            player_data["position"] = [x, y]
+            self.player_grid.update(self.client_id, x, y)
+
 
     def _send_base_change(self, base):
         # 发送进制变更请求
@@ -1672,7 +1752,9 @@ class GameClient:
             return False
 
         try:
-            self.client_socket.send(json.dumps(message).encode('utf-8'))
+            frame = encode_frame(self.codec.encode(message))
+            with self.send_lock:
+                self.client_socket.sendall(frame)
             return True
         except Exception as e:
             print(f"发送消息时出错: {e}")
@@ -1681,75 +1763,109 @@ class GameClient:
 
     def _receive_messages(self):
         # 接收服务器消息的线程函数
-        buffer = ""
+        # 传输的流按长度帧头切分出完整的消息
         while self.running:
             try:
-                data = self.client_socket.recv(4096)
-                if not data:
+                payloads = self.client_socket.receive()
+                if payloads is None:
                     # 服务器关闭连接
                     break
 
-                buffer += data.decode('utf-8')
-                
-                # 处理缓冲区中可能的多个JSON消息
-                while buffer:
+                # 处理收到的所有完整的消息
+                for payload in payloads:
                     try:
-                        # 尝试寻找完整的JSON对象边界
-                        try:
-                            # 寻找第一个有效的JSON对象
-                            json_obj, index = json.JSONDecoder().raw_decode(buffer)
-                            # 处理这个JSON对象
-                            self._process_server_message(json_obj)
-                            # 从缓冲区中移除已处理的JSON
-                            buffer = buffer[index:].lstrip()
-                            # 如果缓冲区为空，退出循环
-                            if not buffer:
-                                break
-                        except json.JSONDecodeError:
-                            # 如果缓冲区中没有完整的JSON对象，等待更多数据
-                            break
+                        with self.message_lock:
+                            self._process_server_message(decode_message(payload))
                     except Exception as e:
-                        print(f"处理JSON消息时出错: {e}, 缓冲区内容: {buffer[:100]}")
-                        # 尝试找到下一个可能的JSON对象开始位置
-                        try:
-                            next_json_start = buffer.find("{", 1)
-                            if next_json_start > 0:
-                                print(f"尝试跳过无效数据到下一个JSON起始位置: {next_json_start}")
-                                buffer = buffer[next_json_start:]
-                            else:
-                                # 没找到下一个JSON起始，清空缓冲区
-                                print("无法找到有效的JSON数据，清空缓冲区")
-                                buffer = ""
-                                break
-                        except:
-                            # 出现严重错误，清空缓冲区
-                            buffer = ""
-                            break
+                        # 帧边界由长度确定，单条消息出错不会影响后续消息
+                        print(f"处理服务器消息时出错: {e}, 消息内容: {bytes(payload[:100])}")
 
+            except FrameError as e:
+                print(f"收到无效的数据帧: {e}")
+                break
             except ConnectionError:
                 print("服务器连接已断开")
                 break
             except Exception as e:
+                if not self.running:
+                    break
                 print(f"接收消息时出错: {e}")
-                buffer = ""  # 出错时清空缓冲区
                 # 不要立即退出循环，尝试继续接收
 
         # 如果循环退出，确保客户端断开连接
         if self.running:
             self.disconnect()
 
+    def _start_datagram_channel(self, offer):
+        # 收到welcome中的UDP端口和令牌后在单独的线程中建立UDP通道
+        self.datagram_thread = threading.Thread(target=self._receive_datagrams, args=(offer,))
+        self.datagram_thread.daemon = True
+        self.datagram_thread.start()
+
+    def _receive_datagrams(self, offer):
+        # UDP接收线程：完成hello握手后处理服务器发来的玩家位置和快照，过期的数据报已被通道丢弃
+        try:
+            channel = DatagramChannel(self.host, offer["port"], offer["token"])
+        except (OSError, KeyError, ValueError) as e:
+            print(f"创建UDP通道时出错: {e}")
+            self._send_message({"type": "udp_fallback"})
+            return
+        if not channel.handshake():
+            print("UDP不可达，只使用TCP")
+            channel.close()
+            self._send_message({"type": "udp_fallback"})
+            return
+        self.datagram_channel = channel
+        print(f"UDP通道已建立: {self.host}:{offer['port']}")
+        while self.running:
+            try:
+                payload = channel.receive()
+            except OSError:
+                if not self.running or channel.sock.fileno() < 0:
+                    break
+                # ICMP错误等只影响单个数据报
+                continue
+            if payload is None:
+                continue
+            try:
+                with self.message_lock:
+                    self._process_server_message(decode_message(payload))
+            except Exception as e:
+                print(f"处理UDP消息时出错: {e}")
+
     def _process_server_message(self, message):
         # 处理从服务器接收到的消息
         message_type = message.get('type')
 
+        if message_type == 'event_bundle':
+            # 服务器每个tick合并发送的事件，按顺序逐个处理
+            for event in message.get('events', []):
+                try:
+                    self._process_server_message(event)
+                except Exception as e:
+                    # 单个事件出错不影响同一帧中的后续事件
+                    print(f"处理服务器事件 {event.get('type')} 时出错: {e}")
+            return
+
+        # 忽略比已应用版本更旧的快照
+        if message_type in ('game_update', 'game_delta') and self._is_stale_snapshot(message):
+            return
+
         if message_type == 'welcome':
             # 处理欢迎消息
             self.client_id = message.get('client_id')
             # 确保客户端ID是字符串格式，以便与玩家列表中的ID匹配
             if self.client_id is not None:
                 self.client_id = str(self.client_id)
+            # 之后的消息使用服务器选择的编码
+            self.codec = get_codec(message.get('codec'))
+            self.room = message.get('room', self.room)
             self.game_state = message.get('game_state')
             self.connected = True
+            if self.udp and message.get('udp'):
+                self._start_datagram_channel(message['udp'])
+            if self._own_player() is not None:
+                self._record_server_position(self._own_player())
             
             # 初始化所有玩家的位置插值数据
             if self.game_state and "players" in self.game_state:
@@ -1764,29 +1880,16 @@ class GameClient:
             # 设置初始玩家值
             self.player_value = 0
             print(message.get('message'))
+            # 欢迎消息是第一个完整关键帧
+            self._acknowledge_snapshot(message)
 
         elif message_type == 'player_moved':
-            # 处理玩家移动
-            player_id = message.get('client_id')
-            new_position = message.get('position')
-            if self.game_state and 'players' in self.game_state and player_id in self.game_state['players']:
-                # 立即更新游戏状态中的玩家位置
-                self.game_state['players'][player_id]['position'] = new_position.copy()
-                
-                # 为其他玩家进行位置插值
-                if str(player_id) != str(self.client_id):
-                    if player_id not in self.player_positions:
-                        self.player_positions[player_id] = {
-                            "current": new_position.copy(),
-                            "target": new_position.copy(),
-                            "last_update": time.time()
-                        }
-                    else:
-                        # 从当前位置开始插值
-                        current_pos = self.game_state['players'][player_id]['position'].copy()
-                        self.player_positions[player_id]["current"] = current_pos
-                        self.player_positions[player_id]["target"] = new_position.copy()
-                        self.player_positions[player_id]["last_update"] = time.time()
+            # 处理单个玩家移动
+            self._apply_player_move(message.get('client_id'), message.get('position'))
+        elif message_type == 'players_moved':
+            # 服务器每个tick批量发送的玩家位置 {player_id: [x, y]}
+            for player_id, new_position in message.get('positions', {}).items():
+                self._apply_player_move(player_id, new_position)
         elif message_type == 'player_joined':
             # 处理新玩家加入
             print(message.get('message'))
@@ -1865,12 +1968,25 @@ class GameClient:
             
             # 更新完整游戏状态
             self.game_state = new_game_state
+            if self._own_player() is not None:
+                self._record_server_position(self._own_player())
+                self._reconcile_prediction()
             
             # 更新玩家值
             if self.game_state and "players" in self.game_state and self.client_id in self.game_state["players"]:
                 player_data = self.game_state["players"][self.client_id]
                 if "value" in player_data:
                     self.player_value = player_data["value"]
+            self._acknowledge_snapshot(message)
+        elif message_type == 'game_delta':
+            # 相对于已确认版本的增量快照
+            complete = self._apply_game_delta(message)
+            self._reconcile_prediction()
+            if complete:
+                self._acknowledge_snapshot(message)
+            else:
+                # 不确认这个增量，否则服务器之后的增量仍以它为基准
+                self._send_message({"type": "keyframe_request"})
         elif message_type == 'base_changed':
             # 处理进制变化
             try:
@@ -2084,8 +2200,9 @@ class GameClient:
             new_bullets = message.get('bullets', [])
 
             if self.game_state and "bullets" in self.game_state:
-                # 将新子弹添加到游戏状态
-                self.game_state["bullets"].extend(new_bullets)
+                # 将新子弹添加到游戏状态(增量快照可能已经先带来了同一批子弹)
+                known_ids = {bullet.get("id") for bullet in self.game_state["bullets"]}
+                self.game_state["bullets"].extend(bullet for bullet in new_bullets if bullet.get("id") not in known_ids)
 
                 # 立即更新子弹插值状态
                 self._update_bullets()
@@ -2117,6 +2234,109 @@ class GameClient:
         if self.message_callback:
             self.message_callback(message)
 
+    def _apply_player_move(self, player_id, new_position):
+        # 更新其他玩家的位置，自己的位置以本地为准
+        player_id = str(player_id)
+        if new_position is None or player_id == str(self.client_id):
+            return
+        if self.game_state and 'players' in self.game_state and player_id in self.game_state['players']:
+            # 立即更新游戏状态中的玩家位置
+            self.game_state['players'][player_id]['position'] = list(new_position)
+
+            # 为其他玩家进行位置插值
+            if player_id not in self.player_positions:
+                self.player_positions[player_id] = {
+                    "current": list(new_position),
+                    "target": list(new_position),
+                    "last_update": time.time()
+                }
+            else:
+                # 从当前位置开始插值
+                self.player_positions[player_id]["current"] = list(new_position)
+                self.player_positions[player_id]["target"] = list(new_position)
+                self.player_positions[player_id]["last_update"] = time.time()
+
+    def _is_stale_snapshot(self, message):
+        # 快照版本不大于已应用的版本时视为过期
+        seq = message.get('seq')
+        return seq is not None and self.snapshot_seq is not None and seq <= self.snapshot_seq
+
+    def _acknowledge_snapshot(self, message):
+        # 记录已应用的快照版本并通知服务器，服务器之后只发送该版本之后的增量
+        seq = message.get('seq')
+        if seq is None:
+            return
+        self.snapshot_seq = seq
+        ack = {
+            "type": "snapshot_ack",
+            "seq": seq
+        }
+        if message.get('timestamp') is not None:
+            # 回传服务器发送快照的时间，服务器据此估计往返时间用于延迟补偿
+            ack["time"] = message['timestamp']
+        self._send_message(ack)
+
+    def _apply_game_delta(self, message):
+        """将增量快照应用到本地游戏状态，其中有本地没有完整记录的实体时返回False，需要请求关键帧"""
+        if not self.game_state or "players" not in self.game_state:
+            return True
+
+        complete = True
+        players = self.game_state["players"]
+        for player_id, fields in message.get("players", {}).items():
+            if player_id not in players:
+                if "username" not in fields:
+                    # 本地没有的玩家只收到部分字段，不能据此创建玩家
+                    complete = False
+                    continue
+                # 新加入的玩家，增量中包含完整记录
+                players[player_id] = fields
+                if player_id == str(self.client_id):
+                    self._record_server_position(fields)
+                continue
+
+            player_data = players[player_id]
+            if player_id == str(self.client_id):
+                self._record_server_position(fields)
+            if "position" in fields:
+                new_position = fields["position"]
+                player_data["position"] = new_position.copy()
+                # 更新其他玩家的插值系统
+                if player_id != str(self.client_id) and player_id in self.player_positions:
+                    self.player_positions[player_id]["current"] = new_position.copy()
+                    self.player_positions[player_id]["target"] = new_position.copy()
+                    self.player_positions[player_id]["last_update"] = time.time()
+            for field, value in fields.items():
+                if field != "position":
+                    player_data[field] = value
+
+        # 已离开游戏或离开视野的玩家
+        for player_id in message.get("removed_players", []) + message.get("left_players", []):
+            players.pop(str(player_id), None)
+            self.player_positions.pop(str(player_id), None)
+
+        # 子弹按ID更新，新子弹包含完整记录
+        bullets = self.game_state.setdefault("bullets", [])
+        bullet_map = {str(bullet.get("id")): bullet for bullet in bullets}
+        for bullet_id, fields in message.get("bullets", {}).items():
+            if bullet_id in bullet_map:
+                bullet_map[bullet_id].update(fields)
+            elif "id" in fields:
+                bullets.append(fields)
+            else:
+                complete = False
+        removed_bullets = {str(bullet_id) for bullet_id in message.get("removed_bullets", []) + message.get("left_bullets", [])}
+        if removed_bullets:
+            self.game_state["bullets"] = [bullet for bullet in bullets if str(bullet.get("id")) not in removed_bullets]
+
+        if "base_conversions" in message:
+            self.game_state["base_conversions"] = message["base_conversions"]
+
+        # 更新玩家值
+        if self.client_id in players and "value" in players[self.client_id]:
+            self.player_value = players[self.client_id]["value"]
+        return complete
+
     def _draw_skill_buttons(self):
         # 绘制底部的技能按钮
         self._draw_skill_buttons_common(self.skills)
@@ -2696,16 +2916,8 @@ class GameClient:
         # 获取当前玩家位置
         player_pos = self.game_state["players"][self.client_id]["position"]
         
-        # 检查是否有其他玩家在指定范围内
-        for other_id, other_player in self.game_state["players"].items():
-            if other_id != self.client_id:
-                other_pos = other_player["position"]
-                # 计算距离
-                distance = math.sqrt(max(0, (player_pos[0] - other_pos[0]) ** 2 + (player_pos[1] - other_pos[1]) ** 2))
-                if distance <= max_range:
-                    return True
-        
-        return False
+        # 通过空间索引检查是否有其他玩家在指定范围内
+        return self.player_grid.any_within(player_pos[0], player_pos[1], max_range, exclude=self.client_id)
         
     def _check_cooldown(self, skill_name):
         current_time = time.time()
@@ -2736,10 +2948,11 @@ if __name__ == "__main__":
     parser.add_argument("--host", default="localhost", help="服务器主机名")
     parser.add_argument("--port", type=int, default=5555, help="服务器端口")
     parser.add_argument("--username", default=f"Player_{random.randint(100, 999)}", help="玩家用户名")
+    parser.add_argument("--room", help="要加入的房间名，不存在时由服务器创建")
     args = parser.parse_args()
     
     # 创建并连接客户端
-    client = GameClient(host=args.host, port=args.port, username=args.username)
+    client = GameClient(host=args.host, port=args.port, username=args.username, room=args.room)
     
     def handle_message(message):
         message_type = message.get('type')
@@ -0,0 +1,507 @@
+# codec.py
+# 可协商的消息编码
+#
+# 客户端在connect握手中列出支持的编码(按优先级)，服务器选择第一个双方都支持的
+# 编码并在welcome消息中告知；welcome本身总是JSON。之后双方都用协商好的编码发送。
+#
+# binary编码用struct打包最频繁的消息(move、player_moved、players_moved、
+# game_update/game_delta中的玩家记录、bullets_created、bullet_hit和每个tick的
+# 事件包)：消息类型是一个字节的整数ID，坐标和速度量化为1/100像素的int32。
+# move消息可以在坐标后带一个uint32的输入序号，解码时按长度区分。
+# 其余消息以及字段不符合二进制格式的消息仍然编码为JSON。
+# JSON负载总是以'{'开头，二进制负载以类型ID开头，所以解码时不需要知道协商结果。
+#
+# 解码结果与JSON解码得到的字典相同：字典的键是字符串，元组变为列表，
+# 坐标和速度精确到POSITION_SCALE分之一。
+#
+# 启用兴趣区域时每个客户端的增量包含不同的实体，encode_record()单独编码每个实体记录，
+# encode_delta()把这些编码结果拼接为完整的game_delta，同一版本中相同的记录只编码一次。
+
+import struct
+
+from protocol import MAX_FRAME_SIZE, encode_frame, encode_payload, encode_payload_with, encode_bundle_frames, decode_payload
+
+# 坐标和速度的量化精度(每像素的单位数)
+POSITION_SCALE = 100
+
+# 二进制消息的类型ID，不能等于ord('{')
+TYPE_MOVE = 1
+TYPE_PLAYER_MOVED = 2
+TYPE_PLAYERS_MOVED = 3
+TYPE_GAME_UPDATE = 4
+TYPE_GAME_DELTA = 5
+TYPE_BULLETS_CREATED = 6
+TYPE_BULLET_HIT = 7
+TYPE_EVENT_BUNDLE = 8
+
+_JSON_MARKER = ord('{')
+
+_MOVE = struct.Struct('!B2i')                      # 类型, x, y
+_MOVE_SEQ = struct.Struct('!B2iI')                 # 类型, x, y, 输入序号
+_PLAYER_MOVED = struct.Struct('!BII2i')            # 类型, tick, client_id, x, y
+_PLAYERS_MOVED = struct.Struct('!BII')             # 类型, tick, 数量
+_PLAYER_POSITION = struct.Struct('!I2i')           # client_id, x, y
+_GAME_UPDATE = struct.Struct('!BIId')              # 类型, seq, tick, timestamp
+_GAME_DELTA = struct.Struct('!BIIId')              # 类型, seq, tick, base, timestamp
+_BULLETS_CREATED = struct.Struct('!BIII')          # 类型, tick, owner_id, 数量
+_BULLET = struct.Struct('!II2i2iid')               # id, owner, x, y, vx, vy, damage, created_time
+_BULLET_HIT = struct.Struct('!BIIIi2i')            # 类型, tick, bullet_id, target_id, damage, x, y
+_EVENT_BUNDLE = struct.Struct('!BII')              # 类型, tick, 事件数
+_COUNT = struct.Struct('!I')
+_RECORD_HEADER = struct.Struct('!IH')              # 玩家ID, 字段掩码
+_XY = struct.Struct('!2i')
+_LENGTH = struct.Struct('!I')
+
+# 玩家记录的字段及其格式，按掩码位的顺序排列
+PLAYER_FIELDS = (
+    ("position", "xy"),
+    ("score", "i"),
+    ("username", "str"),
+    ("value", "i"),
+    ("target_value", "i"),
+    ("base", "B"),
+    ("memory_usage", "i"),
+    ("max_memory", "i"),
+    ("memory_release_active", "?"),
+    ("memory_release_time", "d"),
+    ("input_seq", "I"),
+)
+_PLAYER_FIELD_NAMES = {name for name, _ in PLAYER_FIELDS}
+_SCALARS = {fmt: struct.Struct('!' + fmt) for fmt in ("i", "I", "B", "?", "d")}
+
+# 所有子弹共用的显示属性，不在二进制格式中传输
+_BULLET_CHAR = "*"
+_BULLET_COLOR = [212, 212, 212]
+
+_INT32_MIN = -(1 << 31)
+_INT32_MAX = (1 << 31) - 1
+
+
+class _Unsupported(Exception):
+    """消息不符合二进制格式，改用JSON编码"""
+
+
+def _quantize(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise _Unsupported()
+    return int(round(value * POSITION_SCALE))
+
+
+def _dequantize(value):
+    return value / POSITION_SCALE
+
+
+def _pack_xy(point):
+    if not isinstance(point, (list, tuple)) or len(point) != 2:
+        raise _Unsupported()
+    return _XY.pack(_quantize(point[0]), _quantize(point[1]))
+
+
+def _check_keys(message, keys):
+    if set(message) != keys:
+        raise _Unsupported()
+
+
+def _uint(value):
+    # 实体ID和tick等非负整数，服务器端的字典键可能已经是字符串
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value < (1 << 32):
+        raise _Unsupported()
+    return value
+
+
+def _int32(value):
+    if isinstance(value, bool) or not isinstance(value, int) or not _INT32_MIN <= value <= _INT32_MAX:
+        raise _Unsupported()
+    return value
+
+
+def _encode_player_record(player_id, record):
+    # 一个玩家记录: 玩家ID, 字段掩码, 掩码中的字段
+    if not isinstance(record, dict) or not set(record) <= _PLAYER_FIELD_NAMES:
+        raise _Unsupported()
+    mask = 0
+    fields = []
+    for bit, (name, fmt) in enumerate(PLAYER_FIELDS):
+        if name not in record:
+            continue
+        mask |= 1 << bit
+        value = record[name]
+        if fmt == "xy":
+            fields.append(_pack_xy(value))
+        elif fmt == "str":
+            if not isinstance(value, str):
+                raise _Unsupported()
+            raw = value.encode('utf-8')
+            if len(raw) > 255:
+                raise _Unsupported()
+            fields.append(bytes((len(raw),)) + raw)
+        elif fmt == "i":
+            fields.append(_SCALARS[fmt].pack(_int32(value)))
+        elif fmt == "I":
+            fields.append(_SCALARS[fmt].pack(_uint(value)))
+        elif fmt == "B":
+            if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= 255:
+                raise _Unsupported()
+            fields.append(_SCALARS[fmt].pack(value))
+        elif fmt == "?":
+            if not isinstance(value, bool):
+                raise _Unsupported()
+            fields.append(_SCALARS[fmt].pack(value))
+        else:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise _Unsupported()
+            fields.append(_SCALARS[fmt].pack(value))
+    return _RECORD_HEADER.pack(_uint(player_id), mask) + b''.join(fields)
+
+
+def _encode_players(players):
+    # 玩家记录块: 数量 + [玩家ID, 字段掩码, 掩码中的字段...]
+    parts = [_COUNT.pack(len(players))]
+    for player_id, record in players.items():
+        parts.append(_encode_player_record(player_id, record))
+    return b''.join(parts)
+
+
+def _decode_players(view, offset):
+    (count,) = _COUNT.unpack_from(view, offset)
+    offset += _COUNT.size
+    players = {}
+    for _ in range(count):
+        player_id, mask = _RECORD_HEADER.unpack_from(view, offset)
+        offset += _RECORD_HEADER.size
+        record = {}
+        for bit, (name, fmt) in enumerate(PLAYER_FIELDS):
+            if not mask & (1 << bit):
+                continue
+            if fmt == "xy":
+                x, y = _XY.unpack_from(view, offset)
+                record[name] = [_dequantize(x), _dequantize(y)]
+                offset += _XY.size
+            elif fmt == "str":
+                length = view[offset]
+                record[name] = bytes(view[offset + 1:offset + 1 + length]).decode('utf-8')
+                offset += 1 + length
+            else:
+                scalar = _SCALARS[fmt]
+                (record[name],) = scalar.unpack_from(view, offset)
+                offset += scalar.size
+        players[str(player_id)] = record
+    return players, offset
+
+
+def _encode_json_blob(value):
+    raw = encode_payload(value)
+    return _LENGTH.pack(len(raw)) + raw
+
+
+def _decode_json_blob(view, offset):
+    (length,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    return decode_payload(bytes(view[offset:offset + length])), offset + length
+
+
+# 各类型消息的二进制编码，消息不符合格式时抛出_Unsupported
+
+def _encode_move(message):
+    if "seq" in message:
+        _check_keys(message, {"type", "position", "seq"})
+        return bytes((TYPE_MOVE,)) + _pack_xy(message["position"]) + _COUNT.pack(_uint(message["seq"]))
+    _check_keys(message, {"type", "position"})
+    return bytes((TYPE_MOVE,)) + _pack_xy(message["position"])
+
+
+def _encode_player_moved(message):
+    _check_keys(message, {"type", "client_id", "position", "tick"})
+    return struct.pack('!BII', TYPE_PLAYER_MOVED, _uint(message["tick"]), _uint(message["client_id"])) + _pack_xy(message["position"])
+
+
+def _encode_players_moved(message):
+    _check_keys(message, {"type", "positions", "tick"})
+    positions = message["positions"]
+    parts = [_PLAYERS_MOVED.pack(TYPE_PLAYERS_MOVED, _uint(message["tick"]), len(positions))]
+    for player_id, position in positions.items():
+        parts.append(_COUNT.pack(_uint(player_id)) + _pack_xy(position))
+    return b''.join(parts)
+
+
+def _encode_game_update(message):
+    _check_keys(message, {"type", "seq", "tick", "timestamp", "game_state"})
+    game_state = message["game_state"]
+    if not isinstance(game_state, dict) or "players" not in game_state:
+        raise _Unsupported()
+    rest = {key: value for key, value in game_state.items() if key != "players"}
+    return (struct.pack('!BIId', TYPE_GAME_UPDATE, _uint(message["seq"]), _uint(message["tick"]), message["timestamp"])
+            + _encode_players(game_state["players"]) + _encode_json_blob(rest))
+
+
+def _encode_game_delta(message):
+    if not {"type", "seq", "tick", "base", "timestamp"} <= set(message):
+        raise _Unsupported()
+    players = message.get("players")
+    rest = {key: value for key, value in message.items()
+            if key not in ("type", "seq", "tick", "base", "timestamp", "players")}
+    header = struct.pack('!BIIId', TYPE_GAME_DELTA, _uint(message["seq"]), _uint(message["tick"]),
+                         _uint(message["base"]), message["timestamp"])
+    # 增量中没有玩家变化时不发送players字段
+    has_players = bytes((1 if players is not None else 0,))
+    body = _encode_players(players) if players is not None else b''
+    return header + has_players + body + _encode_json_blob(rest)
+
+
+def _encode_bullets_created(message):
+    _check_keys(message, {"type", "bullets", "owner_id", "tick"})
+    bullets = message["bullets"]
+    parts = [_BULLETS_CREATED.pack(TYPE_BULLETS_CREATED, _uint(message["tick"]), _uint(message["owner_id"]), len(bullets))]
+    for bullet in bullets:
+        _check_keys(bullet, {"id", "owner", "position", "velocity", "damage", "created_time", "char", "color"})
+        if bullet["char"] != _BULLET_CHAR or list(bullet["color"]) != _BULLET_COLOR:
+            raise _Unsupported()
+        position, velocity = bullet["position"], bullet["velocity"]
+        if len(position) != 2 or len(velocity) != 2:
+            raise _Unsupported()
+        parts.append(_BULLET.pack(_uint(bullet["id"]), _uint(bullet["owner"]),
+                                  _quantize(position[0]), _quantize(position[1]),
+                                  _quantize(velocity[0]), _quantize(velocity[1]),
+                                  _int32(bullet["damage"]), bullet["created_time"]))
+    return b''.join(parts)
+
+
+def _encode_bullet_hit(message):
+    _check_keys(message, {"type", "bullet_id", "target_id", "damage", "position", "tick"})
+    return (struct.pack('!BIIIi', TYPE_BULLET_HIT, _uint(message["tick"]), _uint(message["bullet_id"]),
+                        _uint(message["target_id"]), _int32(message["damage"]))
+            + _pack_xy(message["position"]))
+
+
+_ENCODERS = {
+    "move": _encode_move,
+    "player_moved": _encode_player_moved,
+    "players_moved": _encode_players_moved,
+    "game_update": _encode_game_update,
+    "game_delta": _encode_game_delta,
+    "bullets_created": _encode_bullets_created,
+    "bullet_hit": _encode_bullet_hit,
+}
+
+
+# 各类型消息的二进制解码
+
+def _decode_move(view):
+    if len(view) >= _MOVE_SEQ.size:
+        _, x, y, seq = _MOVE_SEQ.unpack_from(view)
+        return {"type": "move", "position": [_dequantize(x), _dequantize(y)], "seq": seq}
+    _, x, y = _MOVE.unpack_from(view)
+    return {"type": "move", "position": [_dequantize(x), _dequantize(y)]}
+
+
+def _decode_player_moved(view):
+    _, tick, client_id, x, y = _PLAYER_MOVED.unpack_from(view)
+    return {"type": "player_moved", "client_id": client_id, "position": [_dequantize(x), _dequantize(y)], "tick": tick}
+
+
+def _decode_players_moved(view):
+    _, tick, count = _PLAYERS_MOVED.unpack_from(view)
+    positions = {}
+    offset = _PLAYERS_MOVED.size
+    for _ in range(count):
+        player_id, x, y = _PLAYER_POSITION.unpack_from(view, offset)
+        positions[str(player_id)] = [_dequantize(x), _dequantize(y)]
+        offset += _PLAYER_POSITION.size
+    return {"type": "players_moved", "positions": positions, "tick": tick}
+
+
+def _decode_game_update(view):
+    _, seq, tick, timestamp = _GAME_UPDATE.unpack_from(view)
+    players, offset = _decode_players(view, _GAME_UPDATE.size)
+    rest, _ = _decode_json_blob(view, offset)
+    game_state = {"players": players}
+    game_state.update(rest)
+    return {"type": "game_update", "seq": seq, "tick": tick, "timestamp": timestamp, "game_state": game_state}
+
+
+def _decode_game_delta(view):
+    _, seq, tick, base, timestamp = _GAME_DELTA.unpack_from(view)
+    offset = _GAME_DELTA.size
+    message = {"type": "game_delta", "seq": seq, "tick": tick, "base": base, "timestamp": timestamp}
+    has_players = view[offset]
+    offset += 1
+    if has_players:
+        message["players"], offset = _decode_players(view, offset)
+    rest, _ = _decode_json_blob(view, offset)
+    message.update(rest)
+    return message
+
+
+def _decode_bullets_created(view):
+    _, tick, owner_id, count = _BULLETS_CREATED.unpack_from(view)
+    bullets = []
+    offset = _BULLETS_CREATED.size
+    for _ in range(count):
+        bullet_id, owner, x, y, vx, vy, damage, created_time = _BULLET.unpack_from(view, offset)
+        offset += _BULLET.size
+        bullets.append({
+            "id": bullet_id,
+            "owner": owner,
+            "position": [_dequantize(x), _dequantize(y)],
+            "velocity": [_dequantize(vx), _dequantize(vy)],
+            "damage": damage,
+            "created_time": created_time,
+            "char": _BULLET_CHAR,
+            "color": list(_BULLET_COLOR)
+        })
+    return {"type": "bullets_created", "bullets": bullets, "owner_id": owner_id, "tick": tick}
+
+
+def _decode_bullet_hit(view):
+    _, tick, bullet_id, target_id, damage, x, y = _BULLET_HIT.unpack_from(view)
+    return {"type": "bullet_hit", "bullet_id": bullet_id, "target_id": target_id, "damage": damage,
+            "position": [_dequantize(x), _dequantize(y)], "tick": tick}
+
+
+def _decode_event_bundle(view):
+    _, tick, count = _EVENT_BUNDLE.unpack_from(view)
+    events = []
+    offset = _EVENT_BUNDLE.size
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size
+        events.append(decode_message(view[offset:offset + length]))
+        offset += length
+    return {"type": "event_bundle", "tick": tick, "events": events}
+
+
+_DECODERS = {
+    TYPE_MOVE: _decode_move,
+    TYPE_PLAYER_MOVED: _decode_player_moved,
+    TYPE_PLAYERS_MOVED: _decode_players_moved,
+    TYPE_GAME_UPDATE: _decode_game_update,
+    TYPE_GAME_DELTA: _decode_game_delta,
+    TYPE_BULLETS_CREATED: _decode_bullets_created,
+    TYPE_BULLET_HIT: _decode_bullet_hit,
+    TYPE_EVENT_BUNDLE: _decode_event_bundle,
+}
+
+
+def decode_message(payload):
+    """解码一个JSON或二进制负载为消息字典，格式错误时抛出ValueError"""
+    if not len(payload):
+        raise ValueError("空的消息负载")
+    if payload[0] == _JSON_MARKER:
+        return decode_payload(bytes(payload))
+    decoder = _DECODERS.get(payload[0])
+    if decoder is None:
+        raise ValueError(f"未知的二进制消息类型 {payload[0]}")
+    try:
+        return decoder(memoryview(payload))
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"二进制消息格式错误: {e}")
+
+
+class JsonCodec:
+    """所有消息都编码为JSON"""
+    name = "json"
+
+    def encode(self, message):
+        return encode_payload(message)
+
+    def encode_record(self, kind, entity_id, record):
+        """
+        编码game_delta中的一个实体记录，同一版本中相同的记录可以由多个客户端的增量共用
+        不符合格式时返回None
+        """
+        return encode_payload({str(entity_id): record})[1:-1]
+
+    def encode_delta(self, message, records):
+        """
+        编码game_delta消息，records为{kind: [encode_record的结果]}，其余字段在message中
+        记录不符合格式时返回None，调用者改用JSON编码
+        """
+        return encode_payload_with(message, **{kind: b'{' + b','.join(parts) + b'}'
+                                              for kind, parts in records.items() if parts})
+
+    def encode_bundle(self, tick, payloads):
+        """把本tick的事件负载合并为帧的列表"""
+        return encode_bundle_frames({"type": "event_bundle", "tick": tick}, payloads)
+
+
+class BinaryCodec(JsonCodec):
+    """热点消息编码为二进制，其余消息编码为JSON"""
+    name = "binary"
+
+    def encode(self, message):
+        encoder = _ENCODERS.get(message.get("type"))
+        if encoder is not None:
+            try:
+                return encoder(message)
+            except (_Unsupported, struct.error, TypeError, KeyError, OverflowError):
+                pass
+        return encode_payload(message)
+
+    def encode_record(self, kind, entity_id, record):
+        if kind != "players":
+            return super().encode_record(kind, entity_id, record)
+        try:
+            return _encode_player_record(entity_id, record)
+        except (_Unsupported, struct.error, TypeError, KeyError, OverflowError):
+            return None
+
+    def encode_delta(self, message, records):
+        # 与_encode_game_delta的格式相同，玩家记录是已经编码好的二进制，其余实体记录拼接到JSON部分
+        players = records.get("players")
+        if players is not None and None in players:
+            return None
+        try:
+            header = _GAME_DELTA.pack(TYPE_GAME_DELTA, _uint(message["seq"]), _uint(message["tick"]),
+                                      _uint(message["base"]), message["timestamp"])
+        except (_Unsupported, struct.error, TypeError, KeyError):
+            return None
+        body = bytes((0,))
+        if players:
+            body = bytes((1,)) + _COUNT.pack(len(players)) + b''.join(players)
+        rest = {key: value for key, value in message.items() if key not in ("type", "seq", "tick", "base", "timestamp")}
+        raw = super().encode_delta(rest, {kind: parts for kind, parts in records.items() if kind != "players"})
+        return header + body + _LENGTH.pack(len(raw)) + raw
+
+    def encode_bundle(self, tick, payloads):
+        frames = []
+        batch = []
+        size = _EVENT_BUNDLE.size
+        for payload in payloads:
+            if batch and size + _LENGTH.size + len(payload) > MAX_FRAME_SIZE:
+                frames.append(self._bundle_frame(tick, batch))
+                batch = []
+                size = _EVENT_BUNDLE.size
+            batch.append(payload)
+            size += _LENGTH.size + len(payload)
+        if batch:
+            frames.append(self._bundle_frame(tick, batch))
+        return frames
+
+    def _bundle_frame(self, tick, payloads):
+        parts = [_EVENT_BUNDLE.pack(TYPE_EVENT_BUNDLE, tick, len(payloads))]
+        for payload in payloads:
+            parts.append(_LENGTH.pack(len(payload)))
+            parts.append(payload)
+        return encode_frame(b''.join(parts))
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+
+# 按名称查找编码，客户端默认按此顺序请求
+CODECS = {codec.name: codec for codec in (BINARY_CODEC, JSON_CODEC)}
+
+
+def negotiate_codec(requested):
+    """从客户端请求的编码列表中选择第一个支持的编码，没有时使用JSON"""
+    if isinstance(requested, list):
+        for name in requested:
+            if name in CODECS:
+                return CODECS[name]
+    return JSON_CODEC
+
+
+def get_codec(name):
+    return CODECS.get(name, JSON_CODEC)
@@ -0,0 +1,227 @@
+# datagram.py
+# 可选的UDP通道，传输只需要最新一份的状态消息
+#
+# 所有消息都走同一个TCP连接时，丢失一个报文段会阻塞之后的全部消息。客户端在connect握手中声明"udp": true，
+# 服务器开启UDP时在welcome中返回 {"port": UDP端口, "token": 令牌}，客户端向该端口发送带令牌的hello，
+# 服务器据此把UDP地址关联到客户端的连接并回复确认。之后每个tick的玩家位置(players_moved)和快照
+# (game_update/game_delta)改为UDP数据报发送，其余事件(bullet_hit、base_changed、chat等)仍走TCP。
+# 快照是相对于客户端已确认版本的增量，丢失的数据报由下一次快照弥补，不需要重传。
+#
+# 数据报格式(一个字节的类型 + 内容):
+#   H + 令牌         客户端hello，也作为保活定期发送，客户端地址变化时服务器更新地址
+#   A + 令牌         服务器对hello的确认
+#   D + 序号(uint32) + 消息负载   服务器发出的状态消息，负载与TCP上的消息编码相同；客户端丢弃不比已收到的更新的数据报
+# 客户端在HELLO_TIMEOUT内没有收到确认时通过TCP发送udp_fallback，之后只使用TCP。
+
+import asyncio
+import os
+import socket
+import struct
+import threading
+import time
+
+HELLO = b'H'
+HELLO_ACK = b'A'
+DATA = b'D'
+
+TOKEN_SIZE = 8
+DATA_HEADER = struct.Struct('!cI')  # 类型, 序号
+
+# 走UDP的消息类型(事件的合并键中的类型)，都是只需要最新一份的状态
+DATAGRAM_MESSAGES = frozenset({"players_moved", "game_update"})
+
+# 单个数据报的最大负载，超过的消息(例如玩家很多时的关键帧)仍走TCP，避免IP分片
+MAX_DATAGRAM_PAYLOAD = 1200
+
+# 客户端发送hello的间隔和等待确认的最长时间(秒)
+HELLO_INTERVAL = 0.2
+HELLO_TIMEOUT = 2.0
+
+# 客户端发送保活hello的间隔(秒)
+KEEPALIVE_INTERVAL = 5.0
+
+_SEQ_MOD = 1 << 32
+
+
+def is_newer(seq, last):
+    """按序号回绕比较，seq比last新时返回True"""
+    return 0 < (seq - last) % _SEQ_MOD < _SEQ_MOD // 2
+
+
+class DatagramPeer:
+    """一个客户端的UDP地址和发送序号，由连接对象的datagram属性持有，只在tick线程中发送"""
+    __slots__ = ("endpoint", "address", "seq")
+
+    def __init__(self, endpoint, address):
+        self.endpoint = endpoint
+        self.address = address
+        self.seq = 0
+
+    def send(self, payload):
+        self.seq = (self.seq + 1) % _SEQ_MOD
+        self.endpoint.sendto(DATA_HEADER.pack(DATA, self.seq) + payload, self.address)
+
+
+class _EndpointProtocol(asyncio.DatagramProtocol):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def datagram_received(self, data, address):
+        self.endpoint.handle(data, address)
+
+    def error_received(self, exc):
+        # ICMP端口不可达等错误只影响单个数据报
+        pass
+
+
+class DatagramEndpoint:
+    """服务器的UDP端口：按令牌把客户端的UDP地址关联到连接，并发送状态数据报"""
+
+    def __init__(self):
+        self.port = None
+        self._tokens = {}  # {令牌: 连接}
+        self._lock = threading.Lock()  # threaded模式下IO线程登记令牌，UDP线程查找令牌
+        self._socket = None
+        self._transport = None
+        self._thread = None
+
+    def start_threaded(self, host, port):
+        """绑定UDP端口并启动接收线程，port为0时由系统分配"""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, name="udp-endpoint")
+        self._thread.daemon = True
+        self._thread.start()
+        print(f"UDP通道已启动，监听 {host}:{self.port}")
+
+    async def start_asyncio(self, host, port):
+        """在当前事件循环中绑定UDP端口"""
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(lambda: _EndpointProtocol(self),
+                                                                  local_addr=(host, port))
+        self.port = self._transport.get_extra_info('sockname')[1]
+        print(f"UDP通道已启动，监听 {host}:{self.port}")
+
+    def _serve(self):
+        while True:
+            try:
+                data, address = self._socket.recvfrom(64)
+            except OSError:
+                break
+            self.handle(data, address)
+
+    def offer(self, connection):
+        """为连接生成令牌，welcome消息中带上connection.datagram_offer"""
+        token = os.urandom(TOKEN_SIZE)
+        with self._lock:
+            self._tokens[token] = connection
+        connection.datagram_token = token
+        connection.datagram_offer = {"port": self.port, "token": token.hex()}
+
+    def withdraw(self, connection):
+        """客户端断开或放弃UDP时注销令牌，之后的消息都走TCP"""
+        with self._lock:
+            self._tokens.pop(connection.datagram_token, None)
+        connection.datagram = None
+
+    def handle(self, data, address):
+        if len(data) != 1 + TOKEN_SIZE or data[:1] != HELLO:
+            return
+        token = data[1:]
+        with self._lock:
+            connection = self._tokens.get(token)
+        if connection is None:
+            return
+        peer = connection.datagram
+        if peer is None:
+            connection.datagram = DatagramPeer(self, address)
+        else:
+            # NAT重新映射后客户端的地址可能变化，序号继续递增
+            peer.address = address
+        self.sendto(HELLO_ACK + token, address)
+
+    def sendto(self, data, address):
+        # 数据报允许丢失，发送缓冲区满或地址不可达时直接丢弃
+        try:
+            if self._transport is not None:
+                self._transport.sendto(data, address)
+            elif self._socket is not None:
+                self._socket.sendto(data, getattr(socket, 'MSG_DONTWAIT', 0), address)
+        except OSError:
+            pass
+
+    def close(self):
+        # 可以重复调用；asyncio模式下需要在事件循环结束前调用
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._socket is not None:
+            try:
+                # shutdown会唤醒阻塞在recvfrom上的线程
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+
+
+class DatagramChannel:
+    """客户端的UDP通道，在客户端的UDP接收线程中使用"""
+
+    def __init__(self, host, port, token):
+        self.token = bytes.fromhex(token)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((host, port))
+        self.last_seq = None
+        self.stale = 0  # 被丢弃的过期数据报数
+        self._last_hello = 0.0
+
+    def _send_hello(self):
+        self._last_hello = time.monotonic()
+        try:
+            self.sock.send(HELLO + self.token)
+        except OSError:
+            pass
+
+    def handshake(self, timeout=HELLO_TIMEOUT):
+        """重复发送hello直到收到确认，超时返回False"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self._send_hello()
+            self.sock.settimeout(HELLO_INTERVAL)
+            try:
+                while True:
+                    data = self.sock.recv(65535)
+                    # 确认可能丢失，收到状态数据报同样说明服务器已关联地址
+                    if data == HELLO_ACK + self.token or data[:1] == DATA:
+                        return True
+            except socket.timeout:
+                continue
+            except OSError:
+                # 端口不可达
+                time.sleep(HELLO_INTERVAL)
+        return False
+
+    def receive(self):
+        """等待下一个数据报，返回比之前收到的都新的消息负载；超时、确认或过期的数据报返回None"""
+        timeout = self._last_hello + KEEPALIVE_INTERVAL - time.monotonic()
+        if timeout <= 0:
+            self._send_hello()
+            timeout = KEEPALIVE_INTERVAL
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(65535)
+        except socket.timeout:
+            return None
+        if len(data) < DATA_HEADER.size or data[:1] != DATA:
+            return None
+        _, seq = DATA_HEADER.unpack_from(data)
+        if self.last_seq is not None and not is_newer(seq, self.last_seq):
+            self.stale += 1
+            return None
+        self.last_seq = seq
+        return data[DATA_HEADER.size:]
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,101 @@
+# history.py
+# 延迟补偿使用的玩家位置历史
+#
+# 客户端看到的其他玩家落后于服务器：状态经过约半个往返时间才到达客户端，客户端再把玩家平滑地插值到新位置，
+# 射击命令又经过约半个往返时间才到达服务器。因此子弹与玩家的碰撞检测把目标玩家回退到射击者看到的时刻
+# (当前时间 - 射击者的往返时间 - 插值延迟)，而不是使用玩家的当前位置。
+#
+# 服务器每个tick应用移动后记录所有玩家的位置和tick开始时间，保留最近HISTORY_SECONDS秒。
+# 位置存放在预分配的环形数组(帧, 槽位, 2)中：移动只修改当前位置数组中该玩家的槽位，
+# 记录一帧是把当前位置整体复制到环形数组的下一帧，不分配新的对象。
+# 玩家按槽位存放，离开的玩家的槽位放入空闲列表由之后加入的玩家复用，不够时按两倍扩容。
+
+import math
+
+import numpy as np
+
+# 保留的历史长度(秒)，也是碰撞检测最多回退的时间
+HISTORY_SECONDS = 1.0
+
+# 客户端显示其他玩家时的插值延迟(秒)：客户端用300毫秒的easeOutCubic把玩家从显示位置移向最新位置，
+# 显示位置平均落后约100毫秒
+INTERPOLATION_DELAY = 0.1
+
+# 初始的玩家槽位数，不够时按两倍扩容
+DEFAULT_CAPACITY = 64
+
+
+class PositionHistory:
+    """最近HISTORY_SECONDS秒内每个tick的玩家位置，只在房间的tick线程中使用"""
+
+    def __init__(self, tick_interval, seconds=HISTORY_SECONDS, capacity=DEFAULT_CAPACITY):
+        # 覆盖seconds秒需要的帧数，再加上当前帧
+        self.length = int(math.ceil(seconds / tick_interval)) + 1
+        self.times = np.zeros(self.length, dtype=np.float64)  # 每帧的tick开始时间
+        self.latest = -1  # 最近记录的帧
+        self.recorded = 0  # 环形数组中已记录的帧数
+        self.slots = {}  # {player_id: 槽位}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.positions = np.zeros((self.length, capacity, 2), dtype=np.float64)
+        self.current = np.zeros((capacity, 2), dtype=np.float64)
+        self._free = list(range(capacity - 1, -1, -1))  # 空闲槽位，后进先出
+
+    def _grow(self):
+        # 容量翻倍，已有数据复制到新数组的前半部分
+        old_capacity = self.capacity
+        positions, current = self.positions, self.current
+        self._allocate(old_capacity * 2)
+        self.positions[:, :old_capacity] = positions
+        self.current[:old_capacity] = current
+        self._free = list(range(old_capacity * 2 - 1, old_capacity - 1, -1))
+
+    @property
+    def capacity(self):
+        return len(self.current)
+
+    def add(self, player_id, position):
+        """加入玩家，加入之前的历史都视为在position"""
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self.slots[player_id] = slot
+        self.current[slot] = position[:2]
+        self.positions[:, slot] = position[:2]
+
+    def remove(self, player_id):
+        slot = self.slots.pop(player_id, None)
+        if slot is not None:
+            self._free.append(slot)
+
+    def move(self, player_id, position):
+        """更新玩家的当前位置，在下一次record时进入历史"""
+        slot = self.slots.get(player_id)
+        if slot is not None:
+            self.current[slot] = position[:2]
+
+    def record(self, now):
+        """把所有玩家的当前位置记录为时间now的一帧，覆盖最旧的一帧"""
+        self.latest = (self.latest + 1) % self.length
+        np.copyto(self.positions[self.latest], self.current)
+        self.times[self.latest] = now
+        self.recorded = min(self.recorded + 1, self.length)
+
+    def frames_at(self, times):
+        """返回每个时间对应的帧：不晚于该时间的最近一帧，早于全部历史时为最早的一帧"""
+        # 从新到旧排列的帧，时间递减，取负后递增以便二分查找
+        order = (self.latest - np.arange(self.recorded)) % self.length
+        index = np.searchsorted(-self.times[order], -np.asarray(times, dtype=np.float64), side='left')
+        return order[np.minimum(index, self.recorded - 1)]
+
+    def rewind(self, player_ids, times):
+        """
+        返回player_ids在各个时间的位置：
+        (位置数组(不同帧数, 玩家数, 2), 每个时间在位置数组中的下标)
+        """
+        if not self.recorded:
+            raise ValueError("位置历史中还没有记录")
+        frames, index = np.unique(self.frames_at(times), return_inverse=True)
+        slots = [self.slots[player_id] for player_id in player_ids]
+        return self.positions[np.ix_(frames, slots)], index
@@ -0,0 +1,128 @@
+# inputlog.py
+# 房间输入日志的二进制格式
+#
+# 录制时房间把每个tick的开始时间、按顺序应用的每条命令(连接、消息、断开)和定期的状态哈希追加到日志文件，
+# 日志头部记录房间参数和随机数种子。同样的命令在同样的tick以同样的顺序应用到同一种子的房间上，
+# 得到的游戏状态相同，因此离线时可以不经过网络按日志重新模拟一局游戏(见replay.py)并用状态哈希检查是否一致。
+#
+# 每条记录是 类型(1字节) + 长度(4字节) + 内容：
+#   H  头部，JSON: {"room", "seed", "tick_rate", "send_rate", "view_radius", "created"}
+#   T  tick开始: tick(uint32) + 房间时间(double)
+#   C  命令: tick(uint32) + 命令类型(uint8) + client_id(int64) + 消息JSON(断开命令为空)
+#   S  tick结束时的状态哈希: tick(uint32) + 哈希(8字节)
+
+import mmap
+import os
+import re
+import struct
+import time
+
+from protocol import encode_payload, decode_payload
+
+# 文件开头的标识
+MAGIC = b"INPUTLOG1\n"
+
+RECORD_HEADER = struct.Struct('!cI')
+TICK_RECORD = struct.Struct('!Id')
+COMMAND_RECORD = struct.Struct('!IBq')
+HASH_RECORD = struct.Struct('!I8s')
+
+# 命令类型与房间命令队列中的名称
+COMMAND_KINDS = ("connect", "message", "disconnect")
+_COMMAND_CODES = {kind: code for code, kind in enumerate(COMMAND_KINDS)}
+
+# 每隔多少个tick记录一次状态哈希
+HASH_INTERVAL = 30
+
+
+def log_path(directory, room_name):
+    """在directory中为房间生成一个新的日志文件名"""
+    safe_name = re.sub(r'[^\w.-]', '_', room_name)
+    base = os.path.join(directory, f"{safe_name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    path = base + ".inputlog"
+    suffix = 1
+    while os.path.exists(path):
+        # 同一秒内关闭又重新创建的房间
+        path = f"{base}-{suffix}.inputlog"
+        suffix += 1
+    return path
+
+
+class InputLogWriter:
+    """追加写入输入日志，只在房间的tick线程中使用"""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self._write(b'H', encode_payload(header))
+
+    def _write(self, kind, body):
+        if self.file.closed:
+            # 服务器关闭时tick线程可能还在执行最后一个tick
+            return
+        self.file.write(RECORD_HEADER.pack(kind, len(body)))
+        self.file.write(body)
+
+    def tick(self, tick, now):
+        self._write(b'T', TICK_RECORD.pack(tick, now))
+
+    def command(self, tick, kind, client_id, message=None):
+        body = COMMAND_RECORD.pack(tick, _COMMAND_CODES[kind], client_id)
+        if message is not None:
+            body += encode_payload(message)
+        self._write(b'C', body)
+
+    def state_hash(self, tick, digest):
+        self._write(b'S', HASH_RECORD.pack(tick, digest))
+        # 每次记录哈希时刷新到文件，服务器异常退出时最多丢失一个哈希间隔的命令
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class InputLogReader:
+    """通过内存映射顺序读取输入日志，记录内容直接从映射中解析"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} 不是输入日志文件")
+
+    def __iter__(self):
+        """
+        依次返回记录:
+        ("header", 头部字典) / ("tick", tick, 房间时间) / ("command", tick, 命令类型, client_id, 消息或None) / ("hash", tick, 哈希)
+        文件末尾不完整的记录(服务器写到一半退出)被忽略
+        """
+        data = self._map
+        offset = len(MAGIC)
+        end = len(data)
+        while offset + RECORD_HEADER.size <= end:
+            kind, length = RECORD_HEADER.unpack_from(data, offset)
+            body_start = offset + RECORD_HEADER.size
+            if body_start + length > end:
+                break
+            if kind == b'T':
+                yield ("tick",) + TICK_RECORD.unpack_from(data, body_start)
+            elif kind == b'C':
+                tick, code, client_id = COMMAND_RECORD.unpack_from(data, body_start)
+                message_start = body_start + COMMAND_RECORD.size
+                message = decode_payload(data[message_start:body_start + length]) if body_start + length > message_start else None
+                yield ("command", tick, COMMAND_KINDS[code], client_id, message)
+            elif kind == b'S':
+                yield ("hash",) + HASH_RECORD.unpack_from(data, body_start)
+            elif kind == b'H':
+                yield ("header", decode_payload(data[body_start:body_start + length]))
+            else:
+                raise ValueError(f"未知的日志记录类型 {kind!r}，偏移 {offset}")
+            offset = body_start + length
+
+    def close(self):
+        self._map.close()
+        self._file.close()
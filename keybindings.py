@@ -1,23 +1,32 @@
 # keybindings.py
 # 存储游戏中所有按键配置
 
-import pygame
+try:
+    import pygame
+except ImportError:
+    # 无界面运行(例如机器人客户端)时不需要pygame
+    pygame = None
+
+
+def _key(name):
+    # 字母键的pygame键值等于其ASCII码，没有pygame时直接使用ASCII码
+    return getattr(pygame, "K_" + name) if pygame else ord(name)
 
 # 默认按键配置
 DEFAULT_KEYBINDINGS = {
     # 基础数制切换
-    'decimal_mode': pygame.K_z,      # 切换到十进制
-    'binary_mode': pygame.K_x,       # 切换到二进制
-    'hex_mode': pygame.K_c,          # 切换到十六进制
+    'decimal_mode': _key('z'),      # 切换到十进制
+    'binary_mode': _key('x'),       # 切换到二进制
+    'hex_mode': _key('c'),          # 切换到十六进制
 
     # 技能按键 (二进制模式下)
-    'skill_1': pygame.K_h,           # 第一个技能
-    'skill_2': pygame.K_j,           # 第二个技能
-    'skill_3': pygame.K_k,           # 第三个技能
-    'skill_4': pygame.K_l,           # 第四个技能
+    'skill_1': _key('h'),           # 第一个技能
+    'skill_2': _key('j'),           # 第二个技能
+    'skill_3': _key('k'),           # 第三个技能
+    'skill_4': _key('l'),           # 第四个技能
 
     # 取消技能按键
-    'cancel_skill': pygame.K_e, # 取消当前技能
+    'cancel_skill': _key('e'), # 取消当前技能
 }
 
 # 加载自定义按键配置
@@ -35,4 +44,6 @@ def get_key_name(key_code):
     """
     将pygame键值转换为可读名称
     """
+    if pygame is None:
+        return chr(key_code)
     return pygame.key.name(key_code)
@@ -3,21 +3,34 @@ import threading
 import time
 import random
 from server import GameServer
+from interest import DEFAULT_VIEW_RADIUS, SUGGESTED_VIEW_RADIUS
+from scheduler import DEFAULT_TICK_RATE, DEFAULT_SEND_RATE
+from profiler import DEFAULT_PROFILE_DIR
 from client import GameClient
-def start_server(host='localhost', port=5555):
+from transport import LoopbackTransport
+def start_server(host='localhost', port=5555, io_mode='asyncio', view_radius=DEFAULT_VIEW_RADIUS,
+                 tick_rate=DEFAULT_TICK_RATE, send_rate=DEFAULT_SEND_RATE, workers=0, stats_port=None,
+                 input_log=None, udp=False, profile_dir=DEFAULT_PROFILE_DIR):
     # 启动游戏服务器
-    server = GameServer(host=host, port=port)
+    run_server(GameServer(host=host, port=port, io_mode=io_mode, view_radius=view_radius,
+                          tick_rate=tick_rate, send_rate=send_rate, workers=workers, stats_port=stats_port,
+                          input_log=input_log, udp=udp, profile_dir=profile_dir))
+
+def run_server(server):
+    # 运行已创建的服务器直到中断
     try:
-        print(f"启动服务器 {host}:{port}")
+        print(f"启动服务器 {server.host}:{server.port}")
         server.start()
     except KeyboardInterrupt:
         print("服务器被用户中断")
     finally:
         server.stop()
 
-def start_client(host='localhost', port=5555, username=None, screen_width=800, screen_height=600):
+def start_client(host='localhost', port=5555, username=None, screen_width=800, screen_height=600, room=None,
+                 udp=True, transport=None):
     # 启动游戏客户端
-    client = GameClient(host=host, port=port, username=username, screen_width=screen_width, screen_height=screen_height)
+    client = GameClient(host=host, port=port, username=username, screen_width=screen_width, screen_height=screen_height,
+                        room=room, udp=udp, transport=transport)
 
     def handle_message(message):
         # 处理从服务器接收到的消息
@@ -40,29 +53,79 @@ def start_client(host='localhost', port=5555, username=None, screen_width=800, s
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="游戏服务器和客户端")
-    parser.add_argument('--mode', choices=['server', 'client', 'both'], default='both',
-                        help='运行模式: server, client, 或 both')
+    parser.add_argument('--mode', choices=['server', 'client', 'both', 'bots', 'benchmark'], default='both',
+                        help='运行模式: server, client, both, bots(无界面机器人负载测试) 或 benchmark(服务器微基准测试)')
     parser.add_argument('--host', default='localhost', help='服务器主机名')
     parser.add_argument('--port', type=int, default=5555, help='服务器端口')
+    parser.add_argument('--io-mode', choices=GameServer.IO_MODES, default='asyncio',
+                        help='服务器网络IO模式: asyncio(单事件循环) 或 threaded(每连接一个线程)')
+    parser.add_argument('--view-radius', type=float, default=DEFAULT_VIEW_RADIUS,
+                        help=f'客户端视野半径(建议{SUGGESTED_VIEW_RADIUS})，只同步视野内的实体和事件；默认不限制')
+    parser.add_argument('--tick-rate', type=float, default=DEFAULT_TICK_RATE, help='服务器每秒模拟的tick数')
+    parser.add_argument('--send-rate', type=float, default=DEFAULT_SEND_RATE, help='服务器每秒发送快照的次数')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='服务器的房间工作进程数，大于0时房间分布在多个进程中运行')
+    parser.add_argument('--stats-port', type=int,
+                        help='服务器在本机(127.0.0.1)的该端口提供JSON格式的运行指标，默认不开启')
+    parser.add_argument('--profile-dir', metavar='DIR', default=DEFAULT_PROFILE_DIR,
+                        help='服务器统计端口的profile命令把采样分析结果写入该目录，命令只能指定其中的文件名')
+    parser.add_argument('--input-log', metavar='DIR',
+                        help='服务器把每个房间的输入日志写入该目录，可以用replay.py离线重新模拟，默认不记录')
+    parser.add_argument('--udp', action='store_true',
+                        help='服务器开启UDP通道，请求UDP的客户端通过数据报接收玩家位置和快照')
+    parser.add_argument('--no-udp', action='store_true', help='客户端不请求UDP通道，只使用TCP')
+    parser.add_argument('--transport', choices=['auto', 'tcp', 'loopback'], default='auto',
+                        help='both模式下客户端与服务器之间的传输，auto在单进程服务器时使用进程内的回环传输')
     parser.add_argument('--username', help='客户端用户名')
+    parser.add_argument('--room', help='客户端要加入的房间名，不存在时由服务器创建；默认进入服务器的默认房间')
+    parser.add_argument('--bots', type=int, default=100, help='bots模式下的机器人数量')
+    parser.add_argument('--duration', type=float, default=30.0, help='bots模式下每个机器人运行的秒数')
+    # 机器人和基准测试模块只在对应的模式下导入，场景名在解析后检查
+    parser.add_argument('--scenario', action='append',
+                        help='benchmark模式下运行的场景，可以指定多次；默认运行全部场景')
+    parser.add_argument('--ticks', type=int, help='benchmark模式下每个场景执行的tick数，默认见benchmark.py')
+    parser.add_argument('--output', help='benchmark模式下结果JSON的输出文件，默认输出到标准输出')
     parser.add_argument('--width', type=int, default=800, help='游戏窗口宽度')
     parser.add_argument('--height', type=int, default=600, help='游戏窗口高度')
     args = parser.parse_args()
+    if args.mode == 'both' and args.transport == 'loopback' and args.workers:
+        parser.error("--transport loopback需要房间在本进程中运行，不能与--workers同时使用")
 
     if args.mode == 'server':
         # 只启动服务器
-        start_server(args.host, args.port)
+        start_server(args.host, args.port, args.io_mode, args.view_radius or None, args.tick_rate, args.send_rate,
+                     args.workers, args.stats_port, args.input_log, args.udp, args.profile_dir)
     elif args.mode == 'client':
         # 只启动客户端
-        start_client(args.host, args.port, args.username, args.width, args.height)
+        start_client(args.host, args.port, args.username, args.width, args.height, args.room, not args.no_udp)
+    elif args.mode == 'bots':
+        # 只启动机器人，连接已运行的服务器
+        from bots import run_load
+        run_load(args.host, args.port, args.bots, args.duration, room=args.room)
+    elif args.mode == 'benchmark':
+        # 不启动网络，直接测量服务器热点方法的耗时
+        from benchmark import SCENARIOS, DEFAULT_TICKS, run_benchmarks, save_report
+        unknown = [name for name in args.scenario or [] if name not in SCENARIOS]
+        if unknown:
+            parser.error(f"未知的场景: {', '.join(unknown)}，可选: {', '.join(SCENARIOS)}")
+        save_report(run_benchmarks(args.scenario, args.ticks if args.ticks is not None else DEFAULT_TICKS,
+                                   view_radius=args.view_radius or None), args.output)
     elif args.mode == 'both':
-        # 在单独的线程中启动服务器
-        server_thread = threading.Thread(target=start_server, args=(args.host, args.port))
+        # 在单独的线程中启动服务器，其他客户端仍然可以通过TCP连接
+        server = GameServer(host=args.host, port=args.port, io_mode=args.io_mode, view_radius=args.view_radius or None,
+                            tick_rate=args.tick_rate, send_rate=args.send_rate, workers=args.workers,
+                            stats_port=args.stats_port, input_log=args.input_log, udp=args.udp,
+                            profile_dir=args.profile_dir)
+        server_thread = threading.Thread(target=run_server, args=(server,))
         server_thread.daemon = True
         server_thread.start()
 
         # 等待服务器启动
         time.sleep(1)
 
-        # 在主线程中启动客户端
-        start_client(args.host, args.port, args.username, args.width, args.height)
+        # 在主线程中启动客户端，服务器的房间在本进程中运行时不经过TCP
+        transport = None
+        if args.transport == 'loopback' or (args.transport == 'auto' and not args.workers):
+            transport = LoopbackTransport(server)
+        start_client(args.host, args.port, args.username, args.width, args.height, args.room, not args.no_udp,
+                     transport)
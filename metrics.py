@@ -0,0 +1,232 @@
+# metrics.py
+# 服务器运行指标
+#
+# 计数器和直方图在记录时只做一次加锁的加法(直方图用二分查找定位桶)，开销足够小，可以在生产环境中一直开启。
+# 连接数、子弹数、发送队列深度等瞬时值不在每个tick记录，只在读取快照时由注册的回调计算。
+# 快照通过只监听本机地址的统计端口读取：连接后服务器写出一行JSON并关闭连接，例如 nc 127.0.0.1 5556。
+# 连接后也可以先发送一行管理命令，例如 echo "profile 10" | nc 127.0.0.1 5556，命令由服务器注册。
+
+import bisect
+import json
+import socket
+import threading
+import time
+
+from protocol import CLIENT_MESSAGE_TYPES
+
+# 耗时直方图的桶上界(秒)，覆盖30Hz时33毫秒的tick预算前后
+DURATION_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# 快照中列出的发送队列最深的客户端数
+DEEPEST_QUEUES = 5
+
+# 统计端口等待管理命令的时间(秒)，没有收到命令时返回指标快照
+COMMAND_TIMEOUT = 0.2
+
+# 管理命令的最大长度
+MAX_COMMAND_SIZE = 1024
+
+
+class Histogram:
+    """固定桶的直方图，最后一个桶统计超过所有上界的值"""
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds=DURATION_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {
+            "bounds": list(self.bounds),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max
+        }
+
+
+class MetricsRegistry:
+    """计数器、直方图、按消息类型的收发统计和快照时计算的瞬时值"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._lock = threading.Lock()  # threaded模式下IO线程和tick线程都会记录
+        self._counters = {}
+        self._histograms = {}
+        self._received = {}  # {消息类型: [消息数, 字节数]}
+        self._sent = {}  # {消息类型: [消息数, 字节数, 编码耗时]}
+        self._gauges = {}  # {名称: 回调}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value, bounds=DURATION_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(bounds)
+            histogram.observe(value)
+
+    def count_received(self, message_type, size):
+        """记录收到的一条消息及其帧的字节数，不是客户端消息类型的都计入"other"，统计项不会随客户端的输入增长"""
+        if not isinstance(message_type, str) or message_type not in CLIENT_MESSAGE_TYPES:
+            message_type = "other"
+        with self._lock:
+            entry = self._received.get(message_type)
+            if entry is None:
+                entry = self._received[message_type] = [0, 0]
+            entry[0] += 1
+            entry[1] += size
+
+    def count_sent(self, message_type, recipients, size, encode_time=0.0):
+        """记录发给recipients个客户端的一条消息，size为编码后的字节数，同一份编码只计一次编码耗时"""
+        with self._lock:
+            entry = self._sent.get(message_type)
+            if entry is None:
+                entry = self._sent[message_type] = [0, 0, 0.0]
+            entry[0] += recipients
+            entry[1] += size * recipients
+            entry[2] += encode_time
+
+    def gauge(self, name, callback):
+        """注册一个在读取快照时计算的瞬时值"""
+        self._gauges[name] = callback
+
+    def summary(self):
+        """
+        多进程模式下工作进程回报给前端的指标摘要：直方图只保留次数、总和和最大值
+        计数器、直方图和消息类型都由服务器代码决定，瞬时值中的房间和发送队列也有数量上限，摘要的大小有上界
+        """
+        snapshot = self.snapshot()
+        snapshot["histograms"] = {name: {"count": histogram["count"], "sum": histogram["sum"], "max": histogram["max"]}
+                                  for name, histogram in snapshot["histograms"].items()}
+        return snapshot
+
+    def snapshot(self):
+        """返回可序列化为JSON的全部指标"""
+        with self._lock:
+            snapshot = {
+                "uptime": time.monotonic() - self.started,
+                "counters": dict(self._counters),
+                "histograms": {name: histogram.snapshot() for name, histogram in self._histograms.items()},
+                "received": {message_type: {"messages": entry[0], "bytes": entry[1]}
+                             for message_type, entry in self._received.items()},
+                "sent": {message_type: {"messages": entry[0], "bytes": entry[1], "encode_seconds": entry[2]}
+                         for message_type, entry in self._sent.items()}
+            }
+        # 回调读取的是其他线程正在修改的游戏状态，单个回调出错时只影响该项
+        gauges = {}
+        for name, callback in list(self._gauges.items()):
+            try:
+                gauges[name] = callback()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        snapshot["gauges"] = gauges
+        return snapshot
+
+
+def queue_depths(connections):
+    """汇总 {client_id: 连接} 中每个客户端发送队列的积压帧数"""
+    depths = sorted(((len(connection.queue), client_id) for client_id, connection in connections.items()),
+                    reverse=True)
+    total = sum(depth for depth, _ in depths)
+    return {
+        "clients": len(depths),
+        "total": total,
+        "mean": total / len(depths) if depths else 0.0,
+        "max": depths[0][0] if depths else 0,
+        "deepest": [[client_id, depth] for depth, client_id in depths[:DEEPEST_QUEUES] if depth]
+    }
+
+
+class StatsServer:
+    """本机统计端口：每个连接可以发送一行命令，收到一行JSON格式的结果，默认为指标快照"""
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.commands = {"metrics": lambda args: self.registry.snapshot()}  # {命令: 回调(参数列表) -> 结果}
+        self.running = False
+        self.server_socket = None
+        self.thread = None
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(8)
+        self.port = self.server_socket.getsockname()[1]
+        self.running = True
+        self.thread = threading.Thread(target=self._serve, name="stats-server")
+        self.thread.daemon = True
+        self.thread.start()
+        print(f"统计端口已启动，监听 {self.host}:{self.port}")
+
+    def _serve(self):
+        while self.running:
+            try:
+                client_socket, _ = self.server_socket.accept()
+            except OSError:
+                break
+            try:
+                data = json.dumps(self._execute(self._read_command(client_socket)), ensure_ascii=False,
+                                  default=str) + "\n"
+                client_socket.sendall(data.encode('utf-8'))
+            except OSError:
+                pass
+            except Exception as e:
+                print(f"执行统计端口命令时出错: {e}")
+            finally:
+                client_socket.close()
+
+    def command(self, name, callback):
+        """注册管理命令，callback接收命令后的参数列表，返回可序列化为JSON的结果"""
+        self.commands[name] = callback
+
+    @staticmethod
+    def _read_command(client_socket):
+        # 短时间内没有收到完整的一行时视为没有命令
+        client_socket.settimeout(COMMAND_TIMEOUT)
+        data = b''
+        try:
+            while b'\n' not in data and len(data) < MAX_COMMAND_SIZE:
+                chunk = client_socket.recv(MAX_COMMAND_SIZE)
+                if not chunk:
+                    break
+                data += chunk
+        except socket.timeout:
+            pass
+        client_socket.settimeout(None)
+        return data.split(b'\n', 1)[0].decode('utf-8', 'replace').split()
+
+    def _execute(self, words):
+        name = words[0] if words else "metrics"
+        callback = self.commands.get(name)
+        if callback is None:
+            return {"error": f"未知命令: {name}", "commands": sorted(self.commands)}
+        try:
+            return callback(words[1:])
+        except (ValueError, IndexError) as e:
+            return {"error": f"命令参数错误: {e}"}
+
+    def stop(self):
+        self.running = False
+        if self.server_socket is not None:
+            try:
+                # shutdown会唤醒阻塞在accept上的线程
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server_socket.close()
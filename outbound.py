@@ -0,0 +1,251 @@
+# outbound.py
+# 服务器端每个客户端连接的发送队列和写线程/写协程
+#
+# 游戏逻辑只把编码好的帧放入连接的队列，由连接自己的写线程(threaded模式)
+# 或写协程(asyncio模式)合并后一次性发送，慢客户端不会阻塞游戏tick。
+# 一个tick内产生的事件先由EventBundler收集，tick结束时每个客户端入队一帧合并的事件；
+# 可合并的状态消息单独成帧并带上合并键，积压时仍按键替换。
+
+import asyncio
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+# 每个连接最多积压的消息数
+DEFAULT_MAX_PENDING = 256
+
+# 每个连接最多积压的字节数，每个tick的事件合并为一帧后单帧可能很大
+DEFAULT_MAX_PENDING_BYTES = 4 * 1024 * 1024
+
+# 队列持续超过上限多长时间(秒)后断开客户端
+DEFAULT_OVERFLOW_GRACE = 2.0
+
+# 只保留最新一条即可的消息类型，值为消息中区分对象的字段
+CONFLATED_MESSAGE_KEYS = {
+    "players_moved": None,  # 快照中也包含位置，积压时只保留最新的一批即可
+    "player_value_updated": "client_id",
+    "game_update": None,
+}
+
+
+def conflation_key(message):
+    """返回消息的合并键，同一个键的旧消息会被新消息替换；不可合并的消息返回None"""
+    message_type = message.get("type")
+    if message_type not in CONFLATED_MESSAGE_KEYS:
+        return None
+    field = CONFLATED_MESSAGE_KEYS[message_type]
+    if field is None:
+        return (message_type,)
+    return (message_type, message.get(field))
+
+
+class OutboundQueue:
+    """
+    有界的发送队列
+    可合并的消息按键替换掉队列中尚未发送的旧消息(保留原来的位置)，
+    其余消息按顺序排队。
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING, overflow_grace=DEFAULT_OVERFLOW_GRACE,
+                 max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self.overflow_grace = overflow_grace
+        self.conflated = 0          # 被合并掉的消息数
+        self.overflow_since = None  # 开始超过上限的时间
+        self.closed = False
+        self._pending = OrderedDict()  # {key: frame}
+        self._pending_bytes = 0
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, frame, key=None):
+        """放入一帧，返回False表示该客户端积压过多，应当断开"""
+        with self._cond:
+            if self.closed:
+                return True
+            if key is not None and key in self._pending:
+                # 替换尚未发送的旧消息
+                self._pending_bytes += len(frame) - len(self._pending[key])
+                self._pending[key] = frame
+                self.conflated += 1
+                return True
+
+            if len(self._pending) >= self.max_pending or self._pending_bytes >= self.max_pending_bytes:
+                now = time.monotonic()
+                if self.overflow_since is None:
+                    self.overflow_since = now
+                # 短暂的突发(例如一次读到大量消息)是允许的，只有持续积压才断开
+                if now - self.overflow_since > self.overflow_grace:
+                    return False
+
+            if key is None:
+                self._seq += 1
+                key = self._seq
+            self._pending[key] = frame
+            self._pending_bytes += len(frame)
+            self._cond.notify()
+            return True
+
+    def drain(self):
+        """取出所有待发送的帧"""
+        with self._cond:
+            return self._drain_locked()
+
+    def _drain_locked(self):
+        frames = list(self._pending.values())
+        self._pending.clear()
+        self._pending_bytes = 0
+        self.overflow_since = None
+        return frames
+
+    def wait_drain(self):
+        """阻塞直到有待发送的帧，返回这些帧；队列关闭后返回None"""
+        with self._cond:
+            while not self._pending and not self.closed:
+                self._cond.wait()
+            if self.closed:
+                return None
+            return self._drain_locked()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._pending.clear()
+            self._pending_bytes = 0
+            self._cond.notify_all()
+
+
+class EventBundler:
+    """
+    按tick收集发往每个客户端的事件负载
+    同一份负载可以发给多个客户端而只编码一次；可合并的事件在同一个tick内按键替换
+    (保留原来的位置)。tick结束时由服务器取出，每个客户端合并为一帧发送。
+    """
+
+    def __init__(self):
+        self.conflated = 0  # 在同一tick内被合并掉的事件数
+        self._pending = {}  # {client_id: OrderedDict{key: payload}}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def add(self, client_ids, payload, key=None):
+        """将已编码的事件负载加入这些客户端本tick的事件列表"""
+        with self._lock:
+            if key is None:
+                self._seq += 1
+                key = self._seq
+            for client_id in client_ids:
+                events = self._pending.get(client_id)
+                if events is None:
+                    events = self._pending[client_id] = OrderedDict()
+                elif key in events:
+                    self.conflated += 1
+                events[key] = payload
+
+    def take(self):
+        """取出所有待发送的事件，返回{client_id: [payload]}"""
+        return {client_id: [payload for _, payload in events] for client_id, events in self.take_keyed().items()}
+
+    def take_keyed(self):
+        """取出所有待发送的事件，返回{client_id: [(合并键, payload)]}，不可合并的事件的键是整数"""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        return {client_id: list(events.items()) for client_id, events in pending.items()}
+
+    def forget(self, client_id):
+        with self._lock:
+            self._pending.pop(client_id, None)
+
+
+class ThreadedClientConnection:
+    """threaded模式的客户端连接，由独立的写线程用sendall发送队列中的帧"""
+
+    def __init__(self, sock, max_pending=DEFAULT_MAX_PENDING):
+        self.sock = sock
+        self.queue = OutboundQueue(max_pending)
+        # UDP通道(见datagram.py)：datagram_offer在welcome中发给客户端，收到hello后datagram为该客户端的DatagramPeer
+        self.datagram_token = None
+        self.datagram_offer = None
+        self.datagram = None
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def send_frame(self, frame, key=None):
+        return self.queue.put(frame, key)
+
+    def _write_loop(self):
+        while True:
+            frames = self.queue.wait_drain()
+            if frames is None:
+                break
+            try:
+                # 合并为一次写入
+                self.sock.sendall(b''.join(frames))
+            except OSError:
+                break
+        self.close()
+
+    def close(self):
+        self.queue.close()
+        try:
+            # shutdown会唤醒阻塞在recv上的读线程
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def abort(self):
+        # 断开积压过多的客户端
+        self.close()
+
+
+class AsyncioClientConnection:
+    """asyncio模式的客户端连接，由写协程把队列中的帧合并写入StreamWriter"""
+
+    def __init__(self, writer, max_pending=DEFAULT_MAX_PENDING):
+        self.writer = writer
+        self.queue = OutboundQueue(max_pending)
+        self.datagram_token = None
+        self.datagram_offer = None
+        self.datagram = None
+        # send_frame只会在事件循环线程中调用，直接使用asyncio.Event唤醒写协程
+        self._wakeup = asyncio.Event()
+        self._writer_task = asyncio.ensure_future(self._write_loop())
+
+    def send_frame(self, frame, key=None):
+        ok = self.queue.put(frame, key)
+        self._wakeup.set()
+        return ok
+
+    async def _write_loop(self):
+        try:
+            while not self.queue.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                frames = self.queue.drain()
+                if not frames:
+                    continue
+                self.writer.write(b''.join(frames))
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.queue.close()
+        self._wakeup.set()
+        self.writer.close()
+
+    def abort(self):
+        # 断开积压过多的客户端：不等待发送缓冲区清空，直接关闭传输
+        self.queue.close()
+        self._wakeup.set()
+        self.writer.transport.abort()
@@ -0,0 +1,106 @@
+# profiler.py
+# 按需启动的采样分析器
+#
+# 启动后由一个后台线程每隔固定间隔读取所有线程当前的调用栈(sys._current_frames)，
+# 按"线程;函数;函数..."累计采样次数，结束时写成折叠栈文件，可以直接交给flamegraph.pl等工具生成火焰图。
+# 不需要在被分析的代码中插桩，也不使用sys.setprofile；没有采样时不存在分析线程，对服务器没有任何开销。
+# 结果只写入服务器配置的目录，统计端口的命令只能指定其中的文件名。
+
+import os
+import re
+import sys
+import threading
+import time
+
+# 默认采样间隔(秒)
+DEFAULT_INTERVAL = 0.005
+
+# 一次采样的最长时间(秒)
+MAX_DURATION = 300.0
+
+# 默认的结果目录，相对于服务器的工作目录
+DEFAULT_PROFILE_DIR = "profiles"
+
+# 线程名中的编号对分析没有意义，"Thread-12 (handle_client)"归并为"handle_client"
+_THREAD_NAME = re.compile(r"^Thread-\d+ \((.+)\)$")
+
+
+def _thread_label(name):
+    match = _THREAD_NAME.match(name)
+    return match.group(1) if match else name
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse_stack(frame):
+    """返回从最外层到当前帧的函数名列表"""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def profile_path(directory, name):
+    """返回结果文件在directory中的路径，name包含路径分隔符或".."时抛出ValueError"""
+    if not isinstance(name, str) or not name or "/" in name or "\\" in name or ".." in name or "\0" in name:
+        raise ValueError(f"结果文件只能指定不含路径的文件名: {name!r}")
+    return os.path.join(directory, name)
+
+
+class SamplingProfiler:
+    """采样分析器，同一时间只进行一次采样"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration, path):
+        """在后台采样duration秒后把结果写入path，已有采样在进行时返回False"""
+        duration = min(max(float(duration), self.interval), MAX_DURATION)
+        with self._lock:
+            if self.running:
+                return False
+            self._thread = threading.Thread(target=self._run, args=(duration, path), name="sampling-profiler")
+            self._thread.daemon = True
+            self._thread.start()
+        print(f"开始采样分析 {duration:.0f} 秒，结果将写入 {path}")
+        return True
+
+    def _run(self, duration, path):
+        counts = {}  # {折叠栈: 采样次数}
+        samples = 0
+        own = threading.get_ident()
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            names = {thread.ident: _thread_label(thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                key = ";".join([names.get(ident, str(ident))] + collapse_stack(frame))
+                counts[key] = counts.get(key, 0) + 1
+            samples += 1
+            # 释放对栈帧的引用，避免延长局部变量的生命周期
+            frame = None
+            time.sleep(self.interval)
+        try:
+            self.write(counts, path)
+            print(f"采样分析结果已写入 {path} ({samples}次采样)")
+        except OSError as e:
+            print(f"写入采样分析结果时出错: {e}")
+
+    @staticmethod
+    def write(counts, path):
+        # 折叠栈格式：每行"线程;外层函数;...;内层函数 次数"，按次数从多到少排列
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write(f"{key} {count}\n")
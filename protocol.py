@@ -0,0 +1,161 @@
+# protocol.py
+# 服务器和客户端共用的网络消息编解码
+#
+# 每条消息编码为一个帧: 4字节大端无符号长度 + UTF-8编码的JSON负载。
+# 接收端把数据直接recv_into到一个可复用的bytearray中，按长度切分完整的帧，
+# 因此不再需要逐字符扫描大括号，多字节字符被拆分到两次recv中也不会出错。
+
+import json
+import struct
+
+# 帧头：负载长度
+FRAME_HEADER = struct.Struct('!I')
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+# 单帧负载的最大字节数，超过视为协议错误
+MAX_FRAME_SIZE = 1 << 20
+
+# 接收缓冲区的初始大小
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# 缓冲区尾部剩余空间小于该值时先整理缓冲区，避免过小的recv
+MIN_RECV_SIZE = 4096
+
+# 客户端发往服务器的消息类型
+CLIENT_MESSAGE_TYPES = frozenset({"connect", "move", "base_change", "player_update", "snapshot_ack", "chat", "action",
+                                  "keyframe_request", "udp_fallback"})
+
+
+class FrameError(ValueError):
+    """帧格式错误，例如帧长度超过上限"""
+
+
+# 共用的JSON编码器，json.dumps每次调用都会为非默认参数创建新的编码器
+_JSON_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+
+def encode_payload(message):
+    """将消息字典编码为JSON负载字节"""
+    return _JSON_ENCODER.encode(message).encode('utf-8')
+
+
+def encode_payload_with(message, **encoded_fields):
+    """
+    编码消息，encoded_fields中的值是已经编码好的JSON字节
+    这些字段直接拼接到负载中，避免对同一份数据重复序列化
+    """
+    body = bytearray(encode_payload(message)[:-1])
+    for name, raw in encoded_fields.items():
+        if len(body) > 1:
+            body += b','
+        body += json.dumps(name).encode('utf-8') + b':' + raw
+    body += b'}'
+    return bytes(body)
+
+
+def encode_bundle_frames(message, payloads, field="events"):
+    """
+    把多个已编码的JSON负载合并为message中的一个数组字段，返回帧的列表
+    通常只有一帧，合并后超过MAX_FRAME_SIZE时拆分为多帧，负载的顺序保持不变
+    """
+    header = encode_payload(message)[:-1] + (b',' if len(message) else b'') + json.dumps(field).encode('utf-8') + b':['
+    limit = MAX_FRAME_SIZE - len(header) - 2  # 2为结尾的]}
+    frames = []
+    batch = []
+    size = 0
+    for payload in payloads:
+        if batch and size + 1 + len(payload) > limit:
+            frames.append(encode_frame(header + b','.join(batch) + b']}'))
+            batch = []
+            size = 0
+        size += len(payload) + (1 if batch else 0)
+        batch.append(payload)
+    if batch:
+        frames.append(encode_frame(header + b','.join(batch) + b']}'))
+    return frames
+
+
+def decode_payload(payload):
+    """将JSON负载字节解码为消息字典"""
+    return json.loads(payload)
+
+
+def encode_frame(payload):
+    """为负载加上长度帧头"""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"帧长度 {len(payload)} 超过上限 {MAX_FRAME_SIZE}")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message):
+    """将消息字典编码为完整的帧"""
+    return encode_frame(encode_payload(message))
+
+
+class FrameBuffer:
+    """
+    可复用的接收缓冲区
+    数据通过recv_into/feed写入[_start, _end)区间，frames()按帧头切出完整的负载。
+    已消费的数据只移动读指针，尾部空间不足时才把剩余数据整理到缓冲区开头，
+    整体开销与接收的字节数成线性关系。
+    """
+
+    def __init__(self, capacity=DEFAULT_BUFFER_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # 未消费数据的起始位置
+        self._end = 0    # 已写入数据的结束位置
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _reserve(self, size):
+        # 确保尾部至少有size字节的可写空间
+        if len(self._buffer) - self._end >= size:
+            return
+        pending = self._end - self._start
+        if self._start > 0:
+            # 将未消费的数据移动到缓冲区开头
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        if len(self._buffer) - self._end < size:
+            # 仍然不够时扩容，最大不超过一个完整帧的大小
+            new_capacity = max(len(self._buffer) * 2, pending + size)
+            new_capacity = min(new_capacity, self.max_frame_size + FRAME_HEADER_SIZE + MIN_RECV_SIZE)
+            if new_capacity - pending < size:
+                raise FrameError("接收缓冲区已满")
+            self._view.release()
+            self._buffer.extend(bytes(new_capacity - len(self._buffer)))
+            self._view = memoryview(self._buffer)
+
+    def recv_into(self, sock):
+        """从socket直接读取数据到缓冲区，返回读取的字节数(0表示连接关闭)"""
+        self._reserve(MIN_RECV_SIZE)
+        received = sock.recv_into(self._view[self._end:])
+        self._end += received
+        return received
+
+    def feed(self, data):
+        """将已读取的数据追加到缓冲区"""
+        self._reserve(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def frames(self):
+        """依次返回缓冲区中所有完整帧的负载(bytes)"""
+        while self._end - self._start >= FRAME_HEADER_SIZE:
+            (length,) = FRAME_HEADER.unpack_from(self._buffer, self._start)
+            if length > self.max_frame_size:
+                raise FrameError(f"帧长度 {length} 超过上限 {self.max_frame_size}")
+            frame_end = self._start + FRAME_HEADER_SIZE + length
+            if frame_end > self._end:
+                # 帧还不完整，为剩余部分预留空间后等待更多数据
+                self._reserve(frame_end - self._end)
+                return
+            payload = bytes(self._view[self._start + FRAME_HEADER_SIZE:frame_end])
+            self._start = frame_end
+            if self._start == self._end:
+                self._start = self._end = 0
+            yield payload
@@ -0,0 +1,143 @@
+# replay.py
+# 按输入日志离线重新模拟一局游戏
+#
+# 在没有网络连接的房间中按录制的tick和顺序重新应用日志中的命令，tick开始时间使用日志中的记录，
+# 不等待真实时间，因此比实时快得多。每遇到一条状态哈希记录就与重新模拟的状态比较，
+# 第一个不一致的tick说明从那里开始出现了非确定性。
+# 重新模拟中只有游戏逻辑，可以用 python -m cProfile replay.py ... 分析真实对局的tick开销，
+# 用--until只模拟到某个tick来二分定位出问题的tick。
+
+import argparse
+import contextlib
+import os
+import time
+
+from room import GameRoom
+from inputlog import InputLogReader
+
+
+class NullConnection:
+    """重新模拟时代替客户端连接，丢弃发送的帧"""
+    datagram_offer = None
+    datagram = None
+
+    def send_frame(self, frame, key=None):
+        return True
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class Replay:
+    """读取一个输入日志并重新模拟"""
+
+    def __init__(self, path, until=None):
+        self.path = path
+        self.until = until  # 只模拟到这个tick(包含)，None表示模拟全部
+        self.room = None
+        self.now = 0.0  # 日志中记录的当前tick开始时间
+        self._pending_tick = None  # 已读到开始记录、尚未执行的tick
+        self.ticks = 0
+        self.commands = 0
+        self.hashes = 0
+        self.mismatches = []  # [(tick, 录制的哈希, 重新模拟的哈希)]
+
+    def _create_room(self, header):
+        room = GameRoom(header["room"], view_radius=header.get("view_radius"), tick_rate=header["tick_rate"],
+                        send_rate=header["send_rate"], seed=header["seed"])
+        room.clock = lambda: self.now
+        return room
+
+    def _run_pending(self):
+        # 日志中一个tick的命令都在tick开始记录之后，读到下一条tick或哈希记录时执行
+        if self._pending_tick is None:
+            return
+        room = self.room
+        room.tick = self._pending_tick - 1
+        room._game_tick(room.scheduler.tick_interval)
+        # 事件只发给连接替身，直接丢弃
+        room.events.take()
+        self._pending_tick = None
+        self.ticks += 1
+
+    def run(self):
+        """重新模拟到日志末尾或until，返回结果字典"""
+        reader = InputLogReader(self.path)
+        started = time.perf_counter()
+        try:
+            for record in reader:
+                kind = record[0]
+                if kind == "header":
+                    if self.room is not None:
+                        raise ValueError("日志中有多个头部记录")
+                    self.room = self._create_room(record[1])
+                elif kind == "tick":
+                    self._run_pending()
+                    if self.until is not None and record[1] > self.until:
+                        break
+                    self._pending_tick, self.now = record[1], record[2]
+                elif kind == "command":
+                    _, _, command, client_id, message = record
+                    if command == "connect":
+                        args = (NullConnection(), None, message)
+                    else:
+                        args = message
+                    self.room.commands.append((command, client_id, args))
+                    self.commands += 1
+                elif kind == "hash":
+                    self._run_pending()
+                    self.hashes += 1
+                    digest = self.room.state_hash()
+                    if digest != record[2]:
+                        self.mismatches.append((record[1], record[2].hex(), digest.hex()))
+            else:
+                self._run_pending()
+        finally:
+            reader.close()
+        elapsed = time.perf_counter() - started
+        simulated = self.ticks * self.room.scheduler.tick_interval if self.room else 0.0
+        return {
+            "path": self.path,
+            "room": self.room.name if self.room else None,
+            "ticks": self.ticks,
+            "last_tick": self.room.tick if self.room else 0,
+            "commands": self.commands,
+            "hashes_checked": self.hashes,
+            "mismatches": len(self.mismatches),
+            "first_mismatch": self.mismatches[0] if self.mismatches else None,
+            "elapsed": elapsed,
+            "speedup": simulated / elapsed if elapsed > 0 else None,
+            "state_hash": self.room.state_hash().hex() if self.room else None
+        }
+
+
+def replay_log(path, until=None, quiet=True):
+    """重新模拟一个输入日志，返回结果字典"""
+    output = open(os.devnull, 'w') if quiet else None
+    try:
+        # 屏蔽房间中的日志输出
+        with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+            return Replay(path, until).run()
+    finally:
+        if output:
+            output.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按输入日志离线重新模拟一局游戏并检查状态哈希")
+    parser.add_argument('logs', nargs='+', help='输入日志文件')
+    parser.add_argument('--until', type=int, help='只模拟到这个tick(包含)')
+    parser.add_argument('--verbose', action='store_true', help='显示房间的日志输出')
+    args = parser.parse_args()
+    failed = False
+    for path in args.logs:
+        result = replay_log(path, args.until, not args.verbose)
+        status = "一致" if not result["mismatches"] else f"不一致(首个不一致的tick {result['first_mismatch'][0]})"
+        print(f"{path}: 房间 {result['room']}，{result['ticks']}个tick，{result['commands']}条命令，"
+              f"检查{result['hashes_checked']}个状态哈希: {status}；"
+              f"耗时{result['elapsed']:.2f}秒，{result['speedup'] or 0:.0f}倍实时速度")
+        failed = failed or bool(result["mismatches"])
+    raise SystemExit(1 if failed else 0)
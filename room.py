@@ -0,0 +1,1147 @@
+# room.py
+# 房间：服务器中一局独立进行的游戏
+#
+# 每个房间有自己的游戏状态、tick、定时器和客户端集合，广播和快照只发给本房间的客户端。
+# 服务器的IO线程把房间内客户端的连接、消息和断开作为命令放入房间的命令队列，
+# 服务器的游戏循环轮流调用各房间的run_due_ticks()，房间本身不创建线程。
+
+import time
+import random
+import math
+import hashlib
+from collections import deque
+
+import numpy as np
+
+from protocol import encode_frame, encode_payload, encode_payload_with
+from codec import JSON_CODEC, negotiate_codec
+from outbound import EventBundler, conflation_key
+from state import StateStore
+from interest import InterestManager, DEFAULT_VIEW_RADIUS
+from spatial import SpatialGrid
+from bullets import BulletStore, BULLET_LIFETIME
+from history import PositionHistory, HISTORY_SECONDS, INTERPOLATION_DELAY
+from scheduler import TickScheduler, DEFAULT_TICK_RATE, DEFAULT_SEND_RATE
+from timers import TimerWheel
+from metrics import MetricsRegistry
+from datagram import DATAGRAM_MESSAGES, MAX_DATAGRAM_PAYLOAD
+from inputlog import InputLogWriter, HASH_INTERVAL
+
+
+class GameRoom:
+    # 每个客户端至少每隔多少个快照版本收到一次完整关键帧，其余时间发送增量
+    KEYFRAME_INTERVAL = 90
+    # 需要检查射程的技能及其射程，其他技能无射程限制
+    SKILL_RANGES = {"开火": 600, "爆炸": 600, "AND": 200, "OR": 200, "XOR": 200}
+    # AND/OR/XOR运算符特效显示的目标距离
+    OPERATOR_EFFECT_RANGE = 100
+    # 内存释放状态持续的秒数
+    MEMORY_RELEASE_DURATION = 10
+    # 进制变更后延迟多少秒发送一次游戏状态更新
+    BASE_CHANGE_UPDATE_DELAY = 0.05
+
+    def __init__(self, name, view_radius=DEFAULT_VIEW_RADIUS, tick_rate=DEFAULT_TICK_RATE, send_rate=DEFAULT_SEND_RATE,
+                 metrics=None, seed=None, input_log=None):
+        self.name = name
+        # 服务器的所有房间共用一个指标注册表
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.clients = {}  # {client_id: (connection, client_address, username)}
+        self.last_handoff = None  # 多进程模式下前端最近一次交接到本房间的序号
+        # 版本化状态存储，记录玩家字段的变化用于生成增量快照
+        self.state_store = StateStore()
+        self.game_state = {
+            "players": self.state_store.track("players"),  # {client_id: {"position": [x, y], "score": 0, "username": "name", "value": 0, "target_value": 0, "memory_release_active": False, "memory_release_time": 0}}
+            "game_objects": [],
+            "base_conversions": [],  # 保存进制转换的动画信息
+            "bullets": BulletStore()  # 子弹的列存储，records()返回 [{"id": bullet_id, "owner": client_id, "position": [x, y], "velocity": [dx, dy], "damage": damage, "created_time": time_created, "char": "*", "color": (212, 212, 212)}]
+        }
+        # IO线程只解码消息并放入命令队列，tick线程是游戏状态唯一的写入者，按到达顺序应用命令，
+        # 因此游戏状态不需要加锁；deque的append/popleft在多线程下是原子的
+        self.commands = deque()  # [(命令类型, client_id, 参数)]
+        self.bullet_id_counter = 0  # 用于分配唯一的子弹ID
+        self.tick = 0  # 已执行的游戏帧数
+        self.events = EventBundler()  # 收集本tick发往每个客户端的事件，tick结束时合并为一帧发送
+        self.snapshot_acks = {}  # {client_id: 客户端已确认的快照版本}
+        self.keyframe_versions = {}  # {client_id: 最近一次发送关键帧的版本}
+        self.keyframe_requests = set()  # 请求了关键帧的客户端，下一次发送快照时收到完整关键帧
+        self.pending_moves = {}  # {client_id: 本tick内收到的最新位置}，在下一个tick统一应用并广播
+        self.pending_input_seqs = {}  # {client_id: 最新位置对应的客户端输入序号}
+        self.rtts = {}  # {client_id: 平滑后的往返时间估计(秒)}，由快照确认中回传的发送时间计算
+        self.client_codecs = {}  # {client_id: 握手时协商的消息编码}，没有记录的客户端使用JSON
+        # 兴趣区域管理，view_radius为None时所有客户端接收全部实体和事件
+        self.interest = InterestManager(view_radius) if view_radius is not None else None
+        # 玩家位置的空间索引，随玩家加入、移动和离开增量更新
+        self.player_grid = SpatialGrid()
+        # 固定步长的tick调度，模拟频率和快照发送频率相互独立
+        self.scheduler = TickScheduler(tick_rate, send_rate)
+        # 由tick驱动的时间轮，负责延迟的状态更新、内存释放结束和子弹寿命
+        self.timers = TimerWheel(self.scheduler.tick_interval)
+        # 最近一秒内每个tick的玩家位置，子弹碰撞检测据此把目标回退到射击者看到的时刻
+        self.position_history = PositionHistory(self.scheduler.tick_interval)
+        # 游戏逻辑只使用房间自己的随机数生成器和每个tick开始时的时间，
+        # 同样的种子和同样的命令序列得到同样的游戏状态，录制的输入日志可以离线重新模拟
+        self.seed = seed if seed is not None else random.randrange(1 << 32)
+        self.rng = random.Random(self.seed)
+        self.clock = time.time
+        self.now = self.clock()  # 当前tick开始时的时间
+        self.input_log = None
+        if input_log is not None:
+            self.input_log = InputLogWriter(input_log, {
+                "room": name,
+                "seed": self.seed,
+                "tick_rate": tick_rate,
+                "send_rate": send_rate,
+                "view_radius": view_radius,
+                "created": self.now
+            })
+        self.memory_release_timers = {}  # {client_id: 结束内存释放状态的定时器}
+        self.state_update_timer = None  # 已安排但尚未执行的延迟状态更新
+        self.stats = {
+            "dropped_slow_clients": 0,  # 因发送队列积压过多而被断开的客户端数
+            "late_ticks": 0,  # 晚于预定时间执行的tick数
+            "skipped_ticks": 0,  # 因落后太多而跳过的tick数
+            "deferred_ticks": 0,  # 超出时间预算而推迟到下一轮调度的tick数
+            "coalesced_moves": 0  # 被同一tick内更新的位置覆盖掉的move消息数
+        }
+
+    @property
+    def empty(self):
+        """没有客户端也没有待处理的命令"""
+        return not self.clients and not self.commands
+
+    def close(self):
+        # 关闭房间内所有客户端的连接和输入日志
+        for client_id, (connection, _, _) in list(self.clients.items()):
+            try:
+                connection.close()
+            except:
+                pass
+        if self.input_log is not None:
+            self.input_log.close()
+
+    def run_due_ticks(self, budget=None):
+        """
+        执行本房间到期的tick，到了发送时间时发送快照，返回距离下一个tick的秒数
+        budget为本次调用的时间预算(秒)，超出预算时剩余的tick推迟到下一轮调度，让其他房间先执行
+        """
+        scheduler = self.scheduler
+        metrics = self.metrics
+        ticks = scheduler.due_ticks()
+        started = time.perf_counter()
+        deadline = started + budget if budget is not None else None
+        ran = 0
+        for _ in range(ticks):
+            if ran and deadline is not None and time.perf_counter() > deadline:
+                scheduler.defer(ticks - ran)
+                self.stats["deferred_ticks"] += ticks - ran
+                metrics.inc("deferred_ticks", ticks - ran)
+                break
+            # 每个tick使用相同的步长，落后时连续执行多个tick追赶
+            tick_started = time.perf_counter()
+            self._game_tick(scheduler.tick_interval)
+            metrics.observe("tick_seconds", time.perf_counter() - tick_started)
+            ran += 1
+        if ran and scheduler.send_due() and self.clients:
+            send_started = time.perf_counter()
+            self._send_game_state_update()
+            metrics.observe("snapshot_seconds", time.perf_counter() - send_started)
+        if ran:
+            # 每个客户端本tick的所有事件合并为一帧
+            flush_started = time.perf_counter()
+            self._flush_events()
+            finished = time.perf_counter()
+            metrics.observe("flush_seconds", finished - flush_started)
+            # 执行的tick连同发送超出了它们的步长，即占用了下一个tick的时间
+            if finished - started > ran * scheduler.tick_interval:
+                metrics.inc("tick_overruns")
+
+        self.stats["late_ticks"] = scheduler.late_ticks
+        self.stats["skipped_ticks"] = scheduler.skipped_ticks
+        report = scheduler.report()
+        if report:
+            print(f"房间 {self.name}: {report}")
+        return scheduler.sleep_time()
+
+    def _register_client(self, client_id, connection, client_address, message):
+        """处理connect命令：初始化玩家状态并发送欢迎消息"""
+        username = message.get('username', f"Player_{client_id}")
+
+        # 添加到客户端列表
+        self.clients[client_id] = (connection, client_address, username)
+        # 选择客户端支持的第一个编码，旧客户端不发送codecs字段，继续使用JSON
+        codec = negotiate_codec(message.get('codecs'))
+        self.client_codecs[client_id] = codec
+
+        # 初始化玩家游戏状态
+        # 为新玩家随机分配一个值
+        random_value = self.rng.randint(1, 255)
+        self.game_state["players"][client_id] = {
+            "position": [0, 0],  # 起始位置
+            "score": 0,
+            "username": username,
+            "value": random_value,
+            "target_value": random_value,
+            "base": 16,  # 默认十六进制
+            "memory_usage": 0,  # 内存使用量
+            "max_memory": 100,  # 最大内存容量
+            "memory_release_active": False,  # 内存释放状态
+            "memory_release_time": 0  # 内存释放状态变化时间
+        }
+        self.player_grid.update(client_id, 0, 0)
+        self.position_history.add(client_id, [0, 0])
+
+        # 新玩家加入后提交一个新的快照版本，欢迎消息作为该客户端的第一个关键帧
+        version, tick, state_json = self._refresh_snapshot(client_id)
+        self.keyframe_versions[client_id] = version
+
+        # 发送欢迎消息和当前游戏状态
+        welcome_msg = {
+            "type": "welcome",
+            "client_id": client_id,
+            "message": f"欢迎 {username} 加入游戏!",
+            "seq": version,
+            "tick": tick,
+            "codec": codec.name,
+            "room": self.name
+        }
+        if connection.datagram_offer is not None:
+            # 服务器开启了UDP且客户端在握手中请求了UDP通道
+            welcome_msg["udp"] = connection.datagram_offer
+        # 欢迎消息总是JSON，客户端从中得知之后使用的编码
+        encode_started = time.perf_counter()
+        welcome_frame = encode_frame(encode_payload_with(welcome_msg, game_state=state_json))
+        self.metrics.count_sent("welcome", 1, len(welcome_frame), time.perf_counter() - encode_started)
+        self._enqueue_frame(client_id, connection, welcome_frame, None)
+
+        # 广播新玩家加入的消息
+        broadcast_msg = {
+            "type": "player_joined",
+            "client_id": client_id,
+            "username": username,
+            "message": f"玩家 {username} 已加入游戏!"
+        }
+        # 其他客户端在下一次发送的增量中收到新玩家
+        self.broadcast(broadcast_msg, exclude=client_id)
+
+        print(f"客户端 {client_id} ({username}) 已连接: {client_address}")
+
+    def _remove_client(self, client_id):
+        # 客户端断开连接，从游戏中移除
+        if client_id in self.clients:
+            del self.clients[client_id]
+        self.snapshot_acks.pop(client_id, None)
+        self.keyframe_versions.pop(client_id, None)
+        self.keyframe_requests.discard(client_id)
+        self.pending_moves.pop(client_id, None)
+        self.pending_input_seqs.pop(client_id, None)
+        self.rtts.pop(client_id, None)
+        self.client_codecs.pop(client_id, None)
+        self.timers.cancel(self.memory_release_timers.pop(client_id, None))
+        self.events.forget(client_id)
+        if self.interest is not None:
+            self.interest.forget(client_id)
+        if client_id in self.game_state["players"]:
+            username = self.game_state["players"][client_id]["username"]
+            del self.game_state["players"][client_id]
+            self.player_grid.remove(client_id)
+            self.position_history.remove(client_id)
+
+            # 广播玩家离开的消息
+            leave_msg = {
+                "type": "player_left",
+                "client_id": client_id,
+                "username": username,
+                "message": f"玩家 {username} 已离开游戏!"
+            }
+            self.broadcast(leave_msg)
+            print(f"客户端 {client_id} ({username}) 已断开连接")
+
+    def _apply_commands(self):
+        """按到达顺序应用IO线程放入的命令(只在tick线程中调用)"""
+        # 只处理本次调用开始时已在队列中的命令，持续涌入的消息不会让tick无法结束
+        for _ in range(len(self.commands)):
+            kind, client_id, args = self.commands.popleft()
+            if self.input_log is not None:
+                # connect命令只记录握手消息，连接对象在重新模拟时由替身代替
+                message = args if kind == "message" else args[2] if kind == "connect" else None
+                self.input_log.command(self.tick, kind, client_id, message)
+            try:
+                if kind == "message":
+                    if client_id in self.clients:
+                        self.process_message(client_id, args)
+                elif kind == "connect":
+                    self._register_client(client_id, *args)
+                elif kind == "disconnect":
+                    self._remove_client(client_id)
+            except Exception as e:
+                # 出错时记录日志，但不影响后续命令
+                print(f"处理客户端 {client_id} 的消息时出错: {e}")
+
+    def process_message(self, client_id, message):
+        # 处理从客户端接收到的消息，由tick线程在应用命令时调用
+        message_type = message.get('type')
+
+        if message_type == 'base_change':
+            # 处理进制变换请求
+            new_base = message.get('base', 16)
+            if client_id in self.game_state["players"]:
+                self.game_state["players"][client_id]["base"] = new_base
+                # 发送更新消息给所有客户端
+                self._send_base_change_notification(client_id, new_base)
+
+        elif message_type == 'move':
+            # 处理玩家移动：只记录最新位置，在下一个tick统一应用并批量广播
+            position = message.get('position', [0, 0])
+            new_position = [float(position[0]), float(position[1])]  # 位置格式不正确时抛出异常
+            # 支持客户端预测的客户端为每次移动编号，服务器在玩家记录的input_seq中回传已应用的最新序号
+            seq = message.get('seq')
+            if client_id in self.game_state["players"]:
+                if client_id in self.pending_moves:
+                    self.stats["coalesced_moves"] += 1
+                self.pending_moves[client_id] = new_position
+                if seq is not None:
+                    self.pending_input_seqs[client_id] = int(seq)
+
+        elif message_type == 'player_update':
+            # 处理玩家值更新
+            new_value = message.get('value', 0)
+            memory_usage = message.get('memory_usage', 0)
+            memory_release_active = message.get('memory_release_active', None)
+            if client_id in self.game_state["players"]:
+                self.game_state["players"][client_id]["value"] = new_value
+                # 更新内存使用量
+                self.game_state["players"][client_id]["memory_usage"] = memory_usage
+                # 更新内存释放状态(如果提供了)
+                if memory_release_active is not None:
+                    self.game_state["players"][client_id]["memory_release_active"] = memory_release_active
+                    if memory_release_active:
+                        self._schedule_memory_release_end(client_id)
+                    else:
+                        self.timers.cancel(self.memory_release_timers.pop(client_id, None))
+                self._check_memory_release(client_id)
+                print(f"更新玩家 {client_id} 的值为 {new_value}，内存使用量为 {memory_usage}")
+            
+            # 广播玩家值更新
+            update_msg = {
+                "type": "player_value_updated",
+                "client_id": client_id,
+                "value": new_value,
+                "memory_usage": memory_usage,
+                "memory_release_active": self.game_state["players"][client_id]["memory_release_active"] if client_id in self.game_state["players"] else False
+            }
+            player_position = self.game_state["players"][client_id]["position"] if client_id in self.game_state["players"] else None
+            self.broadcast(update_msg, position=player_position)
+            
+            # 同时触发一次游戏状态更新
+            self._send_game_state_update()
+            
+        elif message_type == 'snapshot_ack':
+            # 客户端确认已应用的快照版本，之后的增量以此为基准
+            seq = message.get('seq')
+            if isinstance(seq, int) and seq <= self.state_store.version:
+                self.snapshot_acks[client_id] = max(seq, self.snapshot_acks.get(client_id, 0))
+            # 客户端回传快照的发送时间，到本tick开始的间隔是一次往返(包括客户端处理和命令排队的时间)
+            sent = message.get('time')
+            if isinstance(sent, (int, float)):
+                self._update_rtt(client_id, self.now - sent)
+
+        elif message_type == 'keyframe_request':
+            # 客户端收到了无法应用的增量(例如缺少完整记录的实体)，下一次快照改为完整关键帧
+            self.keyframe_requests.add(client_id)
+
+        elif message_type == 'chat':
+            # 处理聊天消息
+            chat_content = message.get('content', '')
+            username = self.game_state["players"][client_id]["username"]
+
+            chat_msg = {
+                "type": "chat",
+                "client_id": client_id,
+                "username": username,
+                "content": chat_content,
+                "timestamp": time.time()
+            }
+            self.broadcast(chat_msg)
+
+        elif message_type == 'action':
+            # 处理玩家动作
+            action = message.get('action', '')
+
+            if action == 'skill' or action == 'hex_skill' or action == 'decimal_skill':
+                # 处理技能使用
+                skill_name = message.get('skill_name', '')
+                skill_index = message.get('skill_index', -1)  # 对于十六进制技能
+                
+                # 检查是否是内存释放技能
+                if action == 'decimal_skill' and skill_index == 3:
+                    # 激活内存释放状态
+                    if client_id in self.game_state["players"]:
+                        self.game_state["players"][client_id]["memory_release_active"] = True
+                        self.game_state["players"][client_id]["memory_release_time"] = self.now
+                        self._schedule_memory_release_end(client_id)
+                
+                # 获取玩家位置
+                player_position = self.game_state["players"][client_id]["position"] if client_id in self.game_state["players"] else [0, 0]
+                
+                # 对于需要检查射程的技能，验证目标是否在范围内
+                can_use_skill = True
+                if skill_name in self.SKILL_RANGES:
+                    # 检查是否有目标在射程内
+                    targets_in_range = self.player_grid.any_within(player_position[0], player_position[1],
+                                                                   self.SKILL_RANGES[skill_name], exclude=client_id)
+                    if not targets_in_range:
+                        # 没有目标在射程内
+                        result = f"没有目标在{skill_name}技能射程内"
+                        can_use_skill = False
+                
+                if can_use_skill:
+                    result = self._process_skill(client_id, skill_name)
+                
+                # 获取运算符效果信息
+                operator_effect = {
+                    "symbol": self._get_operator_symbol(skill_name),
+                    "targets": []
+                }
+                
+                # 对于需要附近玩家的技能，添加目标玩家位置
+                if skill_name in ["AND", "OR", "XOR"]:
+                    # 获取附近玩家位置
+                    effect_range_sq = self.OPERATOR_EFFECT_RANGE ** 2
+                    nearby_players = []
+                    for distance_sq, other_id in self._players_in_range(client_id, player_position, self.OPERATOR_EFFECT_RANGE):
+                        if distance_sq < effect_range_sq:
+                            nearby_players.append(self.game_state["players"][other_id]["position"])
+                    operator_effect["targets"] = nearby_players
+                
+                # 获取内存使用量
+                memory_usage = message.get('memory_usage', 0)
+                if client_id in self.game_state["players"]:
+                    # 更新玩家内存使用量
+                    self.game_state["players"][client_id]["memory_usage"] = memory_usage
+                    self._check_memory_release(client_id)
+                
+                # 广播动作结果
+                action_result = {
+                    "type": "action_result",
+                    "client_id": client_id,
+                    "action": action,
+                    "skill_name": skill_name,
+                    "player_position": player_position,
+                    "operator_effect": operator_effect,
+                    "result": result,
+                    "memory_usage": memory_usage
+                }
+                
+                # 如果是十六进制技能或十进制技能，添加技能索引
+                if skill_index >= 0:
+                    action_result["skill_index"] = skill_index
+                    
+                self.broadcast(action_result, position=player_position)
+            else:
+                # 处理其他类型的动作
+                # 广播动作结果
+                action_result = {
+                    "type": "action_result",
+                    "client_id": client_id,
+                    "action": action,
+                    "result": "unknown_action"
+                }
+                self.broadcast(action_result)
+
+    def _enqueue_frame(self, client_id, connection, frame, key):
+        # 将帧放入客户端的发送队列，积压过多的客户端会被断开
+        if not connection.send_frame(frame, key):
+            self.stats["dropped_slow_clients"] += 1
+            print(f"客户端 {client_id} 发送队列积压过多，断开连接")
+            connection.abort()
+
+    def send_to_client(self, client_id, message):
+        # 向特定客户端发送消息，消息在本tick结束时随其他事件一起发出
+        if client_id in self.clients:
+            try:
+                encode_started = time.perf_counter()
+                payload = self._codec(client_id).encode(self._stamp(message))
+                self.metrics.count_sent(message.get("type"), 1, len(payload), time.perf_counter() - encode_started)
+                self.events.add([client_id], payload, conflation_key(message))
+            except Exception as e:
+                print(f"向客户端 {client_id} 发送消息时出错: {e}")
+
+    def broadcast(self, message, exclude=None, position=None):
+        # 向所有客户端广播消息，可选择排除特定客户端
+        # 指定position时只发送给视野范围内包含该位置的客户端
+        # 每种编码只编码一次，使用相同编码的客户端共用同一份字节
+        self._broadcast_message(self._stamp(message), conflation_key(message), exclude, position)
+
+    def _stamp(self, message):
+        # 为发出的消息加上当前的tick编号
+        stamped = dict(message)
+        stamped["tick"] = self.tick
+        return stamped
+
+    def _codec(self, client_id):
+        return self.client_codecs.get(client_id, JSON_CODEC)
+
+    def _broadcast_message(self, message, key, exclude=None, position=None):
+        # 按接收者的编码分组编码消息，加入所有接收者本tick的事件列表
+        visible = None
+        if position is not None and self.interest is not None:
+            # 通过空间索引找出视野内的客户端，不必逐个比较距离
+            visible = self.interest.visible_viewers(self.player_grid, position)
+        groups = {}  # {编码: [client_id]}
+        for client_id in list(self.clients):
+            if exclude is not None and client_id == exclude:
+                continue
+            if visible is not None and client_id not in visible and client_id in self.player_grid:
+                continue
+            groups.setdefault(self._codec(client_id), []).append(client_id)
+        for codec, recipients in groups.items():
+            try:
+                encode_started = time.perf_counter()
+                payload = codec.encode(message)
+            except Exception as e:
+                print(f"编码广播消息时出错: {e}")
+                return
+            self.metrics.count_sent(message.get("type"), len(recipients), len(payload),
+                                    time.perf_counter() - encode_started)
+            self.events.add(recipients, payload, key)
+
+    def _flush_events(self):
+        # 把本tick收集的事件按客户端合并为一帧(过大时拆分为多帧)放入发送队列
+        # 可合并的状态消息(快照、玩家位置等)不放入合并帧，单独成帧并带上合并键，
+        # 慢客户端的发送队列中尚未发送的旧状态因此仍会被新的状态替换
+        # 已建立UDP通道的客户端的玩家位置和快照改为数据报发送
+        for client_id, events in self.events.take_keyed().items():
+            client = self.clients.get(client_id)
+            if client is None:
+                continue
+            try:
+                peer = client[0].datagram
+                if peer is not None:
+                    events = self._send_datagrams(peer, events)
+                frames = [(frame, None) for frame in self._codec(client_id).encode_bundle(
+                    self.tick, [payload for key, payload in events if not isinstance(key, tuple)])]
+                frames.extend((encode_frame(payload), key) for key, payload in events if isinstance(key, tuple))
+                for frame, key in frames:
+                    self.metrics.inc("frames_sent")
+                    self.metrics.inc("bytes_sent", len(frame))
+                    self._enqueue_frame(client_id, client[0], frame, key)
+            except Exception as e:
+                print(f"向客户端 {client_id} 发送事件时出错: {e}")
+
+    def _send_datagrams(self, peer, events):
+        """把可以丢失的状态消息作为数据报发送，返回其余需要通过TCP可靠发送的[(合并键, 负载)]"""
+        reliable = []
+        for key, payload in events:
+            if isinstance(key, tuple) and key[0] in DATAGRAM_MESSAGES and len(payload) <= MAX_DATAGRAM_PAYLOAD:
+                peer.send(payload)
+                self.metrics.inc("datagrams_sent")
+                self.metrics.inc("datagram_bytes_sent", len(payload))
+            else:
+                reliable.append((key, payload))
+        return reliable
+
+    def _send_base_change_notification(self, client_id, new_base):
+        # 向所有客户端发送进制变更通知
+        player_position = self.game_state["players"][client_id]["position"] if client_id in self.game_state["players"] else [0, 0]
+        base_change_msg = {
+            "type": "base_changed",
+            "client_id": client_id,
+            "base": new_base,
+            "timestamp": time.time(),
+            "priority": "high",  # 添加高优先级标记
+            "player_position": player_position  # 添加玩家位置信息
+        }
+        # 广播进制变更消息
+        self.broadcast(base_change_msg, position=player_position)
+        print(f"广播进制变更消息: 玩家 {client_id} 切换到 {new_base} 进制，位置: {player_position}")
+
+        # 延迟一小段时间后发送一次完整游戏状态更新，确保所有客户端同步
+        # 由时间轮在到期的tick执行，同一段时间内的多次进制变更只触发一次更新
+        if self.state_update_timer is None:
+            self.state_update_timer = self.timers.schedule(self.BASE_CHANGE_UPDATE_DELAY, self._send_delayed_state_update)
+
+    def _send_delayed_state_update(self):
+        self.state_update_timer = None
+        self._send_game_state_update()
+
+    def _schedule_memory_release_end(self, client_id):
+        # 在内存释放状态变化MEMORY_RELEASE_DURATION秒后结束内存释放，重新安排时取消之前的定时器
+        self.timers.cancel(self.memory_release_timers.pop(client_id, None))
+        release_time = self.game_state["players"][client_id].get("memory_release_time", 0)
+        remaining = max(0, release_time + self.MEMORY_RELEASE_DURATION - self.now)
+        self.memory_release_timers[client_id] = self.timers.schedule(remaining, self._end_memory_release, client_id)
+
+    def _end_memory_release(self, client_id):
+        # 结束内存释放状态
+        self.timers.cancel(self.memory_release_timers.pop(client_id, None))
+        player = self.game_state["players"].get(client_id)
+        if player is not None and player.get("memory_release_active", False):
+            player["memory_release_active"] = False
+            player["memory_release_time"] = self.now
+
+    def _check_memory_release(self, client_id):
+        # 如果玩家内存使用量为0，也结束内存释放状态
+        player = self.game_state["players"].get(client_id)
+        if player is not None and player.get("memory_usage", 0) == 0 and player.get("memory_release_active", False):
+            self._end_memory_release(client_id)
+
+    def _update_animations(self):
+        # 更新所有动画效果
+        current_time = self.now
+        # 更新转换动画
+        active_conversions = []
+        for conv in self.game_state["base_conversions"]:
+            elapsed = current_time - conv["start_time"]
+            if elapsed < conv["duration"]:
+                # 动画还在进行中
+                progress = elapsed / conv["duration"]  # 0到1之间的进度值
+                
+                # 平滑更新玩家的值
+                client_id = conv["client_id"]
+                if client_id in self.game_state["players"]:
+                    # 使用线性插值计算当前值
+                    start = conv["start_value"]
+                    end = conv["end_value"]
+                    current = start + (end - start) * progress
+                    self.game_state["players"][client_id]["value"] = int(current)
+                    
+                # 保留此动画继续处理
+                active_conversions.append(conv)
+            else:
+                # 动画结束，确保最终值正确设置
+                client_id = conv["client_id"]
+                if client_id in self.game_state["players"]:
+                    self.game_state["players"][client_id]["value"] = conv["end_value"]
+        
+        # 更新动画列表，只保留活跃的动画
+        self.game_state["base_conversions"] = active_conversions
+
+    def _capture_snapshot(self):
+        """复制一份本帧的游戏状态视图(只在tick线程中调用)，之后的编码和发送不再访问实时状态"""
+        players = {}
+        for player_id, player_data in self.game_state["players"].items():
+            player_copy = dict(player_data)
+            player_copy["position"] = list(player_data["position"])
+            players[player_id] = player_copy
+
+        return {
+            "players": players,
+            "game_objects": list(self.game_state["game_objects"]),
+            "base_conversions": [dict(conv) for conv in self.game_state["base_conversions"]],
+            # 子弹记录在子弹变化时重新生成，不会被之后的帧修改
+            "bullets": self.game_state["bullets"].records()
+        }
+
+    def _commit_state(self):
+        """提交一个新的快照版本(只在tick线程中调用)"""
+        self.state_store.sync("bullets", self.game_state["bullets"].records())
+        self.state_store.sync_value("base_conversions", self.game_state["base_conversions"])
+        return self.state_store.commit()
+
+    def _filter_snapshot(self, snapshot, keys):
+        """只保留兴趣集合中的玩家和子弹"""
+        bullets_by_id = {bullet["id"]: bullet for bullet in snapshot["bullets"]}
+        players = {}
+        bullets = []
+        for kind, entity_id in keys:
+            if kind == "players" and entity_id in snapshot["players"]:
+                players[entity_id] = snapshot["players"][entity_id]
+            elif kind == "bullets" and entity_id in bullets_by_id:
+                bullets.append(bullets_by_id[entity_id])
+        filtered = dict(snapshot)
+        filtered["players"] = players
+        filtered["bullets"] = bullets
+        return filtered
+
+    def _refresh_snapshot(self, viewer_id=None):
+        """
+        提交新版本并复制完整游戏状态，编码一次，返回(版本, tick, 游戏状态JSON)
+        启用兴趣区域时只包含viewer_id视野内的实体
+        """
+        version = self._commit_state()
+        tick = self.tick
+        snapshot = self._capture_snapshot()
+        if self.interest is not None and viewer_id is not None:
+            keys = self.interest.compute([viewer_id], self.game_state["players"],
+                                         self.game_state["bullets"].records())[viewer_id]
+            self.interest.record(viewer_id, version, keys)
+            snapshot = self._filter_snapshot(snapshot, keys)
+        return version, tick, encode_payload(snapshot)
+
+    def _encode_keyframe(self, codec, version, tick, snapshot, timestamp):
+        # 完整关键帧，沿用game_update消息格式
+        update_msg = {
+            "type": "game_update",
+            "seq": version,
+            "tick": tick,
+            "timestamp": timestamp,  # 添加时间戳以帮助客户端判断最新状态
+            "game_state": snapshot
+        }
+        return codec.encode(update_msg)
+
+    def _encode_delta(self, codec, version, tick, base, delta, timestamp):
+        # 相对于客户端已确认版本的增量，空的字段不发送
+        delta_msg = {
+            "type": "game_delta",
+            "seq": version,
+            "tick": tick,
+            "base": base,
+            "timestamp": timestamp
+        }
+        for kind in ("players", "bullets"):
+            if kind in delta["changed"]:
+                delta_msg[kind] = delta["changed"][kind]
+            if kind in delta["removed"]:
+                delta_msg["removed_" + kind] = delta["removed"][kind]
+            if kind in delta.get("left", {}):
+                # 离开视野的实体
+                delta_msg["left_" + kind] = delta["left"][kind]
+        delta_msg.update(delta["values"])
+        return codec.encode(delta_msg)
+
+    def _interest_delta(self, keys, kept, seen, shared):
+        """
+        生成兴趣集合keys相对于客户端确认版本的增量(只在tick线程中调用)
+        kept为确认版本之后发送的每个集合中都有的实体，seen为其中任一集合中有的实体，shared为确认版本之后所有实体的增量
+        返回(消息的其他字段, 只发送变化字段的实体, 发送完整记录的实体)
+        """
+        # 一直在视野内的实体只发送变化的字段；
+        # 进入视野的实体，以及确认版本之后离开过视野的实体，发送完整记录
+        stay = keys & kept
+        enter = keys - kept
+        fields = {}
+        for kind, entity_ids in shared["removed"].items():
+            removed = [entity_id for entity_id in entity_ids if (kind, entity_id) in stay]
+            if removed:
+                fields["removed_" + kind] = removed
+        # 离开视野(包括已被移除)的实体
+        for kind, entity_id in seen - keys:
+            fields.setdefault("left_" + kind, []).append(entity_id)
+        fields.update(shared["values"])
+        return fields, stay, enter
+
+    def _delta_records(self, codec, base, keys, changed, cache):
+        """
+        返回keys中的实体相对于base版本的编码记录{kind: [编码后的记录]}，base为None时为完整记录
+        编码结果按(编码, 基准版本)缓存在cache中，视野重叠的客户端共用同一份编码
+        """
+        # ({kind: {(kind, 实体ID): 编码后的记录}}, 已经检查过的实体键)，没有变化的实体不在前者中
+        encoded, checked = cache.setdefault((codec, base), ({}, set()))
+        for key in keys - checked:
+            checked.add(key)
+            kind, entity_id = key
+            if base is None:
+                record = self.state_store.records([key]).get(kind, {}).get(entity_id)
+            else:
+                record = changed.get(kind, {}).get(entity_id)
+            if record is not None:
+                encoded.setdefault(kind, {})[key] = codec.encode_record(kind, entity_id, record)
+        parts = {}
+        for kind, records in encoded.items():
+            selected = [records[key] for key in keys if key in records]
+            if selected:
+                parts[kind] = selected
+        return parts
+
+    def _encode_interest_delta(self, codec, version, tick, base, timestamp, own, shared_deltas, cache):
+        # 拼接本客户端视野内实体的编码记录，不再为每个客户端单独生成和编码增量
+        fields, stay, enter = own
+        parts = self._delta_records(codec, base, stay, shared_deltas[base]["changed"], cache)
+        for kind, encoded in self._delta_records(codec, None, enter, None, cache).items():
+            parts.setdefault(kind, []).extend(encoded)
+        message = {"type": "game_delta", "seq": version, "tick": tick, "base": base, "timestamp": timestamp}
+        message.update(fields)
+        payload = codec.encode_delta(message, parts)
+        if payload is None:
+            return self._encode_interest_delta(JSON_CODEC, version, tick, base, timestamp, own, shared_deltas, cache)
+        return payload
+
+    def _send_game_state_update(self):
+        # 发送游戏状态更新到所有客户端
+        # 已确认过快照的客户端收到相对于确认版本的增量，其余客户端以及到期的客户端收到完整关键帧
+        # 启用兴趣区域时每个客户端只收到视野内的实体，并通过增量得知进入/离开视野的实体；
+        # 增量按基准版本只生成一次，每个实体记录只编码一次，各客户端的增量只是选取并拼接这些记录
+        version = self._commit_state()
+        tick = self.tick
+        interest = None
+        if self.interest is not None:
+            interest = self.interest.compute(list(self.clients), self.game_state["players"],
+                                             self.game_state["bullets"].records())
+        snapshot = None
+        shared_deltas = {}  # {基准版本: 增量}
+        recipients = []  # [(client_id, 基准版本, 启用兴趣区域时本客户端的关键帧或增量)]
+        for client_id in list(self.clients):
+            base = self.snapshot_acks.get(client_id)
+            keys = interest.get(client_id) if interest is not None else None
+            known = None
+            if keys is not None and self.state_store.can_delta(base):
+                known = self.interest.known_since(client_id, base)
+            if (not self.state_store.can_delta(base)
+                    or client_id in self.keyframe_requests
+                    or (keys is not None and known is None)
+                    or version - self.keyframe_versions.get(client_id, 0) >= self.KEYFRAME_INTERVAL):
+                if snapshot is None:
+                    snapshot = self._capture_snapshot()
+                own = self._filter_snapshot(snapshot, keys) if keys is not None else None
+                recipients.append((client_id, None, own))
+            else:
+                if base not in shared_deltas:
+                    shared_deltas[base] = self.state_store.delta_since(base)
+                own = self._interest_delta(keys, *known, shared_deltas[base]) if keys is not None else None
+                recipients.append((client_id, base, own))
+            if keys is not None:
+                self.interest.record(client_id, version, keys)
+
+        # 编码时不再访问实时状态，未启用兴趣区域时基准版本和编码都相同的客户端共用同一份编码结果
+        # 快照时间戳使用房间的时钟，客户端在确认中回传，用来估计往返时间
+        timestamp = self.clock()
+        shared_payloads = {}  # {(基准版本, 编码): 负载}
+        records = {}  # {(编码, 基准版本): 编码后的实体记录}
+        key = conflation_key({"type": "game_update"})
+        for client_id, base, own in recipients:
+            codec = self._codec(client_id)
+            encode_started = time.perf_counter()
+            if own is not None:
+                if base is None:
+                    payload = self._encode_keyframe(codec, version, tick, own, timestamp)
+                else:
+                    payload = self._encode_interest_delta(codec, version, tick, base, timestamp, own, shared_deltas,
+                                                          records)
+            else:
+                if (base, codec) not in shared_payloads:
+                    if base is None:
+                        shared_payloads[base, codec] = self._encode_keyframe(codec, version, tick, snapshot, timestamp)
+                    else:
+                        shared_payloads[base, codec] = self._encode_delta(codec, version, tick, base, shared_deltas[base], timestamp)
+                payload = shared_payloads[base, codec]
+            # 共用的编码结果只在第一次编码时计入耗时，之后的耗时接近0
+            self.metrics.count_sent("game_update" if base is None else "game_delta", 1, len(payload),
+                                    time.perf_counter() - encode_started)
+            if base is None:
+                self.keyframe_versions[client_id] = version
+                self.keyframe_requests.discard(client_id)
+            # 快照和本tick的其他事件一起发出
+            self.events.add([client_id], payload, key)
+
+    def _update_rtt(self, client_id, sample):
+        # 与TCP的SRTT相同的指数加权平均，单次样本限制在保留的历史长度内
+        sample = min(max(sample, 0.0), HISTORY_SECONDS)
+        rtt = self.rtts.get(client_id)
+        self.rtts[client_id] = sample if rtt is None else rtt + (sample - rtt) / 8
+
+    def _view_delay(self, client_id):
+        """客户端看到的其他玩家比服务器当前状态落后的时间，没有往返时间估计的客户端不回退"""
+        rtt = self.rtts.get(client_id)
+        if rtt is None:
+            return 0.0
+        return min(rtt + INTERPOLATION_DELAY, HISTORY_SECONDS)
+
+    def _apply_pending_moves(self):
+        """应用本tick内收到的移动(只在tick线程中调用)，返回{client_id: 新位置}"""
+        moved = {}
+        players = self.game_state["players"]
+        for client_id, position in self.pending_moves.items():
+            if client_id in players:
+                self.player_grid.update(client_id, position[0], position[1])
+                players[client_id]["position"] = position
+                self.position_history.move(client_id, position)
+                seq = self.pending_input_seqs.get(client_id)
+                if seq is not None:
+                    players[client_id]["input_seq"] = seq
+                moved[client_id] = position
+        self.pending_moves = {}
+        self.pending_input_seqs = {}
+        return moved
+
+    def _broadcast_moves(self, moved):
+        # 每个tick最多发送一条批量的玩家位置更新
+        if not moved:
+            return
+        if self.interest is None:
+            self.broadcast({"type": "players_moved", "positions": moved})
+            return
+        # 每个客户端只收到视野内玩家的位置
+        per_viewer = {}
+        for player_id, position in moved.items():
+            for viewer_id in self.interest.visible_viewers(self.player_grid, position):
+                per_viewer.setdefault(viewer_id, {})[player_id] = position
+        for viewer_id, positions in per_viewer.items():
+            self.send_to_client(viewer_id, {"type": "players_moved", "positions": positions})
+
+    def _game_tick(self, frame_time):
+        # 执行一帧游戏逻辑，线程模式和asyncio模式共用
+        self.tick += 1
+        self.now = self.clock()
+        if self.input_log is not None:
+            self.input_log.tick(self.tick, self.now)
+        # 执行在本tick到期的定时器(延迟的状态更新、内存释放结束、子弹寿命)
+        # 先推进时间轮，之后应用命令时安排的定时器从本tick开始计算延迟，不会提前一个tick触发
+        self.timers.advance()
+        # 应用IO线程收到的连接、断开和客户端消息
+        self._apply_commands()
+        # 应用本tick内收到的玩家移动
+        moved = self._apply_pending_moves()
+        self.position_history.record(self.now)
+        # 更新动画效果
+        self._update_animations()
+        # 更新子弹
+        self._update_bullets(frame_time)
+
+        # 广播本tick的玩家位置
+        self._broadcast_moves(moved)
+
+        if self.input_log is not None and self.tick % HASH_INTERVAL == 0:
+            self.input_log.state_hash(self.tick, self.state_hash())
+
+    def state_hash(self):
+        """游戏状态(玩家、子弹和子弹ID计数)的8字节哈希，用于检查重新模拟的结果与录制时是否一致"""
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(encode_payload(self.game_state["players"]))
+        digest.update(self.game_state["bullets"].state_bytes())
+        digest.update(self.bullet_id_counter.to_bytes(8, 'big'))
+        return digest.digest()
+
+    def _players_in_range(self, client_id, position, radius):
+        """返回position周围radius内的其他玩家[(平方距离, 玩家ID)]，按距离从近到远排序"""
+        players = self.game_state["players"]
+        return sorted(entry for entry in self.player_grid.query_radius(position[0], position[1], radius, exclude=client_id)
+                      if entry[1] in players)
+
+    def _process_skill(self, client_id, skill_name):
+        """处理玩家使用的技能，并应用相应的逻辑运算"""
+        if client_id not in self.game_state["players"]:
+            return "player_not_found"
+
+        player = self.game_state["players"][client_id]
+        current_value = player["value"]
+        username = player["username"]
+
+        # 获取玩家位置
+        player_pos = player["position"]
+
+        # 按位非运算不需要附近玩家
+        if skill_name == "NOT":
+            # 按位非运算
+            # 对自己的值进行按位非运算
+            result_value = ~current_value & 0xFF  # 限制为8位
+            old_value = player["value"]
+            player["value"] = result_value
+            player["target_value"] = result_value
+            # 广播值变化
+            return "成功执行NOT运算"
+
+        # 射程内的其他玩家(距离, 玩家ID)，按距离从近到远排序
+        nearby_players = []
+        if skill_name in self.SKILL_RANGES:
+            nearby_players = self._players_in_range(client_id, player_pos, self.SKILL_RANGES[skill_name])
+
+        # 需要附近玩家的运算(AND, OR, XOR)
+        operations = {
+            "AND": lambda x, y: x & y,
+            "OR": lambda x, y: x | y,
+            "XOR": lambda x, y: x ^ y
+        }
+
+        # 执行对应的位运算
+        if skill_name in operations:
+            if nearby_players:
+                # 将最近的玩家作为目标
+                _, target_id = nearby_players[0]
+                target_player = self.game_state["players"][target_id]
+                target_value = target_player["value"]
+                current_value = operations[skill_name](current_value, target_value)
+                # 设置新值
+                old_value = player["value"]
+                target_player["value"] = current_value
+                target_player["memory_usage"] = target_player["memory_usage"] + current_value % 8
+                # 广播值变化
+                # self._broadcast_value_change(client_id, old_value, current_value)
+                update_msg = {
+                    "type": "player_value_updated",
+                    "client_id": target_id,
+                    "value": target_player["value"],
+                    "memory_usage": target_player["memory_usage"],
+                    "memory_release_active": self.game_state["players"][target_id]["memory_release_active"] if target_id in self.game_state["players"] else False
+                }
+                self.broadcast(update_msg, position=target_player["position"])
+                return f"成功对{len(nearby_players)}个玩家执行{skill_name}运算"
+            else:
+                return f"射程内没有玩家，无法执行{skill_name}运算"
+
+        # 处理开火技能 - 发射子弹
+        if skill_name == "开火":
+            # 找到射程内最近的玩家作为目标
+            if nearby_players:
+                # 最近的玩家
+                target_player = self.game_state["players"][nearby_players[0][1]]
+                target_pos = target_player["position"]
+
+                # 计算子弹发射方向（从玩家指向目标）
+                dx = target_pos[0] - player_pos[0]
+                dy = target_pos[1] - player_pos[1]
+                # 标准化方向向量
+                magnitude = math.sqrt(max(0, dx**2 + dy**2))
+                if magnitude > 0:
+                    dx /= magnitude
+                    dy /= magnitude
+                else:
+                    # 如果玩家和目标位置重合，设置一个默认方向（向右）
+                    dx, dy = 1, 0
+
+                # 根据玩家值计算子弹数量（最多28个，最少1个，确保能构成倒等腰三角形）
+                # 计算子弹伤害值（1-32，随玩家值增加而增加）
+                # 计算子弹速度（随玩家值增加而增加）
+
+                player_value = max(1, min(255, player["value"]))
+
+                # 计算子弹数量，确保能形成倒等腰三角形
+                # 倒等腰三角形的行数需要是1, 3, 6, 10, 15, 21, 28...
+                triangle_rows = [1, 3, 6, 10, 15, 21, 28]
+                # 根据玩家值选择行数，值越大行数越少
+                num_bullets = 0
+                row_index = min(len(triangle_rows) - 1, max(int((len(triangle_rows)-1) * (1 - player_value / 255)), 1))
+                for i in range(row_index):
+                    num_bullets += triangle_rows[i]
+
+                # 计算子弹伤害（1-32）
+                bullet_damage = max(1, min(48, int(48 * (player_value / 255) / num_bullets)))
+
+                # 计算子弹速度（基础速度 + 根据玩家值增加）
+                bullet_speed_base = 200
+                bullet_speed_factor = player_value / 255 * 300  # 最多增加7的速度
+                bullet_speed = bullet_speed_base + bullet_speed_factor
+                row_speed_subtract = 1
+
+                # 创建子弹阵列（倒等腰三角形）
+                bullets_created = []
+                bullet_slots = []
+                current_row = 1
+                total_bullets = 0
+                spread_angle_init = 3.14 / 6  # 子弹扩散角度
+
+                # 创建倒等腰三角形的子弹阵列
+                while total_bullets < num_bullets:
+                    num_row_bullets = triangle_rows[current_row - 1]
+                    for i in range(num_row_bullets):
+                        if total_bullets >= num_bullets:
+                            break
+
+                        # 计算扩散角度，使子弹形成三角形
+                        spread_angle = spread_angle_init / num_row_bullets
+                        angle_offset = (i - (num_row_bullets - 1) / 2) * spread_angle
+
+                        # 计算旋转后的方向
+                        try:
+                            rotated_dx = dx * math.cos(angle_offset) - dy * math.sin(angle_offset)
+                            rotated_dy = dx * math.sin(angle_offset) + dy * math.cos(angle_offset)
+                            # 确保没有复数产生
+                            if isinstance(rotated_dx, complex) or isinstance(rotated_dy, complex):
+                                rotated_dx = 1.0 if rotated_dx == 0 else float(rotated_dx.real)
+                                rotated_dy = 0.0 if rotated_dy == 0 else float(rotated_dy.real)
+                        except Exception:
+                            # 出现任何错误时使用默认方向
+                            rotated_dx, rotated_dy = 1.0, 0.0
+
+                        row_speed_subtract = bullet_speed / 1000 * current_row  # 每行速度递减10%
+                        # 创建子弹，从玩家位置发射
+                        slot = self.game_state["bullets"].spawn(
+                            self.bullet_id_counter, client_id, player_pos,
+                            [(rotated_dx * bullet_speed) * (row_speed_subtract), (rotated_dy * bullet_speed) * (row_speed_subtract)],
+                            bullet_damage, self.tick, self.now)
+
+                        self.bullet_id_counter += 1
+                        bullet_slots.append(slot)
+                        bullets_created.append(self.game_state["bullets"].record(slot))
+                        total_bullets += 1
+
+                    current_row += 1
+
+                # 同一次开火的子弹一起在寿命到期时移除
+                if bullet_slots:
+                    self.timers.schedule(BULLET_LIFETIME, self.game_state["bullets"].expire_slots,
+                                         bullet_slots, [bullet["id"] for bullet in bullets_created])
+
+                # 广播子弹创建消息
+                bullet_msg = {
+                    "type": "bullets_created",
+                    "bullets": bullets_created,
+                    "owner_id": client_id
+                }
+                self.broadcast(bullet_msg, position=player_pos)
+
+                # 开火技能使用者增加10点内存
+                player["memory_usage"] += 10
+
+                # 更新玩家状态
+                update_msg = {
+                    "type": "player_value_updated",
+                    "client_id": client_id,
+                    "value": player["value"],
+                    "memory_usage": player["memory_usage"],
+                    "memory_release_active": player.get("memory_release_active", False)
+                }
+                self.broadcast(update_msg, position=player["position"])
+
+                return f"成功发射{len(bullets_created)}个子弹，目标为玩家{target_player['username']}"
+            else:
+                return "射程内没有可攻击的目标"
+
+        return "未知技能"
+        
+
+    def _get_operator_symbol(self, skill_name):
+        symbols = {
+            "AND": "&",
+            "OR": "|",
+            "NOT": "~",
+            "XOR": "^"
+        }
+        return symbols.get(skill_name, "")
+
+    def _update_bullets(self, delta_time):
+        """更新所有子弹位置并检测碰撞"""
+        bullets = self.game_state["bullets"]
+        if not len(bullets):
+            return
+
+        # 更新子弹位置
+        bullets.integrate(delta_time)
+
+        # 检测与玩家的碰撞，击中的子弹已从存储中移除
+        players = self.game_state["players"]
+        player_ids = list(players)
+        if not player_ids:
+            return
+        # 射击者开火时看到的目标落后于服务器，子弹生成后的这段时间内把目标回退到射击者看到的时刻；
+        # 之后的飞行与目标的当前位置比较，长寿命的子弹不会一直打在目标过去的位置上
+        owners, spawn_ticks = bullets.live_spawns()
+        unique_owners, owner_index = np.unique(owners, return_inverse=True)
+        delays = np.array([self._view_delay(owner) for owner in unique_owners.tolist()])[owner_index]
+        delays[(self.tick - spawn_ticks) * self.scheduler.tick_interval >= delays] = 0.0
+        player_positions, frame_index = self.position_history.rewind(player_ids, self.now - delays)
+        for bullet_id, player_id, damage, bullet_pos in bullets.collide(player_ids, player_positions,
+                                                                        frames=frame_index):
+            player = players[player_id]
+
+            # 增加被击中玩家的内存使用
+            player["memory_usage"] += damage
+
+            # 广播子弹击中消息
+            hit_msg = {
+                "type": "bullet_hit",
+                "bullet_id": bullet_id,
+                "target_id": player_id,
+                "damage": damage,
+                "position": bullet_pos
+            }
+            self.broadcast(hit_msg, position=bullet_pos)
+
+            # 更新被击中玩家状态
+            update_msg = {
+                "type": "player_value_updated",
+                "client_id": player_id,
+                "value": player["value"],
+                "memory_usage": player["memory_usage"],
+                "memory_release_active": player.get("memory_release_active", False)
+            }
+            self.broadcast(update_msg, position=player["position"])
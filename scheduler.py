@@ -0,0 +1,102 @@
+# scheduler.py
+# 服务器端的固定步长tick调度
+#
+# 游戏逻辑以固定的模拟频率推进，每个tick使用相同的步长；快照按独立的发送频率发出。
+# 使用单调时钟计算每个tick的预定时间，落后时在一次调度中连续执行多个tick追赶，
+# 落后超过追赶上限的tick直接跳过，并统计延迟和跳过的tick数以便评估硬件是否足够。
+
+import time
+
+# 默认模拟频率(每秒tick数)
+DEFAULT_TICK_RATE = 30
+
+# 默认快照发送频率(每秒次数)
+DEFAULT_SEND_RATE = 20
+
+# 一次调度最多连续执行的tick数，落后更多时跳过剩余的tick
+MAX_CATCH_UP_TICKS = 5
+
+# 有延迟或跳过的tick时，至少间隔多少秒输出一次统计
+REPORT_INTERVAL = 10.0
+
+
+class TickScheduler:
+    """固定步长调度器，由游戏循环反复调用due_ticks()/send_due()/sleep_time()"""
+
+    def __init__(self, tick_rate=DEFAULT_TICK_RATE, send_rate=DEFAULT_SEND_RATE,
+                 max_catch_up=MAX_CATCH_UP_TICKS, clock=time.monotonic):
+        if tick_rate <= 0 or send_rate <= 0:
+            raise ValueError("模拟频率和发送频率必须大于0")
+        self.tick_rate = tick_rate
+        self.send_rate = send_rate
+        self.tick_interval = 1.0 / tick_rate
+        self.send_interval = 1.0 / send_rate
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.ticks = 0          # 已执行的tick数
+        self.late_ticks = 0     # 晚于预定时间一个步长以上才执行的tick数
+        self.skipped_ticks = 0  # 超过追赶上限而跳过的tick数
+        self._next_tick = None  # 下一个tick的预定时间
+        self._next_send = None  # 下一次发送快照的预定时间
+        self._reported = (0, 0)
+        self._last_report = None
+
+    def start(self):
+        now = self.clock()
+        self._next_tick = now
+        self._next_send = now
+        self._last_report = now
+
+    def due_ticks(self):
+        """返回现在应执行的tick数；落后的时间累积为多个tick，超过追赶上限的部分被跳过"""
+        if self._next_tick is None:
+            self.start()
+        now = self.clock()
+        if now < self._next_tick:
+            return 0
+        behind = int((now - self._next_tick) / self.tick_interval) + 1
+        run = min(behind, self.max_catch_up)
+        self.late_ticks += run - 1
+        self.skipped_ticks += behind - run
+        self._next_tick += behind * self.tick_interval
+        self.ticks += run
+        return run
+
+    def defer(self, count):
+        """退回due_ticks()返回但未执行的count个tick，下一次调度时再执行"""
+        self._next_tick -= count * self.tick_interval
+        self.ticks -= count
+        # 退回的tick都已计入延迟，再次执行时会重新计数
+        self.late_ticks -= count
+
+    def send_due(self):
+        """是否到了发送快照的时间；落后时不补发，只从现在起重新计时"""
+        if self._next_send is None:
+            self.start()
+        now = self.clock()
+        if now < self._next_send:
+            return False
+        self._next_send += self.send_interval
+        if self._next_send <= now:
+            self._next_send = now + self.send_interval
+        return True
+
+    def sleep_time(self):
+        """距离下一个tick的秒数"""
+        if self._next_tick is None:
+            return 0.0
+        return max(0.0, self._next_tick - self.clock())
+
+    def report(self):
+        """自上次输出以来出现了新的延迟或跳过的tick且已超过输出间隔时，返回统计文本，否则返回None"""
+        now = self.clock()
+        if self._last_report is None or now - self._last_report < REPORT_INTERVAL:
+            return None
+        elapsed = now - self._last_report
+        self._last_report = now
+        current = (self.late_ticks, self.skipped_ticks)
+        if current == self._reported:
+            return None
+        late, skipped = current[0] - self._reported[0], current[1] - self._reported[1]
+        self._reported = current
+        return f"最近{elapsed:.0f}秒内有{late}个tick延迟执行，{skipped}个tick被跳过(模拟频率{self.tick_rate}Hz)"
@@ -1,35 +1,115 @@
 import socket
+import selectors
 import threading
-import json
+import itertools
+import asyncio
+import os
 import time
-import random
-import math
-from math import sin, cos
+
+from protocol import FrameBuffer, FrameError, DEFAULT_BUFFER_SIZE, FRAME_HEADER, FRAME_HEADER_SIZE
+from codec import decode_message
+from outbound import ThreadedClientConnection, AsyncioClientConnection, DEFAULT_MAX_PENDING
+from interest import DEFAULT_VIEW_RADIUS, SUGGESTED_VIEW_RADIUS
+from scheduler import DEFAULT_TICK_RATE, DEFAULT_SEND_RATE
+from room import GameRoom
+from metrics import MetricsRegistry, StatsServer, queue_depths
+from profiler import SamplingProfiler, DEFAULT_PROFILE_DIR, profile_path
+from inputlog import log_path
+from datagram import DatagramEndpoint
+from workers import (WorkerPool, MAX_HANDSHAKE_SIZE, LOAD_REPORT_INTERVAL, MAX_REPORTED_ROOMS, send_channel_message,
+                     recv_channel_message)
+
 
 class GameServer:
-    def __init__(self, host='localhost', port=5555):
+    # 可选的网络IO模式: asyncio(单事件循环) 或 threaded(旧的每连接一个线程)
+    IO_MODES = ('asyncio', 'threaded')
+    # connect消息没有指定房间的客户端进入的房间，该房间在没有玩家时也不会关闭
+    DEFAULT_ROOM = "default"
+    # 房间名的最大长度
+    MAX_ROOM_NAME = 64
+    # 每轮调度中每个房间至少可以使用的时间预算(秒)
+    MIN_ROOM_BUDGET = 0.002
+    # 多进程模式下前端等待connect握手的最长时间(秒)
+    HANDSHAKE_TIMEOUT = 5.0
+    # 指标快照中最多列出的房间数(按玩家数从多到少)
+    MAX_ROOM_METRICS = 20
+
+    def __init__(self, host='localhost', port=5555, io_mode='asyncio', backlog=socket.SOMAXCONN,
+                 view_radius=DEFAULT_VIEW_RADIUS, tick_rate=DEFAULT_TICK_RATE, send_rate=DEFAULT_SEND_RATE,
+                 workers=0, stats_port=None, input_log=None, udp=False, profile_dir=DEFAULT_PROFILE_DIR):
+        if io_mode not in self.IO_MODES:
+            raise ValueError(f"未知的IO模式: {io_mode}")
+        if tick_rate <= 0 or send_rate <= 0:
+            raise ValueError("模拟频率和发送频率必须大于0")
         self.host = host
         self.port = port
+        self.io_mode = io_mode
+        self.backlog = backlog
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.clients = {}  # {client_id: (client_socket, client_address, username)}
-        self.client_id_counter = 0
-        self.game_state = {
-            "players": {},  # {client_id: {"position": [x, y], "score": 0, "username": "name", "value": 0, "target_value": 0, "memory_release_active": False, "memory_release_time": 0}}
-            "game_objects": [],
-            "base_conversions": [],  # 保存进制转换的动画信息
-            "bullets": []  # 存储子弹对象 {"id": bullet_id, "owner": client_id, "position": [x, y], "velocity": [dx, dy], "damage": damage, "created_time": time_created, "char": "*", "color": (212, 212, 212)}
-        }
+        self.client_ids = itertools.count()  # 由IO线程在握手时分配客户端ID，在所有房间中唯一
         self.running = False
-        self.lock = threading.Lock()  # 用于同步对共享资源的访问
-        self.bullet_id_counter = 0  # 用于分配唯一的子弹ID
+        self.send_queue_limit = DEFAULT_MAX_PENDING  # 每个客户端发送队列的最大积压消息数
+        # 新房间使用的参数
+        self.view_radius = view_radius
+        self.tick_rate = tick_rate
+        self.send_rate = send_rate
+        # 不为None时每个房间把输入日志写入这个目录，可以用replay.py离线重新模拟
+        self.input_log = input_log
+        if input_log is not None:
+            os.makedirs(input_log, exist_ok=True)
+        # udp为True时向请求UDP通道的客户端提供UDP端口，玩家位置和快照改为数据报发送；
+        # 单进程时与TCP使用相同的端口号，多进程时每个工作进程使用系统分配的端口
+        self.datagrams = DatagramEndpoint() if udp else None
+        # 所有房间由同一个游戏循环轮流推进，每个房间有自己的游戏状态、tick和客户端集合
+        self.rooms = {}  # {房间名: GameRoom}
+        # 只保护房间的创建和关闭：IO线程在握手时查找或创建房间，游戏循环关闭空房间
+        self.rooms_lock = threading.Lock()
+        self.room_ids = itertools.count(1)  # 用于生成新房间的名称
+        self._next_room = 0  # 下一轮调度从哪个房间开始
+        self.busy_time = 0.0  # 推进房间累计花费的秒数，用于计算利用率
+        self.room_busy = {}  # {房间名: 累计花费的秒数}
+        self.closed_rooms = []  # [(房间名, 最近一次交接的序号)]，工作进程在下一次负载回报中通知前端
+        # 运行指标，stats_port不为None时在本机的该端口提供快照；工作进程的指标随负载回报交给前端
+        self.metrics = MetricsRegistry()
+        self.stats_server = StatsServer(self.metrics, stats_port) if stats_port is not None else None
+        # 由统计端口的profile命令按需启动，多进程模式下前端把命令转发给所有工作进程
+        # 结果只写入profile_dir目录
+        self.profiler = SamplingProfiler()
+        self.profile_dir = profile_dir
+        if self.stats_server is not None:
+            self.stats_server.command("profile", self._profile_command)
+        # 多进程模式: workers > 0 时本进程只作为前端接受连接，房间由工作进程运行
+        self.pool = None
+        if workers:
+            self.pool = WorkerPool(workers, {"io_mode": io_mode, "view_radius": view_radius,
+                                             "tick_rate": tick_rate, "send_rate": send_rate,
+                                             "input_log": input_log, "host": host, "udp": udp,
+                                             "profile_dir": profile_dir})
+        else:
+            self._open_room(self.DEFAULT_ROOM)
+        self.channel = None  # 工作进程与前端之间的通道
+        self._register_gauges()
 
     def start(self):
         # 启动服务器
+        if self.stats_server is not None:
+            self.stats_server.start()
+        if self.pool is not None:
+            self._start_front()
+        elif self.io_mode == 'threaded':
+            self._start_threaded()
+        else:
+            asyncio.run(self._serve_asyncio())
+
+    def _start_threaded(self):
+        # 旧的线程模式：每个客户端连接一个线程
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(self.backlog)
+        if self.datagrams is not None:
+            self.datagrams.start_threaded(self.host, self.port)
         self.running = True
-        print(f"服务器已启动，监听 {self.host}:{self.port}")
+        print(f"服务器已启动(threaded)，监听 {self.host}:{self.port}")
 
         # 启动游戏逻辑循环
         game_thread = threading.Thread(target=self.game_loop)
@@ -49,799 +129,539 @@ class GameServer:
         finally:
             self.stop()
 
+    async def _serve_asyncio(self):
+        # asyncio模式：接受连接、所有客户端IO和游戏tick共用一个事件循环
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(self.backlog)
+        self.server_socket.setblocking(False)
+        if self.datagrams is not None:
+            await self.datagrams.start_asyncio(self.host, self.port)
+        self.running = True
+        print(f"服务器已启动(asyncio)，监听 {self.host}:{self.port}")
+
+        server = await asyncio.start_server(self.handle_client_async, sock=self.server_socket)
+        game_task = asyncio.ensure_future(self.game_loop_async())
+        try:
+            async with server:
+                while self.running:
+                    await asyncio.sleep(0.1)
+        except Exception as e:
+            print(f"服务器错误: {e}")
+        finally:
+            game_task.cancel()
+            self.stop()
+
     def stop(self):
         # 停止服务器
         self.running = False
         # 关闭所有客户端连接
-        for client_id, (client_socket, _, _) in self.clients.items():
-            try:
-                client_socket.close()
-            except:
-                pass
+        with self.rooms_lock:
+            rooms = list(self.rooms.values())
+        for room in rooms:
+            room.close()
         # 关闭服务器socket
         try:
             self.server_socket.close()
         except:
             pass
+        if self.pool is not None:
+            self.pool.stop()
+        if self.stats_server is not None:
+            self.stats_server.stop()
+        if self.datagrams is not None:
+            self.datagrams.close()
+        for room in rooms:
+            if room.scheduler.ticks:
+                print(f"房间 {room.name} 共执行 {room.scheduler.ticks} 个tick，延迟 {room.stats['late_ticks']} 个，跳过 {room.stats['skipped_ticks']} 个")
         print("服务器已关闭")
 
-
-    def _extract_json_object(self, buffer):
-        """从缓冲区提取一个完整的JSON对象"""
-        # 查找JSON对象的开始
-        start_pos = buffer.find('{')
-        if start_pos == -1:
-            return None, 0
-
-        # 跟踪大括号的嵌套层次
-        brace_count = 0
-        in_string = False
-        escape_char = False
-
-        for i in range(start_pos, len(buffer)):
-            char = buffer[i]
-
-            # 处理字符串中的字符
-            if in_string:
-                if char == '\\' and not escape_char:
-                    escape_char = True
+    def _open_room(self, name):
+        """创建房间(调用者需持有rooms_lock，或在服务器启动前调用)"""
+        room = GameRoom(name, view_radius=self.view_radius, tick_rate=self.tick_rate, send_rate=self.send_rate,
+                        metrics=self.metrics,
+                        input_log=log_path(self.input_log, name) if self.input_log is not None else None)
+        self.rooms[name] = room
+        if name != self.DEFAULT_ROOM:
+            print(f"房间 {name} 已创建")
+        return room
+
+    def _register_gauges(self):
+        # 读取指标快照时才计算的瞬时值
+        metrics = self.metrics
+        if self.pool is not None:
+            # 前端没有房间，汇总各工作进程最近一次回报的指标
+            metrics.gauge("workers", lambda: {str(index): snapshot for index, snapshot in enumerate(self.pool.metrics)})
+            return
+        metrics.gauge("connected_clients", lambda: sum(len(room.clients) for room in self._room_list()))
+        metrics.gauge("live_bullets", lambda: sum(len(room.game_state["bullets"]) for room in self._room_list()))
+        metrics.gauge("queue_depth", lambda: queue_depths({client_id: client[0] for room in self._room_list()
+                                                           for client_id, client in list(room.clients.items())}))
+        metrics.gauge("rooms", self._room_metrics)
+
+    def _profile_command(self, args):
+        """
+        统计端口的profile命令: profile [秒数] [文件名]，返回各进程结果文件的路径
+        结果写入profile_dir目录，文件名不能包含路径
+        """
+        duration = float(args[0]) if args else 10.0
+        name = args[1] if len(args) > 1 else f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+        path = profile_path(self.profile_dir, name)
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+        except OSError as e:
+            return {"error": f"无法创建采样分析结果目录: {e}"}
+        if not self.profiler.start(duration, path):
+            return {"error": "已有采样分析正在进行"}
+        paths = [path]
+        if self.pool is not None:
+            root, ext = os.path.splitext(name)
+            for index, channel in enumerate(self.pool.channels):
+                if not self.pool.alive[index]:
                     continue
-                if char == '"' and not escape_char:
-                    in_string = False
-                escape_char = False
-                continue
-
-            # 处理字符串外的字符
-            if char == '"':
-                in_string = True
-            elif char == '{':
-                brace_count += 1
-            elif char == '}':
-                brace_count -= 1
-
-            # 找到完整的JSON对象
-            if brace_count == 0 and i > start_pos:
+                # 工作进程使用相同的profile_dir，只转发文件名
+                worker_name = f"{root}-worker{index}{ext}"
                 try:
-                    obj = json.loads(buffer[start_pos:i+1])
-                    return obj, i+1
-                except:
-                    pass
+                    send_channel_message(channel, {"type": "profile", "duration": duration, "name": worker_name})
+                    paths.append(profile_path(self.profile_dir, worker_name))
+                except OSError as e:
+                    print(f"向工作进程 {index} 转发profile命令时出错: {e}")
+        return {"profile": paths, "duration": duration}
+
+    def _room_list(self):
+        with self.rooms_lock:
+            return list(self.rooms.values())
+
+    def _room_metrics(self):
+        rooms = sorted(self._room_list(), key=lambda room: -len(room.clients))
+        return {room.name: {"clients": len(room.clients),
+                            "bullets": len(room.game_state["bullets"]),
+                            "tick": room.tick,
+                            "pending_commands": len(room.commands),
+                            **room.stats}
+                for room in rooms[:self.MAX_ROOM_METRICS]}
+
+    def _room_name(self, message, existing):
+        """
+        按connect消息选择房间名
+        "room"指定房间名时加入该房间(不存在时创建)；"new_room"为真时创建一个不在existing中的新房间；
+        都没有时进入默认房间
+        """
+        name = message.get('room')
+        if name is not None and (not isinstance(name, str) or not name or len(name) > self.MAX_ROOM_NAME):
+            raise FrameError("无效的房间名")
+        if message.get('new_room'):
+            name = f"room_{next(self.room_ids)}"
+            while name in existing:
+                name = f"room_{next(self.room_ids)}"
+        elif name is None:
+            name = self.DEFAULT_ROOM
+        return name
+
+    def _join_room(self, client_id, connection, client_address, message, name=None, handoff_id=None):
+        """放入connect命令并返回房间，name为None时按connect消息选择房间"""
+        with self.rooms_lock:
+            if name is None:
+                name = self._room_name(message, self.rooms)
+            room = self.rooms.get(name)
+            if room is None:
+                room = self._open_room(name)
+            if handoff_id is not None:
+                room.last_handoff = handoff_id
+            # 在锁内放入命令，游戏循环不会关闭一个还有待处理命令的房间
+            room.commands.append(("connect", client_id, (connection, client_address, message)))
+        return room
+
+    def _close_empty_rooms(self):
+        # 关闭没有玩家的房间，默认房间一直保留
+        with self.rooms_lock:
+            for name, room in list(self.rooms.items()):
+                if name != self.DEFAULT_ROOM and room.empty:
+                    del self.rooms[name]
+                    room.close()
+                    self.room_busy.pop(name, None)
+                    self.closed_rooms.append((name, room.last_handoff))
+                    print(f"房间 {name} 已关闭")
+
+    def _process_frames(self, client_id, room, connection, client_address, frames, handoff=None):
+        """
+        处理缓冲区中所有完整的帧，第一帧必须是connect握手消息，返回(客户端ID, 房间)
+        handoff为前端交接的通道消息头部，其中已经确定了客户端ID和房间
+        """
+        for payload in frames.frames():
+            try:
+                message = decode_message(payload)
+            except ValueError as e:
+                # 帧边界由长度确定，单条消息损坏时只需丢弃这一帧
+                print(f"解析客户端 {client_id} 的消息时出错: {e}")
+                self.metrics.inc("bad_frames")
+                continue
+            self.metrics.count_received(message.get('type'), FRAME_HEADER_SIZE + len(payload))
+
+            if client_id is None:
+                if message.get('type') != 'connect':
+                    raise FrameError("第一条消息必须是connect握手")
+                if self.datagrams is not None and message.get('udp'):
+                    self.datagrams.offer(connection)
+                if handoff is not None:
+                    client_id = handoff["client_id"]
+                    room = self._join_room(client_id, connection, client_address, message,
+                                           handoff["room"], handoff["id"])
+                else:
+                    client_id = next(self.client_ids)
+                    room = self._join_room(client_id, connection, client_address, message)
+                continue
 
-        return None, 0
+            if message.get('type') == 'udp_fallback':
+                # 客户端收不到UDP确认，之后只使用TCP；连接层面的消息不交给房间
+                if self.datagrams is not None:
+                    self.datagrams.withdraw(connection)
+                continue
 
+            # 消息在房间的下一个tick由游戏循环处理
+            room.commands.append(("message", client_id, message))
+        return client_id, room
 
-    def handle_client(self, client_socket, client_address):
-        # 处理客户端连接和消息
+    def handle_client(self, client_socket, client_address, handoff=None, data=b''):
+        # 处理客户端连接和消息(threaded模式)
+        # 多进程模式下handoff和data是前端交接的头部和已读取的字节
         client_id = None
+        room = None
+        # 使用缓冲区来处理可能跨多个数据包的消息
+        frames = FrameBuffer()
+        # 发送由连接自己的写线程完成
+        connection = ThreadedClientConnection(client_socket, self.send_queue_limit)
 
         try:
-            # 接收客户端的初始化消息
-            data = client_socket.recv(1024).decode('utf-8')
-            if not data:
-                return
-
-            message = json.loads(data)
-            if message.get('type') == 'connect':
-                username = message.get('username', f"Player_{self.client_id_counter}")
-
-                # 分配客户端ID并添加到客户端列表
-                with self.lock:
-                    client_id = self.client_id_counter
-                    self.client_id_counter += 1
-                    self.clients[client_id] = (client_socket, client_address, username)
-
-                    # 初始化玩家游戏状态
-                    # 为新玩家随机分配一个值
-                    random_value = random.randint(1, 255)
-                    self.game_state["players"][client_id] = {
-                        "position": [0, 0],  # 起始位置
-                        "score": 0,
-                        "username": username,
-                        "value": random_value,
-                        "target_value": random_value,
-                        "base": 16,  # 默认十六进制
-                        "memory_usage": 0,  # 内存使用量
-                        "max_memory": 100,  # 最大内存容量
-                        "memory_release_active": False,  # 内存释放状态
-                        "memory_release_time": 0  # 内存释放状态变化时间
-                    }
-
-                # 发送欢迎消息和当前游戏状态
-                welcome_msg = {
-                    "type": "welcome",
-                    "client_id": client_id,
-                    "message": f"欢迎 {username} 加入游戏!",
-                    "game_state": self.game_state
-                }
-                self.send_to_client(client_id, welcome_msg)
-
-                # 广播新玩家加入的消息
-                broadcast_msg = {
-                    "type": "player_joined",
-                    "client_id": client_id,
-                    "username": username,
-                    "message": f"玩家 {username} 已加入游戏!"
-                }
-                self.broadcast(broadcast_msg, exclude=client_id)
-
-                print(f"客户端 {client_id} ({username}) 已连接: {client_address}")
-
-                # 处理客户端消息
-                # 使用缓冲区来处理可能跨多个数据包的消息
-                buffer = ""
-
-                while self.running:
-                    try:
-                        # 接收数据
-                        data = client_socket.recv(4096).decode('utf-8')
-                        if not data:
-                            break
-
-                        # 将接收的数据添加到缓冲区
-                        buffer += data
-
-                        # 尝试解析多个完整的JSON消息
-                        while buffer:
-                            # 尝试找到一个完整的JSON对象
-                            obj, index = self._extract_json_object(buffer)
-                            if not obj:
-                                # 如果没有找到完整的JSON对象，等待更多数据
-                                break
-
-                            # 处理消息
-                            self.process_message(client_id, obj)
-
-                            # 从缓冲区中删除已处理的消息
-                            buffer = buffer[index:]
-
-                            # 如果缓冲区只剩下空白字符，清空它
-                            if buffer.strip() == "":
-                                buffer = ""
-                                break
-
-                    except Exception as e:
-                        # 出错时记录日志，但不终止循环
-                        print(f"接收或处理消息时出错: {e}")
-                        # 清除缓冲区，防止持续错误
-                        buffer = ""
+            if data:
+                frames.feed(data)
+                client_id, room = self._process_frames(client_id, room, connection, client_address, frames, handoff)
+            while self.running:
+                # 直接接收到帧缓冲区，包括最初的connect握手
+                if not frames.recv_into(client_socket):
+                    break
+                client_id, room = self._process_frames(client_id, room, connection, client_address, frames)
 
         except Exception as e:
             print(f"处理客户端 {client_id} 时出错: {e}")
         finally:
-            # 客户端断开连接，从游戏中移除
             if client_id is not None:
-                with self.lock:
-                    if client_id in self.clients:
-                        del self.clients[client_id]
-                    if client_id in self.game_state["players"]:
-                        username = self.game_state["players"][client_id]["username"]
-                        del self.game_state["players"][client_id]
-
-                        # 广播玩家离开的消息
-                        leave_msg = {
-                            "type": "player_left",
-                            "client_id": client_id,
-                            "username": username,
-                            "message": f"玩家 {username} 已离开游戏!"
-                        }
-                        self.broadcast(leave_msg)
-                        print(f"客户端 {client_id} ({username}) 已断开连接")
+                room.commands.append(("disconnect", client_id, None))
+            if connection.datagram_token is not None:
+                self.datagrams.withdraw(connection)
 
             try:
-                client_socket.close()
+                connection.close()
             except:
                 pass
 
-    def process_message(self, client_id, message):
-        # 处理从客户端接收到的消息
-        message_type = message.get('type')
-
-        if message_type == 'base_change':
-            # 处理进制变换请求
-            new_base = message.get('base', 16)
-            with self.lock:
-                if client_id in self.game_state["players"]:
-                    self.game_state["players"][client_id]["base"] = new_base
-                    # 发送更新消息给所有客户端
-                    self._send_base_change_notification(client_id, new_base)
-
-        elif message_type == 'move':
-            # 处理玩家移动
-            new_position = message.get('position', [0, 0])
-            with self.lock:
-                if client_id in self.game_state["players"]:
-                    self.game_state["players"][client_id]["position"] = new_position
-
-            # 广播玩家位置更新 - 这是一个高优先级消息，立即发送给所有客户端
-            update_msg = {
-                "type": "player_moved",
-                "client_id": client_id,
-                "position": new_position
-            }
-            self.broadcast(update_msg)
-            
-            # 同时触发一次游戏状态更新，确保所有客户端都能接收到最新状态
-            self._send_game_state_update()
-
-        elif message_type == 'player_update':
-            # 处理玩家值更新
-            new_value = message.get('value', 0)
-            memory_usage = message.get('memory_usage', 0)
-            memory_release_active = message.get('memory_release_active', None)
-            with self.lock:
-                if client_id in self.game_state["players"]:
-                    self.game_state["players"][client_id]["value"] = new_value
-                    # 更新内存使用量
-                    self.game_state["players"][client_id]["memory_usage"] = memory_usage
-                    # 更新内存释放状态(如果提供了)
-                    if memory_release_active is not None:
-                        self.game_state["players"][client_id]["memory_release_active"] = memory_release_active
-                    print(f"更新玩家 {client_id} 的值为 {new_value}，内存使用量为 {memory_usage}")
-            
-            # 广播玩家值更新
-            update_msg = {
-                "type": "player_value_updated",
-                "client_id": client_id,
-                "value": new_value,
-                "memory_usage": memory_usage,
-                "memory_release_active": self.game_state["players"][client_id]["memory_release_active"] if client_id in self.game_state["players"] else False
-            }
-            self.broadcast(update_msg)
-            
-            # 同时触发一次游戏状态更新
-            self._send_game_state_update()
-            
-        elif message_type == 'chat':
-            # 处理聊天消息
-            chat_content = message.get('content', '')
-            username = self.game_state["players"][client_id]["username"]
-
-            chat_msg = {
-                "type": "chat",
-                "client_id": client_id,
-                "username": username,
-                "content": chat_content,
-                "timestamp": time.time()
-            }
-            self.broadcast(chat_msg)
-
-        elif message_type == 'action':
-            # 处理玩家动作
-            action = message.get('action', '')
-
-            if action == 'skill' or action == 'hex_skill' or action == 'decimal_skill':
-                # 处理技能使用
-                skill_name = message.get('skill_name', '')
-                skill_index = message.get('skill_index', -1)  # 对于十六进制技能
-                
-                # 检查是否是内存释放技能
-                if action == 'decimal_skill' and skill_index == 3:
-                    # 激活内存释放状态
-                    if client_id in self.game_state["players"]:
-                        self.game_state["players"][client_id]["memory_release_active"] = True
-                        self.game_state["players"][client_id]["memory_release_time"] = time.time()
-                
-                # 获取玩家位置
-                player_position = self.game_state["players"][client_id]["position"] if client_id in self.game_state["players"] else [0, 0]
-                
-                # 对于需要检查射程的技能，验证目标是否在范围内
-                can_use_skill = True
-                if skill_name in ["AND", "OR", "XOR", "开火", "爆炸"]:
-                    # 检查是否有目标在射程内
-                    targets_in_range = False
-                    for other_id, other_player in self.game_state["players"].items():
-                        if other_id != client_id:
-                            other_pos = other_player["position"]
-                            if self._check_skill_range(player_position, other_pos, skill_name):
-                                targets_in_range = True
-                                break
-                    
-                    if not targets_in_range:
-                        # 没有目标在射程内
-                        result = f"没有目标在{skill_name}技能射程内"
-                        can_use_skill = False
-                
-                if can_use_skill:
-                    result = self._process_skill(client_id, skill_name)
-                
-                # 获取运算符效果信息
-                operator_effect = {
-                    "symbol": self._get_operator_symbol(skill_name),
-                    "targets": []
-                }
-                
-                # 对于需要附近玩家的技能，添加目标玩家位置
-                if skill_name in ["AND", "OR", "XOR"]:
-                    # 获取附近玩家位置
-                    nearby_players = []
-                    for other_id, other_player in self.game_state["players"].items():
-                        if other_id != client_id:
-                            other_pos = other_player["position"]
-                            distance = math.sqrt(max(0, (player_position[0] - other_pos[0]) ** 2 + (player_position[1] - other_pos[1]) ** 2))
-                            if distance < 100:  # 与处理技能相同的距离阈值
-                                nearby_players.append(other_pos)
-                    operator_effect["targets"] = nearby_players
-                
-                # 获取内存使用量
-                memory_usage = message.get('memory_usage', 0)
-                if client_id in self.game_state["players"]:
-                    # 更新玩家内存使用量
-                    self.game_state["players"][client_id]["memory_usage"] = memory_usage
-                
-                # 广播动作结果
-                action_result = {
-                    "type": "action_result",
-                    "client_id": client_id,
-                    "action": action,
-                    "skill_name": skill_name,
-                    "player_position": player_position,
-                    "operator_effect": operator_effect,
-                    "result": result,
-                    "memory_usage": memory_usage
-                }
-                
-                # 如果是十六进制技能或十进制技能，添加技能索引
-                if skill_index >= 0:
-                    action_result["skill_index"] = skill_index
-                    
-                self.broadcast(action_result)
-            else:
-                # 处理其他类型的动作
-                # 广播动作结果
-                action_result = {
-                    "type": "action_result",
-                    "client_id": client_id,
-                    "action": action,
-                    "result": "unknown_action"
-                }
-                self.broadcast(action_result)
-
-    def send_to_client(self, client_id, message):
-        # 向特定客户端发送消息
-        if client_id in self.clients:
-            client_socket = self.clients[client_id][0]
-            try:
-                client_socket.send(json.dumps(message).encode('utf-8'))
-            except Exception as e:
-                print(f"向客户端 {client_id} 发送消息时出错: {e}")
+    async def handle_client_async(self, reader, writer, handoff=None, data=b''):
+        # 处理客户端连接和消息(asyncio模式)，与handle_client逻辑相同
+        client_id = None
+        room = None
+        client_address = writer.get_extra_info('peername')
+        connection = AsyncioClientConnection(writer, self.send_queue_limit)
+        frames = FrameBuffer()
 
-    def broadcast(self, message, exclude=None):
-        # 向所有客户端广播消息，可选择排除特定客户端
-        for client_id, (client_socket, _, _) in list(self.clients.items()):
-            if exclude is not None and client_id == exclude:
-                continue
+        try:
+            if data:
+                frames.feed(data)
+                client_id, room = self._process_frames(client_id, room, connection, client_address, frames, handoff)
+            while self.running:
+                data = await reader.read(DEFAULT_BUFFER_SIZE)
+                if not data:
+                    break
+                frames.feed(data)
+                client_id, room = self._process_frames(client_id, room, connection, client_address, frames)
+
+        except (ConnectionError, asyncio.CancelledError):
+            # 连接断开或服务器关闭
+            pass
+        except Exception as e:
+            print(f"处理客户端 {client_id} 时出错: {e}")
+        finally:
+            if client_id is not None:
+                room.commands.append(("disconnect", client_id, None))
+            if connection.datagram_token is not None:
+                self.datagrams.withdraw(connection)
 
             try:
-                client_socket.send(json.dumps(message).encode('utf-8'))
+                connection.close()
+            except:
+                pass
+
+    def _run_rooms(self):
+        """
+        轮流推进所有房间，返回距离最早的下一个tick的秒数
+        每个房间的时间预算为一个tick步长按房间数平分，超出预算的房间把剩余的tick推迟到下一轮；
+        每轮从不同的房间开始，落后的房间不会一直挤占排在它后面的房间
+        """
+        with self.rooms_lock:
+            rooms = list(self.rooms.values())
+        tick_interval = 1.0 / self.tick_rate
+        budget = max(self.MIN_ROOM_BUDGET, tick_interval / len(rooms))
+        start = self._next_room % len(rooms)
+        self._next_room += 1
+        sleep = tick_interval
+        for room in rooms[start:] + rooms[:start]:
+            started = time.perf_counter()
+            try:
+                sleep = min(sleep, room.run_due_ticks(budget))
             except Exception as e:
-                print(f"向客户端 {client_id} 广播消息时出错: {e}")
-
-    def _send_base_change_notification(self, client_id, new_base):
-        # 向所有客户端发送进制变更通知
-        player_position = self.game_state["players"][client_id]["position"] if client_id in self.game_state["players"] else [0, 0]
-        base_change_msg = {
-            "type": "base_changed",
-            "client_id": client_id,
-            "base": new_base,
-            "timestamp": time.time(),
-            "priority": "high",  # 添加高优先级标记
-            "player_position": player_position  # 添加玩家位置信息
-        }
-        # 广播进制变更消息
-        self.broadcast(base_change_msg)
-        print(f"广播进制变更消息: 玩家 {client_id} 切换到 {new_base} 进制，位置: {player_position}")
-
-        # 延迟一小段时间后发送一次完整游戏状态更新，确保所有客户端同步
-        time.sleep(0.05)  # 50毫秒延迟
-        self._send_game_state_update()
-
-    def _update_animations(self):
-        # 更新所有动画效果
-        current_time = time.time()
-        # 更新转换动画
-        active_conversions = []
-        for conv in self.game_state["base_conversions"]:
-            elapsed = current_time - conv["start_time"]
-            if elapsed < conv["duration"]:
-                # 动画还在进行中
-                progress = elapsed / conv["duration"]  # 0到1之间的进度值
-                
-                # 平滑更新玩家的值
-                client_id = conv["client_id"]
-                if client_id in self.game_state["players"]:
-                    # 使用线性插值计算当前值
-                    start = conv["start_value"]
-                    end = conv["end_value"]
-                    current = start + (end - start) * progress
-                    self.game_state["players"][client_id]["value"] = int(current)
-                    
-                # 保留此动画继续处理
-                active_conversions.append(conv)
-            else:
-                # 动画结束，确保最终值正确设置
-                client_id = conv["client_id"]
-                if client_id in self.game_state["players"]:
-                    self.game_state["players"][client_id]["value"] = conv["end_value"]
-        
-        # 更新动画列表，只保留活跃的动画
-        self.game_state["base_conversions"] = active_conversions
-        
-        # 定期向所有客户端发送游戏状态更新
-        # 增加发送频率，确保游戏状态更及时地同步
-        if len(self.clients) > 0 and (len(active_conversions) > 0 or random.random() < 0.6):
-            self._send_game_state_update()
-
-    def _send_game_state_update(self):
-        # 发送游戏状态更新到所有客户端
-        # 确保每个客户端都收到最新的游戏状态，包括所有玩家的位置和内存释放状态
-        
-        # 创建包含内存释放状态的游戏状态
-        game_state_with_memory_release = self.game_state.copy()
-        
-        # 确保每个玩家的内存释放状态都包含在游戏状态中
-        for player_id, player_data in self.game_state["players"].items():
-            memory_release_active = player_data.get("memory_release_active", False)
-            if "players" not in game_state_with_memory_release:
-                game_state_with_memory_release["players"] = {}
-            if player_id not in game_state_with_memory_release["players"]:
-                game_state_with_memory_release["players"][player_id] = {}
-            game_state_with_memory_release["players"][player_id]["memory_release_active"] = memory_release_active
-        
-        update_msg = {
-            "type": "game_update",
-            "game_state": game_state_with_memory_release,
-            "timestamp": time.time()  # 添加时间戳以帮助客户端判断最新状态
-        }
-        self.broadcast(update_msg)
+                # 一个房间出错不影响其他房间
+                print(f"房间 {room.name} 执行tick时出错: {e}")
+            elapsed = time.perf_counter() - started
+            self.busy_time += elapsed
+            self.room_busy[room.name] = self.room_busy.get(room.name, 0.0) + elapsed
+        self._close_empty_rooms()
+        if self.channel is not None:
+            self._report_load()
+        return sleep
 
     def game_loop(self):
-        # 游戏主循环，处理游戏逻辑、碰撞检测、NPC行为等
-        fps = 30
-        frame_time = 1.0 / fps
-
+        # 游戏主循环，在一个线程中推进所有房间
+        while self.running:
+            time.sleep(self._run_rooms())
 
+    async def game_loop_async(self):
+        # asyncio模式下的游戏主循环，与game_loop使用相同的调度
         while self.running:
-            start_time = time.time()
-
-            # 在这里更新游戏状态、处理游戏逻辑等
-            with self.lock:
-                # 更新动画效果
-                self._update_animations()
-                # 更新子弹
-                self._update_bullets(frame_time)
-                
-                # 监控内存释放状态
-                current_time = time.time()
-                for player_id, player_data in self.game_state["players"].items():
-                    if player_data.get("memory_release_active", False):
-                        release_time = player_data.get("memory_release_time", 0)
-                        # 如果内存释放状态持续超过10秒，重置状态
-                        if current_time - release_time > 10:
-                            player_data["memory_release_active"] = False
-                            player_data["memory_release_time"] = current_time
-                    
-                    # 如果玩家内存使用量为0，也重置内存释放状态
-                    if player_data.get("memory_usage", 0) == 0 and player_data.get("memory_release_active", False):
-                        player_data["memory_release_active"] = False
-                        player_data["memory_release_time"] = current_time
-
-            # 计算等待时间以维持稳定的帧率
-            elapsed = time.time() - start_time
-            sleep_time = max(0, frame_time - elapsed)
-            time.sleep(sleep_time)
-    def _check_skill_range(self, player_pos, target_pos, skill_name):
-        """检查玩家与目标的距离是否在射程内"""
-        distance = math.sqrt(max(0, (player_pos[0] - target_pos[0]) ** 2 + (player_pos[1] - target_pos[1]) ** 2))
-        
-        # 定义不同技能的射程限制
-        if skill_name in ["开火", "爆炸"]:
-            return distance <= 600
-        elif skill_name in ["AND", "OR", "XOR"]:
-            return distance <= 200
-        else:
-            # 其他技能无射程限制
-            return True
-            
-    def _process_skill(self, client_id, skill_name):
-        """处理玩家使用的技能，并应用相应的逻辑运算"""
-        if client_id not in self.game_state["players"]:
-            return "player_not_found"
-
-        player = self.game_state["players"][client_id]
-        current_value = player["value"]
-        username = player["username"]
-
-        # 获取玩家位置
-        player_pos = player["position"]
-        nearby_players = []
-
-        for other_id, other_player in self.game_state["players"].items():
-            if other_id != client_id:
-                other_pos = other_player["position"]
-                # 检查射程
-                if self._check_skill_range(player_pos, other_pos, skill_name):
-                    nearby_players.append(other_player)
-
-        # 按位非运算不需要附近玩家
-        if skill_name == "NOT":
-            # 按位非运算
-            # 对自己的值进行按位非运算
-            result_value = ~current_value & 0xFF  # 限制为8位
-            old_value = player["value"]
-            player["value"] = result_value
-            player["target_value"] = result_value
-            # 广播值变化
-            return "成功执行NOT运算"
-            
-        # 需要附近玩家的运算(AND, OR, XOR)
-        operations = {
-            "AND": lambda x, y: x & y,
-            "OR": lambda x, y: x | y,
-            "XOR": lambda x, y: x ^ y
-        }
-        distances = []
-        for other_player in nearby_players:
-            distance = math.sqrt(max(0, (player_pos[0] - other_player["position"][0]) ** 2 + (player_pos[1] - other_player["position"][1]) ** 2))
-            distances.append(distance)
-        # 创建元组列表(距离, 玩家ID, 玩家对象)
-        player_tuples = []
-        for i, other_player in enumerate(nearby_players):
-            # 为每个附近玩家找到对应的ID
-            for other_id, game_player in self.game_state["players"].items():
-                if other_player is game_player:  # 通过对象引用比较
-                    player_tuples.append((distances[i], other_id, other_player))
-                    break
-        
-        # 按距离排序
-        player_tuples.sort()  # 按第一个元素(距离)排序
-        
-        # 执行对应的位运算
-        if skill_name in operations:
-            if player_tuples:  # 使用新的玩家元组列表
-                # 将最近的玩家作为目标
-                _, target_id, target_player = player_tuples[0]  # 获取目标玩家ID和对象
-                target_value = target_player["value"]
-                current_value = operations[skill_name](current_value, target_value)
-                # 设置新值
-                old_value = player["value"]
-                target_player["value"] = current_value
-                target_player["memory_usage"] = target_player["memory_usage"] + current_value % 8
-                # 广播值变化
-                # self._broadcast_value_change(client_id, old_value, current_value)
-                update_msg = {
-                    "type": "player_value_updated",
-                    "client_id": target_id,  # 使用从元组中获取的ID
-                    "value": target_player["value"],
-                    "memory_usage": target_player["memory_usage"],
-                    "memory_release_active": self.game_state["players"][target_id]["memory_release_active"] if target_id in self.game_state["players"] else False
-                }
-                self.broadcast(update_msg)
-                return f"成功对{len(nearby_players)}个玩家执行{skill_name}运算"
-            else:
-                return f"射程内没有玩家，无法执行{skill_name}运算"
-
-        # 处理开火技能 - 发射子弹
-        if skill_name == "开火":
-            # 找到射程内最近的玩家作为目标
-            if nearby_players:
-                # 计算所有玩家的距离
-                distances = []
-                for other_player in nearby_players:
-                    other_pos = other_player["position"]
-                    distance = math.sqrt(max(0, (player_pos[0] - other_pos[0]) ** 2 + (player_pos[1] - other_pos[1]) ** 2))
-                    distances.append(distance)
-
-                # 按距离排序找到最近的玩家
-                target_player = [x for _, x in sorted(zip(distances, nearby_players))][0]
-                target_pos = target_player["position"]
-
-                # 计算子弹发射方向（从玩家指向目标）
-                dx = target_pos[0] - player_pos[0]
-                dy = target_pos[1] - player_pos[1]
-                # 标准化方向向量
-                magnitude = math.sqrt(max(0, dx**2 + dy**2))
-                if magnitude > 0:
-                    dx /= magnitude
-                    dy /= magnitude
-                else:
-                    # 如果玩家和目标位置重合，设置一个默认方向（向右）
-                    dx, dy = 1, 0
-
-                # 根据玩家值计算子弹数量（最多28个，最少1个，确保能构成倒等腰三角形）
-                # 计算子弹伤害值（1-32，随玩家值增加而增加）
-                # 计算子弹速度（随玩家值增加而增加）
-
-                player_value = max(1, min(255, player["value"]))
-
-                # 计算子弹数量，确保能形成倒等腰三角形
-                # 倒等腰三角形的行数需要是1, 3, 6, 10, 15, 21, 28...
-                triangle_rows = [1, 3, 6, 10, 15, 21, 28]
-                # 根据玩家值选择行数，值越大行数越少
-                num_bullets = 0
-                row_index = min(len(triangle_rows) - 1, max(int((len(triangle_rows)-1) * (1 - player_value / 255)), 1))
-                for i in range(row_index):
-                    num_bullets += triangle_rows[i]
-
-                # 计算子弹伤害（1-32）
-                bullet_damage = max(1, min(48, int(48 * (player_value / 255) / num_bullets)))
-
-                # 计算子弹速度（基础速度 + 根据玩家值增加）
-                bullet_speed_base = 200
-                bullet_speed_factor = player_value / 255 * 300  # 最多增加7的速度
-                bullet_speed = bullet_speed_base + bullet_speed_factor
-                row_speed_subtract = 1
-
-                # 创建子弹阵列（倒等腰三角形）
-                bullets_created = []
-                current_row = 1
-                total_bullets = 0
-                spread_angle_init = 3.14 / 6  # 子弹扩散角度
-
-                # 创建倒等腰三角形的子弹阵列
-                while total_bullets < num_bullets:
-                    num_row_bullets = triangle_rows[current_row - 1]
-                    for i in range(num_row_bullets):
-                        if total_bullets >= num_bullets:
-                            break
-
-                        # 计算扩散角度，使子弹形成三角形
-                        spread_angle = spread_angle_init / num_row_bullets
-                        angle_offset = (i - (num_row_bullets - 1) / 2) * spread_angle
-
-                        # 计算旋转后的方向
-                        try:
-                            rotated_dx = dx * math.cos(angle_offset) - dy * math.sin(angle_offset)
-                            rotated_dy = dx * math.sin(angle_offset) + dy * math.cos(angle_offset)
-                            # 确保没有复数产生
-                            if isinstance(rotated_dx, complex) or isinstance(rotated_dy, complex):
-                                rotated_dx = 1.0 if rotated_dx == 0 else float(rotated_dx.real)
-                                rotated_dy = 0.0 if rotated_dy == 0 else float(rotated_dy.real)
-                        except Exception:
-                            # 出现任何错误时使用默认方向
-                            rotated_dx, rotated_dy = 1.0, 0.0
-
-                        row_speed_subtract = bullet_speed / 1000 * current_row  # 每行速度递减10%
-                        # 创建子弹对象
-                        bullet = {
-                            "id": self.bullet_id_counter,
-                            "owner": client_id,
-                            "position": player_pos.copy(),  # 从玩家位置发射
-                            "velocity": [(rotated_dx * bullet_speed) * (row_speed_subtract), (rotated_dy * bullet_speed) * (row_speed_subtract)],
-                            "damage": bullet_damage,
-                            "created_time": time.time(),
-                            "char": "*",  # 子弹字符
-                            "color": (212, 212, 212)  # 子弹颜色
-                        }
-
-                        self.bullet_id_counter += 1
-                        self.game_state["bullets"].append(bullet)
-                        bullets_created.append(bullet)
-                        total_bullets += 1
-
-                    current_row += 1
-
-                # 广播子弹创建消息
-                bullet_msg = {
-                    "type": "bullets_created",
-                    "bullets": bullets_created,
-                    "owner_id": client_id
-                }
-                self.broadcast(bullet_msg)
-
-                # 开火技能使用者增加10点内存
-                player["memory_usage"] += 10
-
-                # 更新玩家状态
-                update_msg = {
-                    "type": "player_value_updated",
-                    "client_id": client_id,
-                    "value": player["value"],
-                    "memory_usage": player["memory_usage"],
-                    "memory_release_active": player.get("memory_release_active", False)
-                }
-                self.broadcast(update_msg)
-
-                return f"成功发射{len(bullets_created)}个子弹，目标为玩家{target_player['username']}"
-            else:
-                return "射程内没有可攻击的目标"
-
-        return "未知技能"
-        
-    def _get_operator_symbol(self, skill_name):
-        symbols = {
-            "AND": "&",
-            "OR": "|",
-            "NOT": "~",
-            "XOR": "^"
-        }
-        return symbols.get(skill_name, "")
-    def _update_bullets(self, delta_time):
-        """更新所有子弹位置并检测碰撞"""
-        bullets_to_remove = []
+            await asyncio.sleep(self._run_rooms())
 
-        for bullet in self.game_state["bullets"]:
-            # 更新子弹位置
-            try:
-                # 处理可能的复数
-                vx = float(bullet["velocity"][0].real) if isinstance(bullet["velocity"][0], complex) else float(bullet["velocity"][0])
-                vy = float(bullet["velocity"][1].real) if isinstance(bullet["velocity"][1], complex) else float(bullet["velocity"][1])
-                
-                # 确保位置也是实数
-                px = float(bullet["position"][0].real) if isinstance(bullet["position"][0], complex) else float(bullet["position"][0])
-                py = float(bullet["position"][1].real) if isinstance(bullet["position"][1], complex) else float(bullet["position"][1])
-                
-                # 更新位置
-                bullet["position"][0] = px + vx * delta_time
-                bullet["position"][1] = py + vy * delta_time
-            except Exception:
-                # 如果出现任何问题，标记子弹移除
-                bullets_to_remove.append(bullet)
-
-            # 检查子弹寿命
-            if time.time() - bullet["created_time"] > 5.0:  # 5秒后子弹消失
-                bullets_to_remove.append(bullet)
-                continue
+    def _start_front(self):
+        # 多进程模式的前端：读取每个连接的connect握手，按房间把socket交给工作进程
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(self.backlog)
+        self.server_socket.setblocking(False)
+        self.pool.start()
+        self.running = True
+        print(f"服务器已启动(前端，{self.pool.count}个工作进程)，监听 {self.host}:{self.port}")
 
-            # 检测与玩家的碰撞
-            bullet_pos = bullet["position"]
-            bullet_owner_id = bullet["owner"]
+        selector = selectors.DefaultSelector()
+        selector.register(self.server_socket, selectors.EVENT_READ, None)
+        for index, channel in enumerate(self.pool.channels):
+            selector.register(channel, selectors.EVENT_READ, index)
+        pending = {}  # {客户端socket: (地址, 已读取的字节, 开始时间)}
+        try:
+            while self.running:
+                for key, _ in selector.select(timeout=0.5):
+                    if key.data is None:
+                        client_socket, client_address = self.server_socket.accept()
+                        client_socket.setblocking(False)
+                        pending[client_socket] = (client_address, bytearray(), time.monotonic())
+                        selector.register(client_socket, selectors.EVENT_READ, client_socket)
+                    elif isinstance(key.data, int):
+                        if not self.pool.read_report(key.data):
+                            selector.unregister(key.fileobj)
+                    else:
+                        self._read_handshake(key.data, pending, selector)
+                # 丢弃迟迟没有完成握手的连接
+                now = time.monotonic()
+                for client_socket, (_, _, since) in list(pending.items()):
+                    if now - since > self.HANDSHAKE_TIMEOUT:
+                        self._drop_pending(client_socket, pending, selector)
+                report = self.pool.report()
+                if report:
+                    print(report)
+        except Exception as e:
+            print(f"服务器错误: {e}")
+        finally:
+            for client_socket in list(pending):
+                self._drop_pending(client_socket, pending, selector)
+            selector.close()
+            self.stop()
 
-            for player_id, player in self.game_state["players"].items():
-                # 不与自己碰撞
-                if player_id == bullet_owner_id:
-                    continue
+    def _drop_pending(self, client_socket, pending, selector):
+        pending.pop(client_socket, None)
+        try:
+            selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass
+        client_socket.close()
 
-                player_pos = player["position"]
-                # 简单的圆形碰撞检测
+    def _read_handshake(self, client_socket, pending, selector):
+        # 读取到完整的connect帧后把socket和已读取的全部字节交给负责该房间的工作进程
+        client_address, data, _ = pending[client_socket]
+        try:
+            received = client_socket.recv(MAX_HANDSHAKE_SIZE - len(data))
+        except BlockingIOError:
+            return
+        except OSError:
+            received = b''
+        if not received:
+            self._drop_pending(client_socket, pending, selector)
+            return
+        data += received
+        if len(data) < FRAME_HEADER_SIZE:
+            return
+        (length,) = FRAME_HEADER.unpack_from(data)
+        if FRAME_HEADER_SIZE + length > MAX_HANDSHAKE_SIZE:
+            print(f"客户端 {client_address} 的握手消息过大")
+            self._drop_pending(client_socket, pending, selector)
+            return
+        if len(data) < FRAME_HEADER_SIZE + length:
+            return
+        try:
+            message = decode_message(data[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + length])
+            if message.get('type') != 'connect':
+                raise FrameError("第一条消息必须是connect握手")
+            room = self._room_name(message, self.pool.placement)
+            client_socket.setblocking(True)
+            self.pool.hand_off(room, next(self.client_ids), client_socket, client_address, bytes(data))
+        except Exception as e:
+            print(f"处理客户端 {client_address} 的握手时出错: {e}")
+        # 工作进程已持有socket的副本，前端关闭自己的副本
+        self._drop_pending(client_socket, pending, selector)
+
+    def serve_worker(self, index, channel):
+        """作为工作进程运行：不监听端口，接收前端交接的客户端并推进本进程的房间"""
+        self.channel = channel
+        self.worker_index = index
+        self._last_load_report = time.monotonic()
+        self.busy_time = 0.0
+        self.running = True
+        if self.io_mode == 'threaded':
+            if self.datagrams is not None:
+                self.datagrams.start_threaded(self.host, 0)
+            game_thread = threading.Thread(target=self.game_loop)
+            game_thread.daemon = True
+            game_thread.start()
+            while self.running:
                 try:
-                    # 确保位置值都是实数
-                    bx = float(bullet_pos[0].real) if isinstance(bullet_pos[0], complex) else float(bullet_pos[0])
-                    by = float(bullet_pos[1].real) if isinstance(bullet_pos[1], complex) else float(bullet_pos[1])
-                    px = float(player_pos[0].real) if isinstance(player_pos[0], complex) else float(player_pos[0])
-                    py = float(player_pos[1].real) if isinstance(player_pos[1], complex) else float(player_pos[1])
-                    distance = math.sqrt(max(0, (bx - px) ** 2 + (by - py) ** 2))
-                except Exception:
-                    # 出现任何错误时使用一个大于碰撞距离的值
-                    distance = 100
-
-                if distance < 20:  # 碰撞距离，可以根据需要调整
-                    # 处理碰撞
-                    damage = bullet["damage"]
-
-                    # 增加被击中玩家的内存使用
-                    player["memory_usage"] += damage
-
-                    # 广播子弹击中消息
-                    hit_msg = {
-                        "type": "bullet_hit",
-                        "bullet_id": bullet["id"],
-                        "target_id": player_id,
-                        "damage": damage,
-                        "position": bullet_pos.copy()
-                    }
-                    self.broadcast(hit_msg)
-
-                    # 更新被击中玩家状态
-                    update_msg = {
-                        "type": "player_value_updated",
-                        "client_id": player_id,
-                        "value": player["value"],
-                        "memory_usage": player["memory_usage"],
-                        "memory_release_active": player.get("memory_release_active", False)
-                    }
-                    self.broadcast(update_msg)
-
-                    # 子弹击中后移除
-                    bullets_to_remove.append(bullet)
+                    received = recv_channel_message(channel)
+                except FrameError as e:
+                    print(f"丢弃无法解析的通道消息: {e}")
+                    continue
+                if received is None:
                     break
+                header, data, fds = received
+                if self._handle_control(header):
+                    continue
+                client_socket = socket.socket(fileno=fds[0])
+                client_address = tuple(header["address"]) if header.get("address") else None
+                client_thread = threading.Thread(target=self.handle_client,
+                                                 args=(client_socket, client_address, header, data))
+                client_thread.daemon = True
+                client_thread.start()
+        else:
+            asyncio.run(self._serve_worker_async(channel))
+
+    async def _serve_worker_async(self, channel):
+        # asyncio模式的工作进程：通道可读时接收交接的socket，客户端IO和房间tick共用一个事件循环
+        loop = asyncio.get_running_loop()
+        closed = loop.create_future()
+        channel.setblocking(False)
+        if self.datagrams is not None:
+            await self.datagrams.start_asyncio(self.host, 0)
+
+        def on_channel_readable():
+            try:
+                received = recv_channel_message(channel)
+            except BlockingIOError:
+                return
+            except FrameError as e:
+                print(f"丢弃无法解析的通道消息: {e}")
+                return
+            if received is None:
+                loop.remove_reader(channel.fileno())
+                if not closed.done():
+                    closed.set_result(None)
+                return
+            header, data, fds = received
+            if self._handle_control(header):
+                return
+            asyncio.ensure_future(self._accept_handoff_async(socket.socket(fileno=fds[0]), header, data))
+
+        loop.add_reader(channel.fileno(), on_channel_readable)
+        game_task = asyncio.ensure_future(self.game_loop_async())
+        try:
+            await closed
+        finally:
+            self.running = False
+            game_task.cancel()
+            if self.datagrams is not None:
+                self.datagrams.close()
+
+    def _handle_control(self, header):
+        """处理前端发来的非交接消息，返回是否已处理"""
+        if header.get("type") == "profile":
+            try:
+                path = profile_path(self.profile_dir, header.get("name"))
+                os.makedirs(self.profile_dir, exist_ok=True)
+            except (ValueError, OSError) as e:
+                print(f"忽略前端的profile命令: {e}")
+                return True
+            self.profiler.start(header.get("duration", 10.0), path)
+            return True
+        return False
+
+    async def _accept_handoff_async(self, client_socket, header, data):
+        client_socket.setblocking(False)
+        reader, writer = await asyncio.open_connection(sock=client_socket)
+        await self.handle_client_async(reader, writer, header, data)
+
+    def _report_load(self):
+        # 工作进程定期向前端回报利用率、各房间的负载和已关闭的房间
+        now = time.monotonic()
+        elapsed = now - self._last_load_report
+        if elapsed < LOAD_REPORT_INTERVAL:
+            return
+        with self.rooms_lock:
+            rooms = [(name, {"players": len(room.clients), "load": self.room_busy.get(name, 0.0) / elapsed})
+                     for name, room in self.rooms.items()]
+        # 房间很多时只列出负载最高的房间，房间数和玩家数另外汇总；已关闭的房间分批回报
+        header = {
+            "type": "load",
+            "utilization": self.busy_time / elapsed,
+            "rooms": dict(sorted(rooms, key=lambda item: -item[1]["load"])[:MAX_REPORTED_ROOMS]),
+            "room_count": len(rooms),
+            "players": sum(room["players"] for _, room in rooms),
+            "closed": self.closed_rooms[:MAX_REPORTED_ROOMS],
+            "metrics": self.metrics.summary()
+        }
+        try:
+            send_channel_message(self.channel, header)
+        except BlockingIOError:
+            # 通道暂时写不进去时跳过本次回报，统计继续累计到下一次
+            return
+        except OSError:
+            self.running = False
+            return
+        self._last_load_report = now
+        self.busy_time = 0.0
+        self.room_busy = {}
+        self.closed_rooms = self.closed_rooms[MAX_REPORTED_ROOMS:]
 
-        # 移除需要删除的子弹
-        for bullet in bullets_to_remove:
-            if bullet in self.game_state["bullets"]:
-                self.game_state["bullets"].remove(bullet)
 
 if __name__ == "__main__":
-    server = GameServer()
+    import argparse
+
+    # 命令行参数解析
+    parser = argparse.ArgumentParser(description="游戏服务器")
+    parser.add_argument("--host", default="localhost", help="服务器主机名")
+    parser.add_argument("--port", type=int, default=5555, help="服务器端口")
+    parser.add_argument("--io-mode", choices=GameServer.IO_MODES, default='asyncio',
+                        help="网络IO模式: asyncio(单事件循环) 或 threaded(每连接一个线程)")
+    parser.add_argument("--view-radius", type=float, default=DEFAULT_VIEW_RADIUS,
+                        help=f"客户端视野半径(建议{SUGGESTED_VIEW_RADIUS})，只同步视野内的实体和事件；默认不限制")
+    parser.add_argument("--tick-rate", type=float, default=DEFAULT_TICK_RATE, help="每秒模拟的tick数")
+    parser.add_argument("--send-rate", type=float, default=DEFAULT_SEND_RATE, help="每秒发送快照的次数")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="房间工作进程数，大于0时本进程只接受连接，房间分布在多个进程中运行")
+    parser.add_argument("--stats-port", type=int,
+                        help="在本机(127.0.0.1)的该端口提供JSON格式的运行指标，默认不开启")
+    parser.add_argument("--input-log", metavar="DIR",
+                        help="把每个房间的输入日志写入该目录，可以用replay.py离线重新模拟，默认不记录")
+    parser.add_argument("--udp", action="store_true",
+                        help="为请求UDP通道的客户端开启UDP端口，玩家位置和快照改为数据报发送")
+    parser.add_argument("--profile-dir", metavar="DIR", default=DEFAULT_PROFILE_DIR,
+                        help="统计端口的profile命令把采样分析结果写入该目录，命令只能指定其中的文件名")
+    args = parser.parse_args()
+
+    server = GameServer(host=args.host, port=args.port, io_mode=args.io_mode,
+                        view_radius=args.view_radius or None,
+                        tick_rate=args.tick_rate, send_rate=args.send_rate, workers=args.workers,
+                        stats_port=args.stats_port, input_log=args.input_log, udp=args.udp,
+                        profile_dir=args.profile_dir)
     try:
         server.start()
     except KeyboardInterrupt:
@@ -0,0 +1,137 @@
+# spatial.py
+# 服务器和客户端共用的均匀网格空间索引
+#
+# 实体按位置放入固定大小的网格单元，范围查询和最近目标查询只检查
+# 覆盖查询区域的单元，距离比较全部使用平方距离，不需要开方。
+# 实体移动时只有跨越单元边界才需要在单元之间移动。
+#
+# 索引不加锁。服务器上只有房间的tick线程修改和查询玩家索引(IO线程只向命令队列追加命令)。
+# 客户端的接收线程在校正预测时会更新自己的位置，主线程查询时对单元内容做快照，
+# 依赖GIL下单个容器操作的原子性。
+
+import heapq
+import math
+
+# 默认单元大小，与技能射程(100~600)和玩家碰撞箱(30)相比取折中值
+DEFAULT_CELL_SIZE = 128
+
+
+class SpatialGrid:
+    """均匀网格空间哈希，存储{实体ID: (x, y)}"""
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self._cells = {}      # {(cx, cy): set(实体ID)}
+        self._entities = {}   # {实体ID: (x, y, (cx, cy))}
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __contains__(self, entity_id):
+        return entity_id in self._entities
+
+    def __iter__(self):
+        return iter(list(self._entities))
+
+    def _cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def update(self, entity_id, x, y):
+        """插入或移动实体，只有跨越单元时才调整单元"""
+        cell = self._cell(x, y)
+        entry = self._entities.get(entity_id)
+        if entry is not None and entry[2] != cell:
+            old_cell = self._cells.get(entry[2])
+            if old_cell is not None:
+                old_cell.discard(entity_id)
+                if not old_cell:
+                    self._cells.pop(entry[2], None)
+        if entry is None or entry[2] != cell:
+            self._cells.setdefault(cell, set()).add(entity_id)
+        self._entities[entity_id] = (x, y, cell)
+
+    def remove(self, entity_id):
+        entry = self._entities.pop(entity_id, None)
+        if entry is None:
+            return
+        cell = self._cells.get(entry[2])
+        if cell is not None:
+            cell.discard(entity_id)
+            if not cell:
+                self._cells.pop(entry[2], None)
+
+    def clear(self):
+        self._cells.clear()
+        self._entities.clear()
+
+    def position(self, entity_id):
+        entry = self._entities.get(entity_id)
+        return (entry[0], entry[1]) if entry is not None else None
+
+    def _scan_cells(self, cells, x, y, radius_sq, exclude, result):
+        # 检查给定单元中的实体，把平方距离不超过radius_sq的(平方距离, 实体ID)加入result
+        for cell in cells:
+            members = self._cells.get(cell)
+            if not members:
+                continue
+            for entity_id in tuple(members):
+                if entity_id == exclude:
+                    continue
+                entry = self._entities.get(entity_id)
+                if entry is None:
+                    continue
+                dx = entry[0] - x
+                dy = entry[1] - y
+                dist_sq = dx * dx + dy * dy
+                if dist_sq <= radius_sq:
+                    result.append((dist_sq, entity_id))
+
+    def query_radius(self, x, y, radius, exclude=None):
+        """返回距离(x, y)不超过radius的[(平方距离, 实体ID)]，不保证顺序"""
+        min_cx, min_cy = self._cell(x - radius, y - radius)
+        max_cx, max_cy = self._cell(x + radius, y + radius)
+        result = []
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self._cells):
+            # 查询范围比已占用的单元还多(例如实体稀疏而半径很大)，只检查已占用的单元
+            cells = [(cx, cy) for cx, cy in tuple(self._cells)
+                     if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy]
+        else:
+            cells = ((cx, cy) for cx in range(min_cx, max_cx + 1) for cy in range(min_cy, max_cy + 1))
+        self._scan_cells(cells, x, y, radius * radius, exclude, result)
+        return result
+
+    def any_within(self, x, y, radius, exclude=None):
+        """是否有实体距离(x, y)不超过radius"""
+        return bool(self.nearest(x, y, 1, radius, exclude))
+
+    def nearest(self, x, y, k=1, max_radius=None, exclude=None):
+        """
+        返回距离(x, y)最近的k个实体[(平方距离, 实体ID)]，按距离从近到远排序
+        从查询点所在单元开始按环向外扩展，已找到k个且更外层的环不可能更近时停止
+        """
+        if not self._entities:
+            return []
+        center_cx, center_cy = self._cell(x, y)
+        radius_sq = max_radius * max_radius if max_radius is not None else float('inf')
+        if max_radius is not None:
+            max_ring = int(max_radius // self.cell_size) + 1
+        else:
+            # 不限半径时扩展到覆盖所有已占用的单元为止
+            max_ring = max((max(abs(cx - center_cx), abs(cy - center_cy)) for cx, cy in tuple(self._cells)), default=0)
+
+        candidates = []
+        for ring in range(max_ring + 1):
+            if ring == 0:
+                cells = [(center_cx, center_cy)]
+            else:
+                cells = [(center_cx + dx, center_cy - ring) for dx in range(-ring, ring + 1)]
+                cells += [(center_cx + dx, center_cy + ring) for dx in range(-ring, ring + 1)]
+                cells += [(center_cx - ring, center_cy + dy) for dy in range(-ring + 1, ring)]
+                cells += [(center_cx + ring, center_cy + dy) for dy in range(-ring + 1, ring)]
+            self._scan_cells(cells, x, y, radius_sq, exclude, candidates)
+            # 更外层单元中的实体距离至少为ring * cell_size
+            if len(candidates) >= k:
+                bound = ring * self.cell_size
+                if heapq.nsmallest(k, candidates)[-1][0] <= bound * bound:
+                    break
+        return heapq.nsmallest(k, candidates)
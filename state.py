@@ -0,0 +1,222 @@
+# state.py
+# 服务器端的版本化游戏状态存储
+#
+# 每次发送快照时提交一个新版本，记录每个实体的每个字段最后一次变化的版本号。
+# 客户端确认收到某个版本后，服务器只需发送该版本之后变化过的字段(增量)，
+# 编码量和带宽与活跃程度成正比，而不是与实体总数成正比。
+
+from collections import deque
+
+# 保留多少个版本的变更记录，客户端确认的版本比这更旧时发送完整关键帧
+DEFAULT_HISTORY = 128
+
+
+def _copy_value(value):
+    # 状态字段只包含标量和由标量组成的列表/元组
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return value
+
+
+class TrackedRecord(dict):
+    """实体记录，字段被赋予不同的值时通知所属的StateStore"""
+
+    def __init__(self, store, key, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._store = store
+        self._key = key
+
+    def __setitem__(self, field, value):
+        if field not in self or self[field] != value:
+            self._store._mark_dirty(self._key, field)
+        super().__setitem__(field, value)
+
+    def update(self, *args, **kwargs):
+        for field, value in dict(*args, **kwargs).items():
+            self[field] = value
+
+
+class TrackedEntities(dict):
+    """实体集合({实体ID: 记录})，记录实体的加入和移除"""
+
+    def __init__(self, store, kind):
+        super().__init__()
+        self._store = store
+        self._kind = kind
+
+    def __setitem__(self, entity_id, record):
+        key = (self._kind, entity_id)
+        super().__setitem__(entity_id, TrackedRecord(self._store, key, record))
+        self._store._mark_created(key)
+
+    def __delitem__(self, entity_id):
+        super().__delitem__(entity_id)
+        self._store._mark_removed((self._kind, entity_id))
+
+
+class StateStore:
+    """
+    版本化的状态存储
+    tracked集合通过TrackedEntities在赋值时记录脏字段；
+    synced集合(例如每帧都在移动的子弹)在提交前用sync()按ID比较加入/移除，
+    并把指定的字段视为每帧都会变化。
+    """
+
+    def __init__(self, history=DEFAULT_HISTORY):
+        self.version = 0
+        self.history = history
+        self._collections = {}      # {kind: {实体ID: 记录}}
+        self._values = {}           # {名称: 全局值的副本}
+        self._field_versions = {}   # {(kind, 实体ID): {字段: 版本}}
+        self._created_versions = {} # {(kind, 实体ID): 版本}
+        self._value_versions = {}   # {名称: 版本}
+        self._dirty = {}            # 本版本内变化的字段 {(kind, 实体ID): set(字段)}
+        self._created = set()
+        self._removed = set()
+        self._changelog = deque()   # [(版本, 变化的实体键集合)]
+        self._removed_log = deque() # [(版本, (kind, 实体ID))]
+        self._changed_cache = {}    # {基准版本: 变化的实体键集合}
+        self._changed_cache_version = 0
+
+    # 变更记录
+
+    def track(self, kind):
+        """创建一个自动记录变化的实体集合"""
+        entities = TrackedEntities(self, kind)
+        self._collections[kind] = entities
+        return entities
+
+    def _mark_dirty(self, key, field):
+        self._dirty.setdefault(key, set()).add(field)
+
+    def _mark_created(self, key):
+        self._created.add(key)
+        self._removed.discard(key)
+
+    def _mark_removed(self, key):
+        self._removed.add(key)
+        self._created.discard(key)
+        self._dirty.pop(key, None)
+
+    def sync(self, kind, records, id_field="id", moving_fields=("position",)):
+        """用当前的记录列表同步一个集合：比较ID得到加入/移除，moving_fields视为已变化"""
+        current = {record[id_field]: record for record in records}
+        previous = self._collections.get(kind, {})
+        for entity_id in current.keys() - previous.keys():
+            self._mark_created((kind, entity_id))
+        for entity_id in previous.keys() - current.keys():
+            self._mark_removed((kind, entity_id))
+        if moving_fields:
+            for entity_id in current.keys() & previous.keys():
+                for field in moving_fields:
+                    self._mark_dirty((kind, entity_id), field)
+        self._collections[kind] = current
+
+    def sync_value(self, name, value):
+        """同步一个全局值(例如进制转换动画列表)，值变化时记录版本"""
+        if name not in self._values or self._values[name] != value:
+            self._values[name] = [dict(item) for item in value] if isinstance(value, list) else value
+            self._value_versions[name] = self.version + 1
+
+    def commit(self):
+        """提交本版本的所有变化，返回新的版本号"""
+        self.version += 1
+        version = self.version
+        changed = set()
+
+        for key, fields in self._dirty.items():
+            stamps = self._field_versions.setdefault(key, {})
+            for field in fields:
+                stamps[field] = version
+            changed.add(key)
+        for key in self._created:
+            self._created_versions[key] = version
+            changed.add(key)
+        for key in self._removed:
+            self._field_versions.pop(key, None)
+            self._created_versions.pop(key, None)
+            self._removed_log.append((version, key))
+            changed.discard(key)
+
+        self._changelog.append((version, changed))
+        self._dirty = {}
+        self._created = set()
+        self._removed = set()
+
+        # 丢弃超出保留范围的变更记录
+        oldest = version - self.history
+        while self._changelog and self._changelog[0][0] <= oldest:
+            self._changelog.popleft()
+        while self._removed_log and self._removed_log[0][0] <= oldest:
+            self._removed_log.popleft()
+        return version
+
+    # 增量生成
+
+    def can_delta(self, base_version):
+        """base_version之后的变更记录是否仍然完整"""
+        return base_version is not None and self.version - self.history <= base_version <= self.version
+
+    def _changed_since(self, base_version):
+        # base_version之后变化过的实体键，同一版本内按基准版本缓存
+        if self._changed_cache_version != self.version:
+            self._changed_cache = {}
+            self._changed_cache_version = self.version
+        if base_version not in self._changed_cache:
+            changed_keys = set()
+            for version, keys_changed in reversed(self._changelog):
+                if version <= base_version:
+                    break
+                changed_keys |= keys_changed
+            self._changed_cache[base_version] = changed_keys
+        return self._changed_cache[base_version]
+
+    def records(self, keys):
+        """返回指定实体的完整记录副本 {kind: {实体ID: 记录}}"""
+        result = {}
+        for kind, entity_id in keys:
+            record = self._collections.get(kind, {}).get(entity_id)
+            if record is not None:
+                result.setdefault(kind, {})[entity_id] = {field: _copy_value(value) for field, value in record.items()}
+        return result
+
+    def delta_since(self, base_version, keys=None):
+        """
+        返回base_version之后的变化：
+        {"changed": {kind: {实体ID: {字段: 值}}}, "removed": {kind: [实体ID]}, "values": {名称: 值}}
+        keys不为None时只包含这些实体键((kind, 实体ID))的变化和移除
+        调用者需保证在此期间状态不会被修改(例如持有游戏锁)
+        """
+        changed_keys = self._changed_since(base_version)
+        if keys is not None:
+            changed_keys = changed_keys & keys
+
+        changed = {}
+        for kind, entity_id in changed_keys:
+            record = self._collections.get(kind, {}).get(entity_id)
+            if record is None:
+                continue
+            key = (kind, entity_id)
+            if self._created_versions.get(key, 0) > base_version:
+                # base之后才创建的实体发送完整记录
+                fields = {field: _copy_value(value) for field, value in record.items()}
+            else:
+                stamps = self._field_versions.get(key, {})
+                fields = {field: _copy_value(record[field]) for field, version in stamps.items()
+                          if version > base_version and field in record}
+            if fields:
+                changed.setdefault(kind, {})[entity_id] = fields
+
+        # 即使实体是在base之后创建的也要发送移除，客户端可能已经收到过它
+        removed = {}
+        for version, (kind, entity_id) in reversed(self._removed_log):
+            if version <= base_version:
+                break
+            if keys is None or (kind, entity_id) in keys:
+                removed.setdefault(kind, []).append(entity_id)
+
+        values = {name: [dict(item) for item in value] if isinstance(value, list) else value
+                  for name, value in self._values.items()
+                  if self._value_versions.get(name, 0) > base_version}
+
+        return {"changed": changed, "removed": removed, "values": values}
@@ -0,0 +1,81 @@
+# timers.py
+# 由游戏tick驱动的哈希时间轮
+#
+# 延迟执行的动作(例如"50毫秒后发送状态更新"、"10秒后结束内存释放"、"5秒后移除子弹")
+# 在安排时按到期tick放入对应的槽位，每个tick只检查当前槽位中的定时器，
+# 不需要每帧扫描所有玩家或子弹。到期时间超过一圈的定时器留在槽位中等待下一圈。
+# 取消只做标记，定时器到期时直接丢弃，因此安排、取消和触发都是O(1)。
+#
+# 时间轮不加锁，只能在tick线程中使用。
+
+import math
+
+# 默认槽位数，30Hz时一圈约17秒，覆盖游戏中所有常用的延迟
+DEFAULT_SLOTS = 512
+
+
+class Timer:
+    """已安排的定时器，可以传给TimerWheel.cancel()取消"""
+    __slots__ = ("deadline", "callback", "args", "cancelled")
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerWheel:
+    """哈希时间轮，每次advance()推进一个tick并执行到期的定时器"""
+
+    def __init__(self, tick_interval, slots=DEFAULT_SLOTS):
+        self.tick_interval = tick_interval
+        self.tick = 0  # 最近一次advance()处理的tick
+        self._slots = [[] for _ in range(slots)]
+        self._count = 0  # 未触发也未取消的定时器数
+
+    def __len__(self):
+        return self._count
+
+    def schedule_ticks(self, ticks, callback, *args):
+        """ticks个tick之后执行callback(*args)，至少在下一个tick执行，返回Timer"""
+        timer = Timer(self.tick + max(1, int(ticks)), callback, args)
+        self._slots[timer.deadline % len(self._slots)].append(timer)
+        self._count += 1
+        return timer
+
+    def schedule(self, delay, callback, *args):
+        """delay秒之后的第一个tick执行callback(*args)，返回Timer"""
+        return self.schedule_ticks(math.ceil(delay / self.tick_interval), callback, *args)
+
+    def cancel(self, timer):
+        if timer is not None and not timer.cancelled:
+            timer.cancelled = True
+            if timer.deadline > self.tick:
+                self._count -= 1
+
+    def advance(self):
+        """推进一个tick，按安排的顺序执行在该tick到期的定时器，返回执行的数量"""
+        self.tick += 1
+        index = self.tick % len(self._slots)
+        bucket = self._slots[index]
+        if not bucket:
+            return 0
+        # 回调中新安排的定时器放入新的列表，不影响本次遍历
+        self._slots[index] = []
+        fired = 0
+        for timer in bucket:
+            if timer.cancelled:
+                continue
+            if timer.deadline > self.tick:
+                # 还要再等若干圈
+                self._slots[index].append(timer)
+                continue
+            self._count -= 1
+            fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                # 单个定时器出错不影响同一槽位中的其他定时器
+                print(f"执行定时器 {getattr(timer.callback, '__name__', timer.callback)} 时出错: {e}")
+        return fired
@@ -0,0 +1,125 @@
+# transport.py
+# 客户端与服务器之间的传输
+#
+# GameClient通过传输对象的open()得到一个流，流只需要三个方法：
+#   sendall(data)  发送已编码的帧
+#   receive()      阻塞直到收到数据，返回完整帧的负载列表；连接关闭时返回None
+#   close()
+# TcpTransport是默认的TCP连接。LoopbackTransport用于服务器和客户端在同一进程中运行的情况
+# (main.py --mode both、基准测试)：服务器发出的帧仍经过连接的发送队列(保留合并和积压上限)，
+# 客户端直接取出帧对象并切出负载，不经过内核，也不复制；客户端发送的字节在调用sendall的线程中
+# 直接交给服务器的帧处理，与threaded模式中每个连接的读线程一样只向房间的命令队列追加命令。
+
+import socket
+import threading
+
+from protocol import FrameBuffer, FRAME_HEADER_SIZE
+from outbound import OutboundQueue, DEFAULT_MAX_PENDING
+
+# 回环连接在服务器日志中显示的客户端地址
+LOOPBACK_ADDRESS = ("loopback", 0)
+
+
+class TcpStream:
+    """TCP连接的客户端一端"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.frames = FrameBuffer()
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def receive(self):
+        # 数据直接接收到帧缓冲区，按长度帧头切分出完整的负载
+        if not self.frames.recv_into(self.sock):
+            return None
+        return list(self.frames.frames())
+
+    def close(self):
+        self.sock.close()
+
+
+class TcpTransport:
+    """默认的TCP传输"""
+    datagrams = True  # 可以在TCP之外协商UDP通道
+
+    def __init__(self, host='localhost', port=5555):
+        self.host = host
+        self.port = port
+
+    def open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((self.host, self.port))
+        return TcpStream(sock)
+
+
+class LoopbackConnection:
+    """回环连接的服务器一端，接口与ThreadedClientConnection相同，帧留在队列中由客户端一端取出"""
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING):
+        self.queue = OutboundQueue(max_pending)
+        # 回环连接不使用UDP通道
+        self.datagram_token = None
+        self.datagram_offer = None
+        self.datagram = None
+
+    def send_frame(self, frame, key=None):
+        return self.queue.put(frame, key)
+
+    def close(self):
+        self.queue.close()
+
+    def abort(self):
+        self.close()
+
+
+class LoopbackStream:
+    """回环连接的客户端一端"""
+
+    def __init__(self, server, connection):
+        self.server = server
+        self.connection = connection
+        self.frames = FrameBuffer()
+        self.client_id = None
+        self.room = None
+        self.closed = False
+        self._lock = threading.Lock()  # 客户端的主线程和接收线程都可能发送
+
+    def sendall(self, data):
+        with self._lock:
+            if self.closed or self.connection.queue.closed or not self.server.running:
+                raise ConnectionResetError("回环连接已关闭")
+            self.frames.feed(data)
+            self.client_id, self.room = self.server._process_frames(self.client_id, self.room, self.connection,
+                                                                    LOOPBACK_ADDRESS, self.frames)
+
+    def receive(self):
+        frames = self.connection.queue.wait_drain()
+        if frames is None:
+            return None
+        # 每一帧是帧头加一个负载，切片不复制帧的内容
+        return [memoryview(frame)[FRAME_HEADER_SIZE:] for frame in frames]
+
+    def close(self):
+        # 与TCP连接的读线程结束时相同，服务器断开(例如积压过多)后客户端关闭时也需要通知房间
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.client_id is not None:
+                self.room.commands.append(("disconnect", self.client_id, None))
+            self.connection.close()
+
+
+class LoopbackTransport:
+    """进程内的回环传输，连接到同一进程中运行的GameServer(不能用于多进程模式)"""
+    datagrams = False
+
+    def __init__(self, server):
+        if server.pool is not None:
+            raise ValueError("多进程模式下房间在工作进程中运行，不能使用回环传输")
+        self.server = server
+
+    def open(self):
+        return LoopbackStream(self.server, LoopbackConnection(self.server.send_queue_limit))
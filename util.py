@@ -0,0 +1,12 @@
+# util.py
+# 机器人、基准测试等工具共用的小函数
+
+import math
+
+
+def percentile(sorted_values, p):
+    """已排序列表的p分位数(最近秩法)，列表为空时返回None"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(p / 100.0 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
@@ -0,0 +1,210 @@
+# workers.py
+# 多进程房间工作进程
+#
+# 一个CPython进程受GIL限制只能用满一个核。多进程模式下前端进程只负责接受连接和读取
+# connect握手，按房间把客户端socket的文件描述符连同已读取的字节交给负责该房间的
+# 工作进程，之后的消息由工作进程直接收发，前端不转发任何消息。
+#
+# 前端和每个工作进程之间有一对保留消息边界的Unix socket(SOCK_SEQPACKET)：
+# 前端发送交接消息(附带文件描述符)，工作进程定期回报负载和已关闭的房间。
+# 每条消息是一个长度帧头的JSON头部，交接消息在头部之后附带客户端已发送的原始字节。
+# 新房间放到负载最低的工作进程，负载由工作进程回报的tick耗时占比决定。
+
+import socket
+import itertools
+import multiprocessing
+import time
+
+from protocol import FRAME_HEADER, FRAME_HEADER_SIZE, FrameError, encode_frame, encode_payload, decode_payload
+
+# 前端最多读取多少字节来等待完整的connect握手
+MAX_HANDSHAKE_SIZE = 64 * 1024
+
+# 单条通道消息的最大字节数(头部 + 交接的原始字节)
+MAX_CHANNEL_MESSAGE = MAX_HANDSHAKE_SIZE + 4096
+
+# 工作进程回报负载的间隔(秒)
+LOAD_REPORT_INTERVAL = 2.0
+
+# 一次负载回报中最多列出的房间数和已关闭的房间数，使回报不超过MAX_CHANNEL_MESSAGE
+MAX_REPORTED_ROOMS = 100
+
+# 前端输出工作进程利用率的间隔(秒)
+UTILIZATION_REPORT_INTERVAL = 10.0
+
+# 两次负载回报之间每放置一个新房间估计增加的利用率，避免新房间全部放到同一个工作进程
+NEW_ROOM_LOAD = 0.02
+
+
+def send_channel_message(channel, header, data=b'', fds=()):
+    """发送一条通道消息，fds中的文件描述符随消息一起传给对端进程"""
+    message = encode_frame(encode_payload(header)) + data
+    if fds:
+        socket.send_fds(channel, [message], list(fds))
+    else:
+        channel.send(message)
+
+
+def recv_channel_message(channel):
+    """
+    接收一条通道消息，返回(头部, 原始字节, 文件描述符列表)，对端关闭时返回None
+    消息被截断或头部无法解析时抛出FrameError，这条消息已从通道中取出，之后的消息不受影响
+    """
+    message, fds, flags, _ = socket.recv_fds(channel, MAX_CHANNEL_MESSAGE, 1)
+    if not message:
+        for fd in fds:
+            socket.close(fd)
+        return None
+    try:
+        if flags & socket.MSG_TRUNC:
+            raise FrameError(f"通道消息超过{MAX_CHANNEL_MESSAGE}字节，已被截断")
+        if len(message) < FRAME_HEADER_SIZE:
+            raise FrameError("通道消息缺少帧头")
+        (length,) = FRAME_HEADER.unpack_from(message)
+        header = decode_payload(message[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + length])
+        if not isinstance(header, dict):
+            raise FrameError("通道消息的头部不是对象")
+    except ValueError as e:
+        for fd in fds:
+            socket.close(fd)
+        if isinstance(e, FrameError):
+            raise
+        raise FrameError(f"无法解析通道消息的头部: {e}") from e
+    return header, message[FRAME_HEADER_SIZE + length:], fds
+
+
+def run_worker(index, channel, options):
+    """工作进程入口：运行一个没有监听socket的GameServer，房间和客户端由前端交接过来"""
+    from server import GameServer
+    server = GameServer(**options)
+    try:
+        server.serve_worker(index, channel)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+class WorkerPool:
+    """前端进程持有的工作进程池，负责房间放置、交接客户端和汇总负载"""
+
+    def __init__(self, count, options):
+        if count <= 0:
+            raise ValueError("工作进程数必须大于0")
+        self.count = count
+        self.options = options  # 传给工作进程中GameServer的参数
+        self.processes = []
+        self.channels = []
+        self.alive = []
+        self.utilization = []  # 每个工作进程最近回报的tick耗时占比
+        self.room_loads = []  # 每个工作进程最近回报的 {房间名: {"players": 玩家数, "load": tick耗时占比}}，最多MAX_REPORTED_ROOMS个
+        self.room_counts = []  # 每个工作进程最近回报的房间总数
+        self.player_counts = []  # 每个工作进程最近回报的玩家总数
+        self.new_rooms = []  # 每个工作进程自上次回报以来新放置的房间数
+        self.metrics = []  # 每个工作进程最近回报的指标摘要
+        self.placement = {}  # {房间名: [工作进程序号, 最近一次交接的序号]}
+        self.handoff_ids = itertools.count(1)
+        self._last_report = time.monotonic()
+
+    def start(self):
+        # 使用spawn启动，工作进程不继承前端的线程和监听socket
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.count):
+            front_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            process = context.Process(target=run_worker, args=(index, worker_end, self.options),
+                                      name=f"room-worker-{index}", daemon=True)
+            process.start()
+            worker_end.close()
+            self.processes.append(process)
+            self.channels.append(front_end)
+            self.alive.append(True)
+            self.utilization.append(0.0)
+            self.room_loads.append({})
+            self.room_counts.append(0)
+            self.player_counts.append(0)
+            self.new_rooms.append(0)
+            self.metrics.append(None)
+        print(f"已启动 {self.count} 个房间工作进程")
+
+    def place(self, room):
+        """返回负责房间的工作进程序号，新房间放到估计负载最低的工作进程"""
+        entry = self.placement.get(room)
+        if entry is not None and self.alive[entry[0]]:
+            return entry[0]
+        candidates = [index for index in range(self.count) if self.alive[index]]
+        if not candidates:
+            raise RuntimeError("没有可用的工作进程")
+        index = min(candidates, key=lambda i: (self.utilization[i] + self.new_rooms[i] * NEW_ROOM_LOAD,
+                                               self.room_counts[i] + self.new_rooms[i]))
+        self.placement[room] = [index, None]
+        self.new_rooms[index] += 1
+        return index
+
+    def hand_off(self, room, client_id, client_socket, client_address, data):
+        """把客户端socket和已读取的字节交给负责房间的工作进程，前端之后不再使用这个socket"""
+        index = self.place(room)
+        handoff_id = next(self.handoff_ids)
+        header = {
+            "type": "handoff",
+            "id": handoff_id,
+            "client_id": client_id,
+            "room": room,
+            "address": list(client_address[:2]) if client_address else None
+        }
+        send_channel_message(self.channels[index], header, data, [client_socket.fileno()])
+        self.placement[room][1] = handoff_id
+        return index
+
+    def read_report(self, index):
+        """读取工作进程的一条回报，工作进程退出时返回False；无法解析的回报被丢弃，不影响前端"""
+        try:
+            received = recv_channel_message(self.channels[index])
+        except FrameError as e:
+            print(f"丢弃房间工作进程 {index} 的回报: {e}")
+            return True
+        if received is None:
+            self.alive[index] = False
+            self.placement = {room: entry for room, entry in self.placement.items() if entry[0] != index}
+            print(f"房间工作进程 {index} 已退出")
+            return False
+        header = received[0]
+        if header.get("type") == "load":
+            self.utilization[index] = header.get("utilization", 0.0)
+            self.room_loads[index] = header.get("rooms", {})
+            self.room_counts[index] = header.get("room_count", len(self.room_loads[index]))
+            self.player_counts[index] = header.get("players", 0)
+            self.new_rooms[index] = 0
+            self.metrics[index] = header.get("metrics")
+            for room, handoff_id in header.get("closed", []):
+                # 关闭之后又有客户端交接过来时，房间会在同一个工作进程中重新创建，放置保持不变
+                entry = self.placement.get(room)
+                if entry is not None and entry[0] == index and entry[1] == handoff_id:
+                    del self.placement[room]
+        return True
+
+    def report(self):
+        """超过输出间隔时返回各工作进程的利用率文本，否则返回None"""
+        now = time.monotonic()
+        if now - self._last_report < UTILIZATION_REPORT_INTERVAL:
+            return None
+        self._last_report = now
+        parts = []
+        for index in range(self.count):
+            if not self.alive[index]:
+                parts.append(f"#{index} 已退出")
+                continue
+            parts.append(f"#{index} {self.utilization[index]:.0%} "
+                         f"({self.room_counts[index]}个房间, {self.player_counts[index]}名玩家)")
+        return "工作进程利用率: " + ", ".join(parts)
+
+    def stop(self):
+        # 关闭通道，工作进程读到EOF后自行退出
+        for channel in self.channels:
+            try:
+                channel.close()
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()